@@ -0,0 +1,39 @@
+-- =============================================
+-- CARTE : index spatial et géométrie synchronisée
+-- =============================================
+-- The map loads only the buildings of the current viewport through
+-- /api/map/buildings (geom && ST_MakeEnvelope(...)), which needs a GiST
+-- index on BATIMENT.geom and geom kept in step with latitude/longitude.
+-- Run after update_schema_table_stracter.sql.
+
+-- 1. geom follows latitude/longitude on every write
+CREATE OR REPLACE FUNCTION trg_batiment_geom()
+RETURNS trigger AS $$
+BEGIN
+    IF NEW.latitude IS NULL OR NEW.longitude IS NULL THEN
+        NEW.geom := NULL;
+    ELSE
+        NEW.geom := ST_SetSRID(ST_MakePoint(NEW.longitude, NEW.latitude), 4326);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS batiment_geom ON BATIMENT;
+CREATE TRIGGER batiment_geom
+BEFORE INSERT OR UPDATE OF latitude, longitude ON BATIMENT
+FOR EACH ROW EXECUTE FUNCTION trg_batiment_geom();
+
+-- 2. Backfill of the rows written before the trigger
+UPDATE BATIMENT
+SET geom = CASE WHEN latitude IS NULL OR longitude IS NULL THEN NULL
+                ELSE ST_SetSRID(ST_MakePoint(longitude, latitude), 4326) END
+WHERE geom IS DISTINCT FROM
+      CASE WHEN latitude IS NULL OR longitude IS NULL THEN NULL
+           ELSE ST_SetSRID(ST_MakePoint(longitude, latitude), 4326) END;
+
+-- 3. Spatial index for the bounding-box queries
+CREATE INDEX IF NOT EXISTS idx_batiment_geom
+ON BATIMENT USING gist (geom);
+
+ANALYZE BATIMENT;
@@ -0,0 +1,110 @@
+-- =============================================
+-- ÉTAT COURANT DES BÂTIMENTS (dernière inspection)
+-- =============================================
+-- One row per inspected building holding its latest inspection, so pages
+-- can read the current state with a plain join instead of a correlated
+-- "ORDER BY date_visite DESC LIMIT 1" subquery per building.
+-- Kept up to date by statement-level triggers on INSPECTION.
+-- Run after mpd.sql and update_schema_table_stracter.sql.
+
+-- 1. Table
+CREATE TABLE IF NOT EXISTS BATIMENT_ETAT_COURANT (
+   code_batiment INT PRIMARY KEY REFERENCES BATIMENT(code_batiment) ON DELETE CASCADE,
+   id_inspect    INT  NOT NULL,
+   date_visite   DATE NOT NULL,
+   etat_constate VARCHAR(50)
+);
+
+-- Used by the state filters and the dashboard group-bys
+CREATE INDEX IF NOT EXISTS idx_etat_courant_etat
+ON BATIMENT_ETAT_COURANT (etat_constate);
+
+
+-- 2. Recompute the current state of a set of buildings
+CREATE OR REPLACE FUNCTION rafraichir_etat_courant(codes INT[])
+RETURNS void AS $$
+BEGIN
+    -- Serialize concurrent writers on the same buildings. NO KEY UPDATE does
+    -- not conflict with the KEY SHARE lock taken by the INSPECTION foreign key.
+    PERFORM 1 FROM BATIMENT
+    WHERE code_batiment = ANY(codes)
+    ORDER BY code_batiment
+    FOR NO KEY UPDATE;
+
+    INSERT INTO BATIMENT_ETAT_COURANT (code_batiment, id_inspect, date_visite, etat_constate)
+    SELECT DISTINCT ON (i.code_batiment)
+           i.code_batiment, i.id_inspect, i.date_visite, i.etat_constate
+    FROM INSPECTION i
+    WHERE i.code_batiment = ANY(codes)
+    ORDER BY i.code_batiment, i.date_visite DESC, i.id_inspect DESC
+    ON CONFLICT (code_batiment) DO UPDATE
+    SET id_inspect    = EXCLUDED.id_inspect,
+        date_visite   = EXCLUDED.date_visite,
+        etat_constate = EXCLUDED.etat_constate;
+
+    -- Buildings whose last inspection was deleted
+    DELETE FROM BATIMENT_ETAT_COURANT ec
+    WHERE ec.code_batiment = ANY(codes)
+      AND NOT EXISTS (SELECT 1 FROM INSPECTION i
+                      WHERE i.code_batiment = ec.code_batiment);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- 3. Triggers (one per event: transition tables allow a single event)
+CREATE OR REPLACE FUNCTION trg_etat_courant_insert()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM rafraichir_etat_courant(ARRAY(SELECT DISTINCT code_batiment FROM nouvelles));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_etat_courant_update()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM rafraichir_etat_courant(ARRAY(
+        SELECT code_batiment FROM nouvelles
+        UNION
+        SELECT code_batiment FROM anciennes));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_etat_courant_delete()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM rafraichir_etat_courant(ARRAY(SELECT DISTINCT code_batiment FROM anciennes));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS etat_courant_insert ON INSPECTION;
+CREATE TRIGGER etat_courant_insert
+AFTER INSERT ON INSPECTION
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT EXECUTE FUNCTION trg_etat_courant_insert();
+
+DROP TRIGGER IF EXISTS etat_courant_update ON INSPECTION;
+CREATE TRIGGER etat_courant_update
+AFTER UPDATE ON INSPECTION
+REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+FOR EACH STATEMENT EXECUTE FUNCTION trg_etat_courant_update();
+
+DROP TRIGGER IF EXISTS etat_courant_delete ON INSPECTION;
+CREATE TRIGGER etat_courant_delete
+AFTER DELETE ON INSPECTION
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT EXECUTE FUNCTION trg_etat_courant_delete();
+
+
+-- 4. Initial fill from the existing inspections
+INSERT INTO BATIMENT_ETAT_COURANT (code_batiment, id_inspect, date_visite, etat_constate)
+SELECT DISTINCT ON (i.code_batiment)
+       i.code_batiment, i.id_inspect, i.date_visite, i.etat_constate
+FROM INSPECTION i
+ORDER BY i.code_batiment, i.date_visite DESC, i.id_inspect DESC
+ON CONFLICT (code_batiment) DO UPDATE
+SET id_inspect    = EXCLUDED.id_inspect,
+    date_visite   = EXCLUDED.date_visite,
+    etat_constate = EXCLUDED.etat_constate;
@@ -0,0 +1,198 @@
+-- =============================================
+-- CARTE : regroupement des bâtiments par zoom (clusters)
+-- =============================================
+-- At low zoom the map shows one feature per grid cell with the number of
+-- buildings and their mix of conservation states, read from
+-- CARTE_GRAPPE by /api/map/clusters instead of sending every point.
+-- The grid is 64 px at each zoom level (4 x 4 cells per 256 px web-mercator
+-- tile), for zoom levels 0 to 16.
+-- Maintained incrementally: CARTE_GRAPPE_MEMBRE records where and in which
+-- state each building is counted, and a change to a building or to its
+-- current state moves its contribution from the old cell to the new one.
+-- Run after update_etat_courant.sql.
+
+-- 1. Tables
+CREATE TABLE IF NOT EXISTS CARTE_GRAPPE (
+   zoom            SMALLINT NOT NULL,
+   cellule_x       INT NOT NULL,
+   cellule_y       INT NOT NULL,
+   nb              INT NOT NULL DEFAULT 0,
+   nb_bon          INT NOT NULL DEFAULT 0,
+   nb_moyen        INT NOT NULL DEFAULT 0,
+   nb_degrade      INT NOT NULL DEFAULT 0,
+   nb_ruine        INT NOT NULL DEFAULT 0,
+   nb_non_inspecte INT NOT NULL DEFAULT 0,
+   somme_lng       DOUBLE PRECISION NOT NULL DEFAULT 0,
+   somme_lat       DOUBLE PRECISION NOT NULL DEFAULT 0,
+   PRIMARY KEY (zoom, cellule_x, cellule_y)
+);
+
+-- Contribution of each geolocated building to the cells (positions are
+-- read from latitude/longitude, which geom is derived from)
+CREATE TABLE IF NOT EXISTS CARTE_GRAPPE_MEMBRE (
+   code_batiment INT PRIMARY KEY,
+   lng           DOUBLE PRECISION NOT NULL,
+   lat           DOUBLE PRECISION NOT NULL,
+   etat          VARCHAR(50)
+);
+
+
+-- 2. Grid cells of a position at every clustered zoom level
+--    (web-mercator tile arithmetic with 4 x 4 cells per tile)
+CREATE OR REPLACE FUNCTION cellules_grappe(p_lng DOUBLE PRECISION, p_lat DOUBLE PRECISION)
+RETURNS TABLE (zoom SMALLINT, cellule_x INT, cellule_y INT) AS $$
+    SELECT z::SMALLINT,
+           floor((p_lng + 180.0) / 360.0 * n)::INT,
+           floor((1.0 - ln(tan(r) + 1.0 / cos(r)) / pi()) / 2.0 * n)::INT
+    FROM generate_series(0, 16) AS z
+    CROSS JOIN LATERAL (SELECT 4 * 2 ^ z AS n,
+                               radians(greatest(least(p_lat, 85.0511), -85.0511)) AS r) t;
+$$ LANGUAGE sql IMMUTABLE;
+
+
+-- 3. Move the contributions of a set of buildings to their current cells
+CREATE OR REPLACE FUNCTION rafraichir_grappes(codes INT[])
+RETURNS void AS $$
+BEGIN
+    -- Writers of the same buildings are already serialized by the row
+    -- locks of BATIMENT; this covers direct calls.
+    PERFORM 1 FROM CARTE_GRAPPE_MEMBRE
+    WHERE code_batiment = ANY(codes)
+    ORDER BY code_batiment
+    FOR UPDATE;
+
+    IF to_regclass('pg_temp.grappe_delta') IS NULL THEN
+        CREATE TEMP TABLE grappe_delta (
+            code_batiment INT, lng DOUBLE PRECISION, lat DOUBLE PRECISION,
+            etat VARCHAR(50), signe INT
+        ) ON COMMIT DROP;
+    ELSE
+        TRUNCATE grappe_delta;
+    END IF;
+
+    -- Old contribution (-1) and new one (+1), only for buildings that moved
+    -- or changed state
+    WITH nouveau AS (
+        SELECT b.code_batiment, b.longitude::DOUBLE PRECISION AS lng,
+               b.latitude::DOUBLE PRECISION AS lat, ec.etat_constate AS etat
+        FROM BATIMENT b
+        LEFT JOIN BATIMENT_ETAT_COURANT ec ON b.code_batiment = ec.code_batiment
+        WHERE b.code_batiment = ANY(codes)
+          AND b.latitude IS NOT NULL AND b.longitude IS NOT NULL
+    ),
+    ancien AS (
+        SELECT code_batiment, lng, lat, etat
+        FROM CARTE_GRAPPE_MEMBRE
+        WHERE code_batiment = ANY(codes)
+    ),
+    change AS (
+        SELECT a.code_batiment AS ancien_code, a.lng AS ancien_lng, a.lat AS ancien_lat, a.etat AS ancien_etat,
+               n.code_batiment AS nouveau_code, n.lng, n.lat, n.etat
+        FROM ancien a
+        FULL JOIN nouveau n ON a.code_batiment = n.code_batiment
+        WHERE a.code_batiment IS NULL OR n.code_batiment IS NULL
+           OR (a.lng, a.lat, a.etat) IS DISTINCT FROM (n.lng, n.lat, n.etat)
+    )
+    INSERT INTO grappe_delta
+    SELECT ancien_code, ancien_lng, ancien_lat, ancien_etat, -1 FROM change WHERE ancien_code IS NOT NULL
+    UNION ALL
+    SELECT nouveau_code, lng, lat, etat, 1 FROM change WHERE nouveau_code IS NOT NULL;
+
+    -- Cells updated in key order so concurrent writers cannot deadlock
+    INSERT INTO CARTE_GRAPPE AS g (zoom, cellule_x, cellule_y, nb, nb_bon, nb_moyen,
+                                   nb_degrade, nb_ruine, nb_non_inspecte, somme_lng, somme_lat)
+    SELECT c.zoom, c.cellule_x, c.cellule_y,
+           SUM(d.signe),
+           COALESCE(SUM(d.signe) FILTER (WHERE d.etat = 'Bon'), 0),
+           COALESCE(SUM(d.signe) FILTER (WHERE d.etat = 'Moyen'), 0),
+           COALESCE(SUM(d.signe) FILTER (WHERE d.etat = 'Dégradé'), 0),
+           COALESCE(SUM(d.signe) FILTER (WHERE d.etat = 'En ruine'), 0),
+           COALESCE(SUM(d.signe) FILTER (WHERE d.etat IS NULL), 0),
+           SUM(d.signe * d.lng), SUM(d.signe * d.lat)
+    FROM grappe_delta d
+    CROSS JOIN LATERAL cellules_grappe(d.lng, d.lat) c
+    GROUP BY c.zoom, c.cellule_x, c.cellule_y
+    ORDER BY c.zoom, c.cellule_x, c.cellule_y
+    ON CONFLICT (zoom, cellule_x, cellule_y) DO UPDATE
+    SET nb              = g.nb + EXCLUDED.nb,
+        nb_bon          = g.nb_bon + EXCLUDED.nb_bon,
+        nb_moyen        = g.nb_moyen + EXCLUDED.nb_moyen,
+        nb_degrade      = g.nb_degrade + EXCLUDED.nb_degrade,
+        nb_ruine        = g.nb_ruine + EXCLUDED.nb_ruine,
+        nb_non_inspecte = g.nb_non_inspecte + EXCLUDED.nb_non_inspecte,
+        somme_lng       = g.somme_lng + EXCLUDED.somme_lng,
+        somme_lat       = g.somme_lat + EXCLUDED.somme_lat;
+
+    DELETE FROM CARTE_GRAPPE WHERE nb <= 0
+      AND (zoom, cellule_x, cellule_y) IN (
+          SELECT c.zoom, c.cellule_x, c.cellule_y
+          FROM grappe_delta d CROSS JOIN LATERAL cellules_grappe(d.lng, d.lat) c
+          WHERE d.signe < 0);
+
+    DELETE FROM CARTE_GRAPPE_MEMBRE
+    WHERE code_batiment IN (SELECT code_batiment FROM grappe_delta WHERE signe < 0);
+    INSERT INTO CARTE_GRAPPE_MEMBRE (code_batiment, lng, lat, etat)
+    SELECT code_batiment, lng, lat, etat FROM grappe_delta WHERE signe > 0;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- 4. Triggers (one per event: transition tables allow a single event)
+CREATE OR REPLACE FUNCTION trg_grappes_nouvelles()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM rafraichir_grappes(ARRAY(SELECT DISTINCT code_batiment FROM nouvelles));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_grappes_anciennes()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM rafraichir_grappes(ARRAY(SELECT DISTINCT code_batiment FROM anciennes));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS grappes_batiment_insert ON BATIMENT;
+CREATE TRIGGER grappes_batiment_insert
+AFTER INSERT ON BATIMENT
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT EXECUTE FUNCTION trg_grappes_nouvelles();
+
+DROP TRIGGER IF EXISTS grappes_batiment_update ON BATIMENT;
+CREATE TRIGGER grappes_batiment_update
+AFTER UPDATE ON BATIMENT
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT EXECUTE FUNCTION trg_grappes_nouvelles();
+
+DROP TRIGGER IF EXISTS grappes_batiment_delete ON BATIMENT;
+CREATE TRIGGER grappes_batiment_delete
+AFTER DELETE ON BATIMENT
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT EXECUTE FUNCTION trg_grappes_anciennes();
+
+DROP TRIGGER IF EXISTS grappes_etat_insert ON BATIMENT_ETAT_COURANT;
+CREATE TRIGGER grappes_etat_insert
+AFTER INSERT ON BATIMENT_ETAT_COURANT
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT EXECUTE FUNCTION trg_grappes_nouvelles();
+
+DROP TRIGGER IF EXISTS grappes_etat_update ON BATIMENT_ETAT_COURANT;
+CREATE TRIGGER grappes_etat_update
+AFTER UPDATE ON BATIMENT_ETAT_COURANT
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT EXECUTE FUNCTION trg_grappes_nouvelles();
+
+DROP TRIGGER IF EXISTS grappes_etat_delete ON BATIMENT_ETAT_COURANT;
+CREATE TRIGGER grappes_etat_delete
+AFTER DELETE ON BATIMENT_ETAT_COURANT
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT EXECUTE FUNCTION trg_grappes_anciennes();
+
+
+-- 5. Initial computation
+TRUNCATE CARTE_GRAPPE, CARTE_GRAPPE_MEMBRE;
+SELECT rafraichir_grappes(ARRAY(SELECT code_batiment FROM BATIMENT
+                               WHERE latitude IS NOT NULL AND longitude IS NOT NULL));
+ANALYZE CARTE_GRAPPE;
@@ -0,0 +1,312 @@
+-- =============================================
+-- IMPORT : chargement en masse (CSV / GeoJSON)
+-- =============================================
+-- `flask import` and the /imports page stream a file with COPY into the
+-- staging tables below (every value as text, so COPY never rejects a row),
+-- then one function per kind validates the whole batch set-wise, records
+-- the errors of each rejected line in IMPORT_ERREUR and inserts the valid
+-- lines in a single statement.
+-- Inspections and interventions name their building by code_batiment or
+-- by ref_batiment, the building's reference in the source system
+-- (BATIMENT.ref_externe), so a new city's buildings and their histories
+-- can be loaded from the same export.
+-- Needs PostgreSQL 16 (pg_input_is_valid). Run after update_carte.sql.
+
+-- 1. Source reference of imported buildings
+ALTER TABLE BATIMENT ADD COLUMN IF NOT EXISTS ref_externe VARCHAR(100);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_batiment_ref_externe ON BATIMENT (ref_externe);
+
+
+-- 2. Batches, staging tables and errors
+CREATE TABLE IF NOT EXISTS IMPORT_LOT (
+   id_lot       SERIAL PRIMARY KEY,
+   type_lot     VARCHAR(20) NOT NULL CHECK (type_lot IN ('batiment', 'inspection', 'intervention')),
+   fichier      VARCHAR(255),
+   cree_le      TIMESTAMPTZ NOT NULL DEFAULT now(),
+   nb_lignes    INT NOT NULL DEFAULT 0,
+   nb_importees INT NOT NULL DEFAULT 0,
+   nb_rejetees  INT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS IMPORT_ERREUR (
+   id_lot  INT NOT NULL REFERENCES IMPORT_LOT(id_lot) ON DELETE CASCADE,
+   ligne   INT NOT NULL,
+   colonne VARCHAR(50),
+   message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_import_erreur_lot ON IMPORT_ERREUR (id_lot, ligne);
+
+-- Emptied at the end of every batch: unlogged, nothing to recover
+CREATE UNLOGGED TABLE IF NOT EXISTS IMPORT_BATIMENT (
+   id_lot            INT NOT NULL,
+   ligne             INT NOT NULL,
+   ref_externe       TEXT,
+   nom_batiment      TEXT,
+   adresse_rue       TEXT,
+   latitude          TEXT,
+   longitude         TEXT,
+   date_construction TEXT,
+   note_historique   TEXT,
+   id_zone           TEXT,
+   id_type           TEXT,
+   id_protection     TEXT,
+   id_proprio        TEXT,
+   PRIMARY KEY (id_lot, ligne)
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS IMPORT_INSPECTION (
+   id_lot        INT NOT NULL,
+   ligne         INT NOT NULL,
+   code_batiment TEXT,
+   ref_batiment  TEXT,
+   date_visite   TEXT,
+   etat_constate TEXT,
+   rapport       TEXT,
+   code_resolu   INT,
+   PRIMARY KEY (id_lot, ligne)
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS IMPORT_INTERVENTION (
+   id_lot         INT NOT NULL,
+   ligne          INT NOT NULL,
+   code_batiment  TEXT,
+   ref_batiment   TEXT,
+   date_debut     TEXT,
+   date_fin       TEXT,
+   type_travaux   TEXT,
+   cout_estime    TEXT,
+   est_validee    TEXT,
+   statut_travaux TEXT,
+   id_prestataire TEXT,
+   code_resolu    INT,
+   PRIMARY KEY (id_lot, ligne)
+);
+
+
+-- 3. geom is computed set-wise by the building import: the row trigger of
+--    update_carte.sql now only runs for inserts that come without one
+DROP TRIGGER IF EXISTS batiment_geom ON BATIMENT;
+
+DROP TRIGGER IF EXISTS batiment_geom_insert ON BATIMENT;
+CREATE TRIGGER batiment_geom_insert
+BEFORE INSERT ON BATIMENT
+FOR EACH ROW WHEN (NEW.geom IS NULL)
+EXECUTE FUNCTION trg_batiment_geom();
+
+DROP TRIGGER IF EXISTS batiment_geom_update ON BATIMENT;
+CREATE TRIGGER batiment_geom_update
+BEFORE UPDATE OF latitude, longitude ON BATIMENT
+FOR EACH ROW EXECUTE FUNCTION trg_batiment_geom();
+
+
+-- 4. Closes a batch: counts, staging rows dropped
+CREATE OR REPLACE FUNCTION terminer_import(p_lot INT, p_lignes INT, p_importees INT)
+RETURNS INT AS $$
+    UPDATE IMPORT_LOT
+    SET nb_lignes = p_lignes,
+        nb_importees = p_importees,
+        nb_rejetees = (SELECT COUNT(DISTINCT ligne) FROM IMPORT_ERREUR WHERE id_lot = p_lot)
+    WHERE id_lot = p_lot;
+    DELETE FROM IMPORT_BATIMENT WHERE id_lot = p_lot;
+    DELETE FROM IMPORT_INSPECTION WHERE id_lot = p_lot;
+    DELETE FROM IMPORT_INTERVENTION WHERE id_lot = p_lot;
+    SELECT p_importees;
+$$ LANGUAGE sql;
+
+
+-- 5. Buildings
+CREATE OR REPLACE FUNCTION importer_batiments(p_lot INT)
+RETURNS INT AS $$
+DECLARE
+    lignes INT;
+    importees INT;
+BEGIN
+    SELECT COUNT(*) INTO lignes FROM IMPORT_BATIMENT WHERE id_lot = p_lot;
+
+    INSERT INTO IMPORT_ERREUR (id_lot, ligne, colonne, message)
+    SELECT p_lot, s.ligne, e.colonne, e.message
+    FROM (SELECT *, COUNT(*) OVER (PARTITION BY ref_externe) AS nb_ref
+          FROM IMPORT_BATIMENT WHERE id_lot = p_lot) s
+    CROSS JOIN LATERAL (VALUES
+        ('ref_externe', CASE
+            WHEN length(s.ref_externe) > 100 THEN 'plus de 100 caractères'
+            WHEN s.ref_externe IS NOT NULL AND s.nb_ref > 1 THEN 'référence en double dans le fichier'
+            WHEN s.ref_externe IN (SELECT ref_externe FROM BATIMENT WHERE ref_externe IS NOT NULL)
+                THEN 'référence déjà importée' END),
+        ('nom_batiment', CASE
+            WHEN s.nom_batiment IS NULL THEN 'valeur obligatoire'
+            WHEN length(s.nom_batiment) > 150 THEN 'plus de 150 caractères' END),
+        ('adresse_rue', CASE
+            WHEN length(s.adresse_rue) > 255 THEN 'plus de 255 caractères' END),
+        ('latitude', CASE
+            WHEN NOT pg_input_is_valid(s.latitude, 'numeric') THEN 'nombre attendu'
+            WHEN s.latitude::NUMERIC NOT BETWEEN -90 AND 90 THEN 'hors de [-90, 90]'
+            WHEN s.latitude IS NOT NULL AND s.longitude IS NULL THEN 'longitude manquante' END),
+        ('longitude', CASE
+            WHEN NOT pg_input_is_valid(s.longitude, 'numeric') THEN 'nombre attendu'
+            WHEN s.longitude::NUMERIC NOT BETWEEN -180 AND 180 THEN 'hors de [-180, 180]'
+            WHEN s.longitude IS NOT NULL AND s.latitude IS NULL THEN 'latitude manquante' END),
+        ('date_construction', CASE
+            WHEN NOT pg_input_is_valid(s.date_construction, 'date') THEN 'date attendue (AAAA-MM-JJ)' END),
+        ('id_zone', CASE
+            WHEN NOT pg_input_is_valid(s.id_zone, 'integer') THEN 'entier attendu'
+            WHEN s.id_zone::INT NOT IN (SELECT id_zone FROM ZONE_URBAINE) THEN 'zone inconnue' END),
+        ('id_type', CASE
+            WHEN NOT pg_input_is_valid(s.id_type, 'integer') THEN 'entier attendu'
+            WHEN s.id_type::INT NOT IN (SELECT id_type FROM TYPE_BATIMENT) THEN 'type inconnu' END),
+        ('id_protection', CASE
+            WHEN NOT pg_input_is_valid(s.id_protection, 'integer') THEN 'entier attendu'
+            WHEN s.id_protection::INT NOT IN (SELECT id_protection FROM NIV_PROTECTION)
+                THEN 'niveau de protection inconnu' END),
+        ('id_proprio', CASE
+            WHEN NOT pg_input_is_valid(s.id_proprio, 'integer') THEN 'entier attendu'
+            WHEN s.id_proprio::INT NOT IN (SELECT id_proprio FROM PROPRIETAIRE) THEN 'propriétaire inconnu' END)
+    ) e(colonne, message)
+    WHERE e.message IS NOT NULL;
+
+    INSERT INTO BATIMENT (ref_externe, nom_batiment, adresse_rue, latitude, longitude,
+                          date_construction, note_historique, id_zone, id_type,
+                          id_protection, id_proprio, geom)
+    SELECT s.ref_externe, s.nom_batiment, s.adresse_rue,
+           s.latitude::DECIMAL(9,6), s.longitude::DECIMAL(9,6),
+           s.date_construction::DATE, s.note_historique, s.id_zone::INT, s.id_type::INT,
+           s.id_protection::INT, s.id_proprio::INT,
+           ST_SetSRID(ST_MakePoint(s.longitude::DECIMAL(9,6), s.latitude::DECIMAL(9,6)), 4326)
+    FROM IMPORT_BATIMENT s
+    WHERE s.id_lot = p_lot
+      AND NOT EXISTS (SELECT 1 FROM IMPORT_ERREUR e WHERE e.id_lot = p_lot AND e.ligne = s.ligne)
+    ORDER BY s.ligne;
+    GET DIAGNOSTICS importees = ROW_COUNT;
+
+    RETURN terminer_import(p_lot, lignes, importees);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- 6. Building of an inspection or intervention line, by code or by reference
+CREATE OR REPLACE FUNCTION erreur_batiment_import(p_code TEXT, p_ref TEXT, p_resolu INT)
+RETURNS TEXT AS $$
+    SELECT CASE
+        WHEN p_code IS NULL AND p_ref IS NULL THEN 'code_batiment ou ref_batiment obligatoire'
+        WHEN NOT pg_input_is_valid(p_code, 'integer') THEN 'entier attendu'
+        WHEN p_resolu IS NULL AND p_code IS NOT NULL THEN 'bâtiment inconnu'
+        WHEN p_resolu IS NULL THEN 'référence de bâtiment inconnue' END;
+$$ LANGUAGE sql IMMUTABLE;
+
+
+-- 7. Inspections
+CREATE OR REPLACE FUNCTION importer_inspections(p_lot INT)
+RETURNS INT AS $$
+DECLARE
+    lignes INT;
+    importees INT;
+BEGIN
+    SELECT COUNT(*) INTO lignes FROM IMPORT_INSPECTION WHERE id_lot = p_lot;
+
+    UPDATE IMPORT_INSPECTION s
+    SET code_resolu = b.code_batiment
+    FROM BATIMENT b
+    WHERE s.id_lot = p_lot AND s.code_batiment IS NOT NULL
+      AND b.code_batiment = CASE WHEN pg_input_is_valid(s.code_batiment, 'integer')
+                                 THEN s.code_batiment::INT END;
+
+    UPDATE IMPORT_INSPECTION s
+    SET code_resolu = b.code_batiment
+    FROM BATIMENT b
+    WHERE s.id_lot = p_lot AND s.code_batiment IS NULL
+      AND b.ref_externe = s.ref_batiment;
+
+    INSERT INTO IMPORT_ERREUR (id_lot, ligne, colonne, message)
+    SELECT p_lot, s.ligne, e.colonne, e.message
+    FROM IMPORT_INSPECTION s
+    CROSS JOIN LATERAL (VALUES
+        (CASE WHEN s.code_batiment IS NULL THEN 'ref_batiment' ELSE 'code_batiment' END,
+         erreur_batiment_import(s.code_batiment, s.ref_batiment, s.code_resolu)),
+        ('date_visite', CASE
+            WHEN s.date_visite IS NULL THEN 'valeur obligatoire'
+            WHEN NOT pg_input_is_valid(s.date_visite, 'date') THEN 'date attendue (AAAA-MM-JJ)' END),
+        -- Same values as the chk_etat_constate constraint
+        ('etat_constate', CASE
+            WHEN s.etat_constate NOT IN ('Bon', 'Moyen', 'Dégradé', 'En ruine')
+                THEN 'état invalide (Bon, Moyen, Dégradé ou En ruine)' END)
+    ) e(colonne, message)
+    WHERE s.id_lot = p_lot AND e.message IS NOT NULL;
+
+    INSERT INTO INSPECTION (date_visite, rapport, etat_constate, code_batiment)
+    SELECT s.date_visite::DATE, s.rapport, s.etat_constate, s.code_resolu
+    FROM IMPORT_INSPECTION s
+    WHERE s.id_lot = p_lot
+      AND NOT EXISTS (SELECT 1 FROM IMPORT_ERREUR e WHERE e.id_lot = p_lot AND e.ligne = s.ligne)
+    ORDER BY s.ligne;
+    GET DIAGNOSTICS importees = ROW_COUNT;
+
+    RETURN terminer_import(p_lot, lignes, importees);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- 8. Interventions
+CREATE OR REPLACE FUNCTION importer_interventions(p_lot INT)
+RETURNS INT AS $$
+DECLARE
+    lignes INT;
+    importees INT;
+BEGIN
+    SELECT COUNT(*) INTO lignes FROM IMPORT_INTERVENTION WHERE id_lot = p_lot;
+
+    UPDATE IMPORT_INTERVENTION s
+    SET code_resolu = b.code_batiment
+    FROM BATIMENT b
+    WHERE s.id_lot = p_lot AND s.code_batiment IS NOT NULL
+      AND b.code_batiment = CASE WHEN pg_input_is_valid(s.code_batiment, 'integer')
+                                 THEN s.code_batiment::INT END;
+
+    UPDATE IMPORT_INTERVENTION s
+    SET code_resolu = b.code_batiment
+    FROM BATIMENT b
+    WHERE s.id_lot = p_lot AND s.code_batiment IS NULL
+      AND b.ref_externe = s.ref_batiment;
+
+    INSERT INTO IMPORT_ERREUR (id_lot, ligne, colonne, message)
+    SELECT p_lot, s.ligne, e.colonne, e.message
+    FROM IMPORT_INTERVENTION s
+    CROSS JOIN LATERAL (VALUES
+        (CASE WHEN s.code_batiment IS NULL THEN 'ref_batiment' ELSE 'code_batiment' END,
+         erreur_batiment_import(s.code_batiment, s.ref_batiment, s.code_resolu)),
+        ('id_prestataire', CASE
+            WHEN s.id_prestataire IS NULL THEN 'valeur obligatoire'
+            WHEN NOT pg_input_is_valid(s.id_prestataire, 'integer') THEN 'entier attendu'
+            WHEN s.id_prestataire::INT NOT IN (SELECT id_prestataire FROM PRESTATAIRE)
+                THEN 'prestataire inconnu' END),
+        ('date_debut', CASE
+            WHEN NOT pg_input_is_valid(s.date_debut, 'date') THEN 'date attendue (AAAA-MM-JJ)' END),
+        ('date_fin', CASE
+            WHEN NOT pg_input_is_valid(s.date_fin, 'date') THEN 'date attendue (AAAA-MM-JJ)'
+            WHEN CASE WHEN pg_input_is_valid(s.date_debut, 'date')
+                      THEN s.date_fin::DATE < s.date_debut::DATE END THEN 'antérieure à date_debut' END),
+        ('type_travaux', CASE
+            WHEN length(s.type_travaux) > 255 THEN 'plus de 255 caractères' END),
+        ('cout_estime', CASE
+            WHEN NOT pg_input_is_valid(s.cout_estime, 'numeric(12,2)') THEN 'montant invalide'
+            WHEN s.cout_estime::NUMERIC < 0 THEN 'montant négatif' END),
+        ('est_validee', CASE
+            WHEN NOT pg_input_is_valid(s.est_validee, 'boolean') THEN 'booléen attendu (true/false)' END),
+        ('statut_travaux', CASE
+            WHEN length(s.statut_travaux) > 50 THEN 'plus de 50 caractères' END)
+    ) e(colonne, message)
+    WHERE s.id_lot = p_lot AND e.message IS NOT NULL;
+
+    INSERT INTO INTERVENTION (date_debut, date_fin, type_travaux, cout_estime, est_validee,
+                              statut_travaux, code_batiment, id_prestataire)
+    SELECT s.date_debut::DATE, s.date_fin::DATE, s.type_travaux, s.cout_estime::DECIMAL(12,2),
+           COALESCE(s.est_validee::BOOLEAN, FALSE), COALESCE(s.statut_travaux, 'Planifié'),
+           s.code_resolu, s.id_prestataire::INT
+    FROM IMPORT_INTERVENTION s
+    WHERE s.id_lot = p_lot
+      AND NOT EXISTS (SELECT 1 FROM IMPORT_ERREUR e WHERE e.id_lot = p_lot AND e.ligne = s.ligne)
+    ORDER BY s.ligne;
+    GET DIAGNOSTICS importees = ROW_COUNT;
+
+    RETURN terminer_import(p_lot, lignes, importees);
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,91 @@
+-- =============================================
+-- INDEX : clés étrangères et colonnes de tri des pages
+-- =============================================
+-- mpd.sql only creates the primary keys. These indexes cover the foreign
+-- keys and sort keys the lists, detail pages and triggers filter on.
+-- Built CONCURRENTLY so the script can run on a live database without
+-- blocking writes: run it with plain psql (autocommit), not with -1 /
+-- --single-transaction, which CONCURRENTLY refuses.
+-- A build that fails (deadlock, cancel) leaves an INVALID index that
+-- IF NOT EXISTS would then skip; list them with
+--   SELECT indexrelid::regclass FROM pg_index WHERE NOT indisvalid;
+-- drop them with DROP INDEX CONCURRENTLY and run the script again.
+--
+-- Database time per page, before -> after: median of the Server-Timing
+-- db value on `flask bench seed --buildings 100k` (186k inspections,
+-- 86k interventions, 77k documents), reference data cache on.
+-- `flask bench plans` (plan_expectations.json) fails when a page stops
+-- using them.
+
+-- 1. INSPECTION
+-- Inspections of a building, newest first: list filtered by building,
+-- building file, and the DISTINCT ON of the BATIMENT_ETAT_COURANT triggers.
+--   /inspections/?building=     29.9 ms -> 1.0 ms
+--   /buildings/view/            29.9 ms -> 1.6 ms  (with the two below)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inspection_batiment_date
+    ON INSPECTION (code_batiment, date_visite DESC, id_inspect DESC);
+
+-- Keyset order of the inspection list: a page reads 51 index entries
+-- instead of sorting the table. Also serves the date range filter.
+--   /inspections/              132.6 ms -> 2.0 ms
+--   /inspections/?etat=         40.2 ms -> 2.2 ms
+--   /inspections/?date_from=    35.2 ms -> 2.8 ms
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inspection_date
+    ON INSPECTION (date_visite DESC, id_inspect DESC);
+
+-- 2. INTERVENTION
+-- Keyset order of the intervention list (undated works first, as in
+-- INTERVENTIONS_KEYSET).
+--   /interventions/             71.2 ms -> 2.4 ms
+--   /interventions/?statut=     17.2 ms -> 5.2 ms
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_intervention_tri
+    ON INTERVENTION ((COALESCE(date_debut, DATE '9999-12-31')) DESC, id_interv DESC);
+
+-- Same order, restricted to the interventions awaiting validation. The
+-- validated=no filter repeats this predicate word for word, which lets
+-- the planner prove it and use the partial index. 776 kB instead of
+-- 1.9 MB; with 40 % of unvalidated rows in the synthetic data it is only
+-- a little faster than idx_intervention_tri (5.3 ms vs 5.8 ms for the
+-- statement), the gap grows as validated works pile up.
+--   /interventions/?validated=no&statut=Terminé  19.3 ms -> 8.3 ms
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_intervention_non_validee
+    ON INTERVENTION ((COALESCE(date_debut, DATE '9999-12-31')) DESC, id_interv DESC)
+    WHERE est_validee = FALSE OR est_validee IS NULL;
+
+-- Interventions of a building: list filter and building file.
+--   /interventions/?building=    7.2 ms -> 1.6 ms
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_intervention_batiment_date
+    ON INTERVENTION (code_batiment, date_debut DESC, id_interv DESC);
+
+-- Works of a contractor: list filter, statistics of the contractor page,
+-- delete check. The page's own list keeps a parallel seq scan at this
+-- size (about 860 rows joined to BATIMENT), 20 ms either way.
+--   /interventions/?prestataire= 13.2 ms -> 3.8 ms
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_intervention_prestataire_date
+    ON INTERVENTION (id_prestataire, date_debut DESC);
+
+-- 3. DOCUMENT_MEDIA
+-- Documents of a building, newest first.
+--   /documents/building/         4.4 ms -> 0.5 ms
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_document_batiment
+    ON DOCUMENT_MEDIA (code_batiment, id_doc DESC);
+
+-- 4. BATIMENT
+-- Buildings of a zone, type or owner, sorted by name: detail pages of the
+-- reference data, list filters, delete checks.
+--   /zones/view/                61.5 ms -> 10.7 ms
+--   /types/view/                79.5 ms -> 39.0 ms
+--   /proprietaires/view/        10.7 ms -> 1.3 ms
+-- They add about 2 ms of planning to the six-table join of the building
+-- list (3.6 ms -> 5.6 ms), which has more join orders to weigh.
+-- No index on id_protection: with 5 levels each one holds 4 to 43 % of
+-- the buildings and the planner keeps the seq scan (/protections/view/
+-- 78.5 ms with or without it).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_batiment_zone ON BATIMENT (id_zone, nom_batiment);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_batiment_type ON BATIMENT (id_type, nom_batiment);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_batiment_proprio ON BATIMENT (id_proprio, nom_batiment);
+
+ANALYZE INSPECTION;
+ANALYZE INTERVENTION;
+ANALYZE DOCUMENT_MEDIA;
+ANALYZE BATIMENT;
@@ -0,0 +1,26 @@
+-- =============================================
+-- PROXIMITÉ : bâtiments les plus proches d'un point
+-- =============================================
+-- /api/buildings/near orders the buildings by distance to the inspector's
+-- position with the KNN operator (b.geom::geography <-> point) and, with a
+-- radius, filters them with ST_DWithin on geography (metres). Both are
+-- answered by this GiST index on the geography of geom: the index scan
+-- returns the nearest buildings first and stops after LIMIT rows, instead
+-- of computing the distance to every building.
+-- Built CONCURRENTLY: run with plain psql, outside a transaction.
+--
+-- Timing: not measured yet. The query has not run on PostGIS, so the
+-- KNN latency on a million buildings is unknown. The plan rules of its
+-- two statements in plan_expectations.json (5c273fb59804 and
+-- 60720e65c910, "require: using idx_batiment_geog") were written by hand,
+-- not recorded from EXPLAIN. To measure on PostGIS:
+--   flask bench seed --buildings 1M
+--   flask bench plans --only api.buildings_near   (fix the rules if they fail)
+--   flask bench routes --only api.buildings_near  (p50/p95 of both variants)
+-- and record the times here.
+-- Run after update_carte.sql.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_batiment_geog
+ON BATIMENT USING gist ((geom::geography));
+
+ANALYZE BATIMENT;
@@ -0,0 +1,67 @@
+-- =============================================
+-- RECHERCHE : sous-chaînes indexées, sans accents
+-- =============================================
+-- Trigram (pg_trgm) indexes on unaccented, lower-cased text so that the
+-- "search" box of the lists (substring match, "fes" finds "Fès") uses an
+-- index instead of a sequential scan.
+-- The application builds its conditions with app/search.py, which emits
+-- exactly the expressions indexed below: lower(f_unaccent(<column>)).
+-- Run after update_etat_courant.sql.
+
+-- 1. Extensions
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- 2. Immutable wrapper: unaccent() itself is only STABLE (its dictionary
+--    could change), which is not allowed in an index expression.
+CREATE OR REPLACE FUNCTION f_unaccent(text)
+RETURNS text AS $$
+    SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+
+-- 3. Trigram indexes
+-- BATIMENT (buildings list, and building name in the other lists)
+CREATE INDEX IF NOT EXISTS idx_batiment_nom_trgm
+ON BATIMENT USING gin (lower(f_unaccent(nom_batiment)) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_batiment_adresse_trgm
+ON BATIMENT USING gin (lower(f_unaccent(adresse_rue)) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_batiment_code_trgm
+ON BATIMENT USING gin ((code_batiment::text) gin_trgm_ops);
+
+-- ZONE_URBAINE
+CREATE INDEX IF NOT EXISTS idx_zone_nom_trgm
+ON ZONE_URBAINE USING gin (lower(f_unaccent(nom_zone)) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_zone_type_trgm
+ON ZONE_URBAINE USING gin (lower(f_unaccent(type_zone)) gin_trgm_ops);
+
+-- INSPECTION
+CREATE INDEX IF NOT EXISTS idx_inspection_rapport_trgm
+ON INSPECTION USING gin (lower(f_unaccent(rapport)) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_inspection_id_trgm
+ON INSPECTION USING gin ((id_inspect::text) gin_trgm_ops);
+
+-- INTERVENTION
+CREATE INDEX IF NOT EXISTS idx_intervention_travaux_trgm
+ON INTERVENTION USING gin (lower(f_unaccent(type_travaux)) gin_trgm_ops);
+
+-- PRESTATAIRE
+CREATE INDEX IF NOT EXISTS idx_prestataire_nom_trgm
+ON PRESTATAIRE USING gin (lower(f_unaccent(nom_entreprise)) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_prestataire_role_trgm
+ON PRESTATAIRE USING gin (lower(f_unaccent(role_prest)) gin_trgm_ops);
+
+-- DOCUMENT_MEDIA
+CREATE INDEX IF NOT EXISTS idx_document_titre_trgm
+ON DOCUMENT_MEDIA USING gin (lower(f_unaccent(titre_doc)) gin_trgm_ops);
+
+ANALYZE BATIMENT;
+ANALYZE ZONE_URBAINE;
+ANALYZE INSPECTION;
+ANALYZE INTERVENTION;
+ANALYZE PRESTATAIRE;
+ANALYZE DOCUMENT_MEDIA;
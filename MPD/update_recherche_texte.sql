@@ -0,0 +1,44 @@
+-- =============================================
+-- RECHERCHE PLEIN TEXTE : rapports et notes historiques
+-- =============================================
+-- French full-text search (stemming, accent-insensitive) over
+-- INSPECTION.rapport and BATIMENT.note_historique, through stored
+-- tsvector columns behind GIN indexes. Used by the /search/ page and the
+-- "texte" mode of the inspections list (see app/search.py).
+-- Run after update_recherche.sql (needs the unaccent extension).
+
+-- 1. Text search configuration: French stemmer on unaccented words,
+--    so "humidite" and "humidité", "fissure" and "fissures" match.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'fr_unaccent') THEN
+        CREATE TEXT SEARCH CONFIGURATION fr_unaccent (COPY = french);
+        ALTER TEXT SEARCH CONFIGURATION fr_unaccent
+            ALTER MAPPING FOR hword, hword_part, word
+            WITH unaccent, french_stem;
+    END IF;
+END;
+$$;
+
+-- 2. Stored tsvector columns (maintained by PostgreSQL on every write)
+ALTER TABLE INSPECTION
+ADD COLUMN IF NOT EXISTS rapport_tsv tsvector
+GENERATED ALWAYS AS (to_tsvector('fr_unaccent', coalesce(rapport, ''))) STORED;
+
+-- Building name weighs more than the historical note in the ranking
+ALTER TABLE BATIMENT
+ADD COLUMN IF NOT EXISTS note_historique_tsv tsvector
+GENERATED ALWAYS AS (
+    setweight(to_tsvector('fr_unaccent', coalesce(nom_batiment, '')), 'A') ||
+    setweight(to_tsvector('fr_unaccent', coalesce(note_historique, '')), 'B')
+) STORED;
+
+-- 3. GIN indexes
+CREATE INDEX IF NOT EXISTS idx_inspection_rapport_tsv
+ON INSPECTION USING gin (rapport_tsv);
+
+CREATE INDEX IF NOT EXISTS idx_batiment_note_tsv
+ON BATIMENT USING gin (note_historique_tsv);
+
+ANALYZE INSPECTION;
+ANALYZE BATIMENT;
@@ -0,0 +1,23 @@
+-- =============================================
+-- REQUÊTES LENTES : plans capturés (tampon circulaire)
+-- =============================================
+-- When a statement of a request runs longer than SLOW_QUERY_MS, the app
+-- runs EXPLAIN (ANALYZE, BUFFERS) on it in the background and keeps the
+-- plan here, literal values and parameters replaced by ?. The table is a
+-- ring buffer shared by all the workers: capture n goes to slot
+-- n % SLOW_QUERY_CAPACITY, overwriting the oldest one.
+
+CREATE SEQUENCE IF NOT EXISTS requete_lente_numero_seq;
+
+CREATE TABLE IF NOT EXISTS REQUETE_LENTE (
+   emplacement INT PRIMARY KEY,
+   numero      BIGINT NOT NULL,
+   capturee_le TIMESTAMPTZ NOT NULL DEFAULT now(),
+   endpoint    VARCHAR(100),
+   chemin      VARCHAR(255),
+   duree_ms    NUMERIC(12,1) NOT NULL,
+   requete     TEXT NOT NULL,
+   plan        JSONB,
+   erreur      TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_requete_lente_numero ON REQUETE_LENTE (numero DESC);
@@ -0,0 +1,170 @@
+-- =============================================
+-- STATISTIQUES DU TABLEAU DE BORD (agrégats précalculés)
+-- =============================================
+-- The dashboard reads every figure from STATISTIQUE_TABLEAU_BORD in one
+-- query instead of recomputing counts and group-bys on each visit.
+-- Writes to the source tables only log the dependent figures as stale
+-- (statement-level triggers appending to STATISTIQUE_PERIMEE, so writers
+-- never wait on each other); rafraichir_statistiques() recomputes the
+-- stale ones. It is called by the application in the background when
+-- a stale figure is read, and can also be scheduled, e.g. with pg_cron:
+--   SELECT cron.schedule('stats', '*/5 * * * *', 'SELECT rafraichir_statistiques()');
+-- or `flask --app run stats refresh` from a system cron.
+-- Run after update_etat_courant.sql.
+
+-- 1. Tables
+CREATE TABLE IF NOT EXISTS STATISTIQUE_TABLEAU_BORD (
+   cle        VARCHAR(50) PRIMARY KEY,
+   valeur     JSONB,
+   calcule_le TIMESTAMPTZ
+);
+
+-- Append-only log of figures invalidated by a write since their last refresh
+CREATE TABLE IF NOT EXISTS STATISTIQUE_PERIMEE (
+   cle    VARCHAR(50) NOT NULL,
+   depuis TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_statistique_perimee_cle
+ON STATISTIQUE_PERIMEE (cle);
+
+INSERT INTO STATISTIQUE_TABLEAU_BORD (cle) VALUES
+('total_batiments'), ('total_inspections'), ('total_interventions'),
+('batiments_par_zone'), ('batiments_par_type'), ('batiments_par_etat'),
+('batiments_urgents'), ('cout_par_annee')
+ON CONFLICT (cle) DO NOTHING;
+
+
+-- 2. Computation of one figure
+CREATE OR REPLACE FUNCTION calculer_statistique(p_cle VARCHAR)
+RETURNS JSONB AS $$
+BEGIN
+    CASE p_cle
+    WHEN 'total_batiments' THEN
+        RETURN (SELECT to_jsonb(COUNT(*)) FROM BATIMENT);
+    WHEN 'total_inspections' THEN
+        RETURN (SELECT to_jsonb(COUNT(*)) FROM INSPECTION);
+    WHEN 'total_interventions' THEN
+        RETURN (SELECT to_jsonb(COUNT(*)) FROM INTERVENTION);
+    WHEN 'batiments_par_zone' THEN
+        RETURN (SELECT COALESCE(jsonb_agg(jsonb_build_array(nom_zone, nb) ORDER BY nb DESC, nom_zone), '[]')
+                FROM (SELECT z.nom_zone, COUNT(b.code_batiment) AS nb
+                      FROM ZONE_URBAINE z
+                      LEFT JOIN BATIMENT b ON z.id_zone = b.id_zone
+                      GROUP BY z.id_zone, z.nom_zone) s);
+    WHEN 'batiments_par_type' THEN
+        RETURN (SELECT COALESCE(jsonb_agg(jsonb_build_array(libelle_type, nb) ORDER BY nb DESC, libelle_type), '[]')
+                FROM (SELECT t.libelle_type, COUNT(b.code_batiment) AS nb
+                      FROM TYPE_BATIMENT t
+                      LEFT JOIN BATIMENT b ON t.id_type = b.id_type
+                      GROUP BY t.id_type, t.libelle_type) s);
+    WHEN 'batiments_par_etat' THEN
+        RETURN (SELECT COALESCE(jsonb_agg(jsonb_build_array(etat_constate, nb) ORDER BY etat_constate), '[]')
+                FROM (SELECT etat_constate, COUNT(*) AS nb
+                      FROM BATIMENT_ETAT_COURANT
+                      GROUP BY etat_constate) s);
+    WHEN 'batiments_urgents' THEN
+        -- Most urgent first; the dashboard shows the first 100 and the total
+        RETURN (SELECT jsonb_build_object(
+                    'total', (SELECT COUNT(*) FROM BATIMENT_ETAT_COURANT
+                              WHERE etat_constate IN ('En ruine', 'Dégradé')),
+                    'liste', COALESCE(jsonb_agg(jsonb_build_array(code_batiment, nom_batiment,
+                                                                  etat_constate, date_visite)
+                                                ORDER BY rang, nom_batiment), '[]'))
+                FROM (SELECT b.code_batiment, b.nom_batiment, ec.etat_constate, ec.date_visite,
+                             CASE ec.etat_constate WHEN 'En ruine' THEN 1 ELSE 2 END AS rang
+                      FROM BATIMENT b
+                      JOIN BATIMENT_ETAT_COURANT ec ON b.code_batiment = ec.code_batiment
+                      WHERE ec.etat_constate IN ('En ruine', 'Dégradé')
+                      ORDER BY rang, b.nom_batiment
+                      LIMIT 100) s);
+    WHEN 'cout_par_annee' THEN
+        RETURN (SELECT COALESCE(jsonb_agg(jsonb_build_array(annee, total) ORDER BY annee DESC), '[]')
+                FROM (SELECT EXTRACT(YEAR FROM date_debut)::INTEGER AS annee,
+                             COALESCE(SUM(cout_estime), 0) AS total
+                      FROM INTERVENTION
+                      WHERE date_debut IS NOT NULL
+                      GROUP BY EXTRACT(YEAR FROM date_debut)) s);
+    ELSE
+        RAISE EXCEPTION 'Statistique inconnue: %', p_cle;
+    END CASE;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- 3. Refresh of the stale figures (or all of them with force => TRUE).
+--    Only one refresh runs at a time; concurrent callers return 0 at once.
+CREATE OR REPLACE FUNCTION rafraichir_statistiques(force BOOLEAN DEFAULT FALSE)
+RETURNS INTEGER AS $$
+DECLARE
+    cles VARCHAR[];
+    c VARCHAR;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('STATISTIQUE_TABLEAU_BORD')) THEN
+        RETURN 0;
+    END IF;
+
+    -- Consume the committed stale entries. Entries of writers still in
+    -- progress are not visible here and stay for the next refresh, so no
+    -- change is ever lost. Each figure is computed by a later statement,
+    -- which sees every write whose entry was consumed.
+    WITH consommees AS (
+        DELETE FROM STATISTIQUE_PERIMEE RETURNING cle
+    )
+    SELECT array_agg(DISTINCT cle) INTO cles FROM consommees;
+
+    IF force THEN
+        SELECT array_agg(cle) INTO cles FROM STATISTIQUE_TABLEAU_BORD;
+    END IF;
+
+    FOREACH c IN ARRAY COALESCE(cles, '{}') LOOP
+        UPDATE STATISTIQUE_TABLEAU_BORD
+        SET valeur = calculer_statistique(c), calcule_le = now()
+        WHERE cle = c;
+    END LOOP;
+    RETURN COALESCE(array_length(cles, 1), 0);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- 4. Stale entries: the trigger arguments are the dependent figures
+CREATE OR REPLACE FUNCTION trg_statistiques_perimees()
+RETURNS trigger AS $$
+BEGIN
+    INSERT INTO STATISTIQUE_PERIMEE (cle)
+    SELECT unnest(TG_ARGV);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS statistiques_batiment ON BATIMENT;
+CREATE TRIGGER statistiques_batiment
+AFTER INSERT OR UPDATE OR DELETE ON BATIMENT
+FOR EACH STATEMENT EXECUTE FUNCTION trg_statistiques_perimees(
+    'total_batiments', 'batiments_par_zone', 'batiments_par_type', 'batiments_urgents');
+
+DROP TRIGGER IF EXISTS statistiques_zone ON ZONE_URBAINE;
+CREATE TRIGGER statistiques_zone
+AFTER INSERT OR UPDATE OR DELETE ON ZONE_URBAINE
+FOR EACH STATEMENT EXECUTE FUNCTION trg_statistiques_perimees('batiments_par_zone');
+
+DROP TRIGGER IF EXISTS statistiques_type ON TYPE_BATIMENT;
+CREATE TRIGGER statistiques_type
+AFTER INSERT OR UPDATE OR DELETE ON TYPE_BATIMENT
+FOR EACH STATEMENT EXECUTE FUNCTION trg_statistiques_perimees('batiments_par_type');
+
+DROP TRIGGER IF EXISTS statistiques_inspection ON INSPECTION;
+CREATE TRIGGER statistiques_inspection
+AFTER INSERT OR UPDATE OR DELETE ON INSPECTION
+FOR EACH STATEMENT EXECUTE FUNCTION trg_statistiques_perimees(
+    'total_inspections', 'batiments_par_etat', 'batiments_urgents');
+
+DROP TRIGGER IF EXISTS statistiques_intervention ON INTERVENTION;
+CREATE TRIGGER statistiques_intervention
+AFTER INSERT OR UPDATE OR DELETE ON INTERVENTION
+FOR EACH STATEMENT EXECUTE FUNCTION trg_statistiques_perimees(
+    'total_interventions', 'cout_par_annee');
+
+
+-- 5. First computation
+SELECT rafraichir_statistiques(TRUE);
@@ -0,0 +1,155 @@
+-- =============================================
+-- TUILES VECTORIELLES : invalidation du cache
+-- =============================================
+-- /tiles/buildings/{z}/{x}/{y}.pbf renders Mapbox Vector Tiles from
+-- BATIMENT.geom and caches them on disk (see app/tiles.py). Writes that
+-- change what a tile shows log the affected positions here; the
+-- application reads the log and deletes the cached tiles containing
+-- them at every zoom level. A NULL position means "every tile".
+-- Each host keeps its own tile cache, so each cache reads the log from its
+-- own position (CARTE_TUILE_LECTEUR): the id of the oldest transaction it
+-- has not read yet. An entry is purged once every cache has read it.
+-- Run after update_carte.sql and update_etat_courant.sql.
+
+-- 1. Log of positions whose tiles are out of date, with the transaction
+--    that wrote them
+CREATE TABLE IF NOT EXISTS CARTE_TUILE_PERIMEE (
+   geom           GEOMETRY(POINT, 4326),
+   depuis         TIMESTAMPTZ NOT NULL DEFAULT now(),
+   id_transaction XID8 NOT NULL DEFAULT pg_current_xact_id()
+);
+
+ALTER TABLE CARTE_TUILE_PERIMEE
+    ADD COLUMN IF NOT EXISTS id_transaction XID8 NOT NULL DEFAULT pg_current_xact_id();
+
+CREATE INDEX IF NOT EXISTS idx_carte_tuile_perimee_transaction
+    ON CARTE_TUILE_PERIMEE (id_transaction);
+
+
+-- 2. Position of each tile cache in the log. A cache reads the entries of
+--    the transactions from its horizon up to the oldest one still running,
+--    then moves its horizon there: an entry committed late by an older
+--    transaction is never skipped. A cache missing here is cleared.
+CREATE TABLE IF NOT EXISTS CARTE_TUILE_LECTEUR (
+   id_lecteur VARCHAR(64) PRIMARY KEY,
+   horizon    XID8 NOT NULL,
+   vu_le      TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+
+-- 3. Buildings: position, name, address or classification changed
+CREATE OR REPLACE FUNCTION trg_tuiles_batiment_insert()
+RETURNS trigger AS $$
+BEGIN
+    INSERT INTO CARTE_TUILE_PERIMEE (geom)
+    SELECT geom FROM nouvelles WHERE geom IS NOT NULL;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_tuiles_batiment_update()
+RETURNS trigger AS $$
+BEGIN
+    INSERT INTO CARTE_TUILE_PERIMEE (geom)
+    SELECT g FROM (
+        SELECT a.geom AS ancienne, n.geom AS nouvelle
+        FROM anciennes a
+        JOIN nouvelles n ON a.code_batiment = n.code_batiment
+        -- Every BATIMENT column the tile query selects (BUILDINGS_TILE_QUERY
+        -- in app/routes/tiles.py): keep the two lists in step
+        WHERE a.geom IS DISTINCT FROM n.geom
+           OR a.nom_batiment IS DISTINCT FROM n.nom_batiment
+           OR a.adresse_rue IS DISTINCT FROM n.adresse_rue
+           OR a.id_zone IS DISTINCT FROM n.id_zone
+           OR a.id_type IS DISTINCT FROM n.id_type
+           OR a.id_protection IS DISTINCT FROM n.id_protection
+    ) c
+    CROSS JOIN LATERAL (VALUES (c.ancienne), (c.nouvelle)) AS v(g)
+    WHERE g IS NOT NULL;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_tuiles_batiment_delete()
+RETURNS trigger AS $$
+BEGIN
+    INSERT INTO CARTE_TUILE_PERIMEE (geom)
+    SELECT geom FROM anciennes WHERE geom IS NOT NULL;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tuiles_batiment_insert ON BATIMENT;
+CREATE TRIGGER tuiles_batiment_insert
+AFTER INSERT ON BATIMENT
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT EXECUTE FUNCTION trg_tuiles_batiment_insert();
+
+DROP TRIGGER IF EXISTS tuiles_batiment_update ON BATIMENT;
+CREATE TRIGGER tuiles_batiment_update
+AFTER UPDATE ON BATIMENT
+REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+FOR EACH STATEMENT EXECUTE FUNCTION trg_tuiles_batiment_update();
+
+DROP TRIGGER IF EXISTS tuiles_batiment_delete ON BATIMENT;
+CREATE TRIGGER tuiles_batiment_delete
+AFTER DELETE ON BATIMENT
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT EXECUTE FUNCTION trg_tuiles_batiment_delete();
+
+
+-- 4. Current state changed (maintained from INSPECTION, see update_etat_courant.sql)
+CREATE OR REPLACE FUNCTION trg_tuiles_etat_courant()
+RETURNS trigger AS $$
+BEGIN
+    INSERT INTO CARTE_TUILE_PERIMEE (geom)
+    SELECT b.geom
+    FROM BATIMENT b
+    WHERE b.geom IS NOT NULL
+      AND b.code_batiment IN (SELECT code_batiment FROM changees);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tuiles_etat_courant_insert ON BATIMENT_ETAT_COURANT;
+CREATE TRIGGER tuiles_etat_courant_insert
+AFTER INSERT ON BATIMENT_ETAT_COURANT
+REFERENCING NEW TABLE AS changees
+FOR EACH STATEMENT EXECUTE FUNCTION trg_tuiles_etat_courant();
+
+DROP TRIGGER IF EXISTS tuiles_etat_courant_update ON BATIMENT_ETAT_COURANT;
+CREATE TRIGGER tuiles_etat_courant_update
+AFTER UPDATE ON BATIMENT_ETAT_COURANT
+REFERENCING NEW TABLE AS changees
+FOR EACH STATEMENT EXECUTE FUNCTION trg_tuiles_etat_courant();
+
+DROP TRIGGER IF EXISTS tuiles_etat_courant_delete ON BATIMENT_ETAT_COURANT;
+CREATE TRIGGER tuiles_etat_courant_delete
+AFTER DELETE ON BATIMENT_ETAT_COURANT
+REFERENCING OLD TABLE AS changees
+FOR EACH STATEMENT EXECUTE FUNCTION trg_tuiles_etat_courant();
+
+
+-- 5. Renamed zone, type or protection level: every tile may show it
+CREATE OR REPLACE FUNCTION trg_tuiles_toutes()
+RETURNS trigger AS $$
+BEGIN
+    INSERT INTO CARTE_TUILE_PERIMEE (geom) VALUES (NULL);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tuiles_zone ON ZONE_URBAINE;
+CREATE TRIGGER tuiles_zone
+AFTER UPDATE OF nom_zone OR DELETE ON ZONE_URBAINE
+FOR EACH STATEMENT EXECUTE FUNCTION trg_tuiles_toutes();
+
+DROP TRIGGER IF EXISTS tuiles_type ON TYPE_BATIMENT;
+CREATE TRIGGER tuiles_type
+AFTER UPDATE OF libelle_type OR DELETE ON TYPE_BATIMENT
+FOR EACH STATEMENT EXECUTE FUNCTION trg_tuiles_toutes();
+
+DROP TRIGGER IF EXISTS tuiles_protection ON NIV_PROTECTION;
+CREATE TRIGGER tuiles_protection
+AFTER UPDATE OF niveau OR DELETE ON NIV_PROTECTION
+FOR EACH STATEMENT EXECUTE FUNCTION trg_tuiles_toutes();
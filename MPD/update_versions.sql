@@ -0,0 +1,55 @@
+-- =============================================
+-- VERSIONS DES TABLES : ETag et cache des pages
+-- =============================================
+-- VERSION_DONNEES holds a counter per table, bumped by a statement-level
+-- trigger on every write. A page declares the tables it reads; the
+-- application reads their counters (one primary key lookup) to build the
+-- ETag of the page, answers If-None-Match with 304 and serves repeat views
+-- from a per-worker cache without running the page's queries
+-- (see app/pagecache.py).
+-- The counter is written in the transaction of the change, so a reader sees
+-- the new version and the new rows together. Like the CARTE_GRAPPE cells,
+-- the counter row of a table is held from the write until its transaction
+-- commits: concurrent writers of one table commit one after the other.
+-- The derived tables (BATIMENT_ETAT_COURANT, CARTE_GRAPPE, ...) are written
+-- by the triggers of their source table, in the same transaction: the
+-- source's version covers them.
+-- Run after update_statistiques.sql.
+
+-- 1. Table
+CREATE TABLE IF NOT EXISTS VERSION_DONNEES (
+   nom_table VARCHAR(64) PRIMARY KEY,
+   version   BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO VERSION_DONNEES (nom_table) VALUES
+('BATIMENT'), ('INSPECTION'), ('INTERVENTION'), ('DOCUMENT_MEDIA'),
+('ZONE_URBAINE'), ('TYPE_BATIMENT'), ('NIV_PROTECTION'), ('PROPRIETAIRE'),
+('PRESTATAIRE'), ('STATISTIQUE_TABLEAU_BORD')
+ON CONFLICT (nom_table) DO NOTHING;
+
+
+-- 2. One increment per statement (not per row): a bulk import bumps the
+--    version once. A statement that changes no row bumps it too, which
+--    only costs the pages of that table one render.
+CREATE OR REPLACE FUNCTION trg_version_donnees()
+RETURNS trigger AS $$
+BEGIN
+    UPDATE VERSION_DONNEES SET version = version + 1
+    WHERE nom_table = upper(TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOR t IN SELECT nom_table FROM VERSION_DONNEES LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS version_donnees ON %I', lower(t));
+        EXECUTE format('CREATE TRIGGER version_donnees
+                        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I
+                        FOR EACH STATEMENT EXECUTE FUNCTION trg_version_donnees()', lower(t));
+    END LOOP;
+END;
+$$;
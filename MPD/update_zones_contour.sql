@@ -0,0 +1,111 @@
+-- =============================================
+-- ZONES : contours et rattachement spatial des bâtiments
+-- =============================================
+-- ZONE_URBAINE.contour is the outline of a zone, loaded from GeoJSON by
+-- `flask zones import`. A building whose position lies inside a contour
+-- belongs to that zone: a trigger sets id_zone whenever a position is
+-- written, and affecter_zones() re-assigns the buildings in one UPDATE
+-- after contours change. Buildings outside every contour keep the zone
+-- picked in the form. Where contours overlap the smallest one wins.
+--
+-- Timing: not measured yet. These functions have only run against
+-- stand-in geometry functions, not PostGIS, so the time to re-zone 50k
+-- buildings is unknown. To measure it on PostGIS, run
+-- `flask bench seed --buildings 50k`, load real contours with
+-- `flask zones import`, then run `flask zones assign`, which prints the
+-- time of the UPDATE (commit included). Record the result here.
+-- Run after update_carte.sql and update_import.sql.
+
+-- 1. Contour and its spatial index
+ALTER TABLE ZONE_URBAINE ADD COLUMN IF NOT EXISTS contour GEOMETRY(MULTIPOLYGON, 4326);
+
+CREATE INDEX IF NOT EXISTS idx_zone_contour
+ON ZONE_URBAINE USING gist (contour);
+
+
+-- 2. Zone of a position (NULL outside every contour)
+CREATE OR REPLACE FUNCTION zone_de_position(p_geom GEOMETRY)
+RETURNS INT AS $$
+    SELECT z.id_zone
+    FROM ZONE_URBAINE z
+    WHERE ST_Contains(z.contour, p_geom)
+    ORDER BY ST_Area(z.contour), z.id_zone
+    LIMIT 1
+$$ LANGUAGE sql STABLE;
+
+
+-- 3. Every write of a position: the contour decides the zone. Named so it
+--    runs after batiment_geom_insert / batiment_geom_update (BEFORE
+--    triggers fire in name order), which compute geom.
+CREATE OR REPLACE FUNCTION trg_batiment_zone()
+RETURNS trigger AS $$
+DECLARE
+    v_zone INT;
+BEGIN
+    IF NEW.geom IS NOT NULL THEN
+        v_zone := zone_de_position(NEW.geom);
+        IF v_zone IS NOT NULL THEN
+            NEW.id_zone := v_zone;
+        END IF;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS batiment_zone ON BATIMENT;
+CREATE TRIGGER batiment_zone
+BEFORE INSERT OR UPDATE OF latitude, longitude, geom ON BATIMENT
+FOR EACH ROW EXECUTE FUNCTION trg_batiment_zone();
+
+
+-- 4. Bulk re-assignment after contours change: one spatial join through
+--    the GiST indexes, only the buildings whose zone changes are written
+--    (the statement-level triggers of the statistics, clusters and tiles
+--    then run once). p_zones limits it to the buildings inside those
+--    zones' contours. Returns the number of buildings moved.
+CREATE OR REPLACE FUNCTION affecter_zones(p_zones INT[] DEFAULT NULL)
+RETURNS INT AS $$
+DECLARE
+    moved INT;
+BEGIN
+    UPDATE BATIMENT b
+    SET id_zone = c.id_zone
+    FROM (
+        SELECT DISTINCT ON (bc.code_batiment) bc.code_batiment, z.id_zone
+        FROM BATIMENT bc
+        JOIN ZONE_URBAINE z ON ST_Contains(z.contour, bc.geom)
+        WHERE p_zones IS NULL
+           OR EXISTS (SELECT 1 FROM ZONE_URBAINE r
+                      WHERE r.id_zone = ANY(p_zones) AND ST_Contains(r.contour, bc.geom))
+        ORDER BY bc.code_batiment, ST_Area(z.contour), z.id_zone
+    ) c
+    WHERE b.code_batiment = c.code_batiment
+      AND b.id_zone IS DISTINCT FROM c.id_zone;
+    GET DIAGNOSTICS moved = ROW_COUNT;
+    RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- 5. Figures of each zone computed from its contour rather than from
+--    id_zone: buildings inside, their current state, and how many of them
+--    are still attached to another zone (what affecter_zones() would move)
+CREATE OR REPLACE FUNCTION statistiques_zones_spatiales(p_zones INT[] DEFAULT NULL)
+RETURNS TABLE (id_zone INT, surface_km2 NUMERIC, nb_batiments BIGINT, nb_bon BIGINT,
+               nb_moyen BIGINT, nb_urgent BIGINT, nb_autre_zone BIGINT) AS $$
+    SELECT z.id_zone,
+           round((ST_Area(z.contour::geography) / 1e6)::numeric, 2),
+           COUNT(b.code_batiment),
+           COUNT(*) FILTER (WHERE ec.etat_constate = 'Bon'),
+           COUNT(*) FILTER (WHERE ec.etat_constate = 'Moyen'),
+           COUNT(*) FILTER (WHERE ec.etat_constate IN ('Dégradé', 'En ruine')),
+           COUNT(b.code_batiment) FILTER (WHERE b.id_zone IS DISTINCT FROM z.id_zone)
+    FROM ZONE_URBAINE z
+    LEFT JOIN BATIMENT b ON ST_Contains(z.contour, b.geom)
+    LEFT JOIN BATIMENT_ETAT_COURANT ec ON ec.code_batiment = b.code_batiment
+    WHERE z.contour IS NOT NULL
+      AND (p_zones IS NULL OR z.id_zone = ANY(p_zones))
+    GROUP BY z.id_zone
+$$ LANGUAGE sql STABLE;
+
+ANALYZE ZONE_URBAINE;
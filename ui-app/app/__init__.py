@@ -1,4 +1,4 @@
-from flask import Flask
+from flask import Flask, jsonify
 from config import Config
 from flask_cors import CORS
 
@@ -13,10 +13,39 @@ def create_app(config_class=Config):
     from . import db
     db.init_app(app)
     
+    # SQL trace of each request (Server-Timing, log line, budgets)
+    from . import querylog
+    querylog.init_app(app)
+
+    # Prometheus metrics (/metrics)
+    from . import metrics
+    metrics.init_app(app)
+
+    # Dashboard statistics CLI (flask stats refresh)
+    from . import stats
+    stats.init_app(app)
+
+    # Benchmarks CLI (flask bench pipeline)
+    from . import bench
+    bench.init_app(app)
+
+    # Bulk import CLI (flask import buildings file.csv)
+    from . import importer
+    importer.init_app(app)
+
+    # Zone contours CLI (flask zones import contours.geojson)
+    from . import zoning
+    zoning.init_app(app)
+
+    # export_url() for the list templates
+    from . import export
+    export.init_app(app)
+    
     # Register blueprints
     from .routes import (buildings_bp, inspections_bp, interventions_bp, 
                          dashboard_bp, prestataires_bp, zones_bp,
-                         protections_bp, proprietaires_bp, types_bp, documents_bp)
+                         protections_bp, proprietaires_bp, types_bp, documents_bp,
+                         search_bp, api_bp, tiles_bp, imports_bp, admin_bp)
     
     app.register_blueprint(dashboard_bp)
     app.register_blueprint(buildings_bp)
@@ -28,6 +57,11 @@ def create_app(config_class=Config):
     app.register_blueprint(proprietaires_bp)
     app.register_blueprint(types_bp)
     app.register_blueprint(documents_bp)
+    app.register_blueprint(search_bp)
+    app.register_blueprint(api_bp)
+    app.register_blueprint(tiles_bp)
+    app.register_blueprint(imports_bp)
+    app.register_blueprint(admin_bp)
     
     @app.route('/test-db')
     def test_db_connection():
@@ -41,6 +75,11 @@ def create_app(config_class=Config):
         except Exception as e:
             return f"<h1>Database Connection Failed!</h1><p>{e}</p>"
 
+    @app.route('/pool-stats')
+    def pool_stats():
+        """Connection pool size, saturation and checkout wait times of this worker."""
+        return jsonify(db.pool_stats())
+
     # Custom Jinja filter for safe date formatting
     @app.template_filter('safe_strftime')
     def safe_strftime(value, format='%d/%m/%Y'):
@@ -0,0 +1,549 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import socket
+import statistics
+import threading
+import time
+
+import click
+import psycopg
+from flask import current_app, g
+from psycopg.conninfo import conninfo_to_dict, make_conninfo
+
+from . import db, querylog, synthetic
+from .refdata import invalidate
+from .tiles import tiles_at
+
+# Pages whose independent queries are batched (see db.fetch_batch)
+PIPELINE_ROUTES = [
+    '/',
+    '/buildings/',
+    '/buildings/add',
+    '/buildings/edit/{code}',
+    '/interventions/',
+]
+
+# Table and key of the sample record put in the <id> of each blueprint's routes
+SAMPLE_TABLES = {
+    'buildings': ('BATIMENT', 'code_batiment'),
+    'inspections': ('INSPECTION', 'id_inspect'),
+    'interventions': ('INTERVENTION', 'id_interv'),
+    'prestataires': ('PRESTATAIRE', 'id_prestataire'),
+    'zones': ('ZONE_URBAINE', 'id_zone'),
+    'protections': ('NIV_PROTECTION', 'id_protection'),
+    'proprietaires': ('PROPRIETAIRE', 'id_proprio'),
+    'types': ('TYPE_BATIMENT', 'id_type'),
+    'documents': ('DOCUMENT_MEDIA', 'id_doc'),
+    'api': ('BATIMENT', 'code_batiment'),
+    'admin': ('REQUETE_LENTE', 'numero'),
+}
+
+# Query strings timed for each page (default: the page alone). {building},
+# {zone}, {prestataire}, the position and the bounding boxes come from the
+# sample building.
+ROUTE_SCENARIOS = {
+    'buildings.list_buildings': ['', '?etat=Dégradé', '?zone={zone}', '?search=medersa',
+                                 '?zone={zone}&type={type}&etat=Non inspecté',
+                                 '?protection={protection}&search=riad'],
+    'buildings.export_buildings': ['?zone={zone}&etat=Bon&format=ndjson'],
+    'inspections.list_inspections': ['', '?etat=En ruine', '?building={building}',
+                                     '?search=fissures&mode=texte',
+                                     '?date_from=2024-01-01&date_to=2024-06-30&etat=Dégradé'],
+    'inspections.export_inspections': ['?building={building}'],
+    'interventions.list_interventions': ['', '?statut=En cours', '?prestataire={prestataire}',
+                                         '?validated=no&statut=Terminé', '?building={building}'],
+    'interventions.export_interventions': ['?prestataire={prestataire}&statut=Terminé'],
+    'documents.list_all_documents': ['', '?type_doc=Plan'],
+    'documents.export_documents': ['?building={building}'],
+    'search.fulltext_search': ['?q=zelliges', '?q=pisé&scope=inspections'],
+    'api.map_buildings': ['?bbox={street_bbox}&zoom=16'],
+    'api.buildings_near': ['?lat={lat}&lng={lng}', '?lat={lat}&lng={lng}&radius=500&protection={protection}'],
+    'api.map_clusters': ['?bbox={country_bbox}&zoom=6', '?bbox={country_bbox}&zoom=6&etat=Dégradé'],
+    'api.map_heatmap': ['?bbox={country_bbox}&zoom=6', '?bbox={country_bbox}&resolution=20000'],
+}
+
+# Plan expectations of the page statements (flask bench plans), kept with the code
+PLAN_EXPECTATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 'plan_expectations.json')
+
+# Tables that grow with the number of buildings: a page reading one of them
+# with a sequential scan does not scale
+LARGE_TABLES = ('batiment', 'inspection', 'intervention', 'document_media')
+
+# Size suffixes of `bench seed --buildings`
+SIZE_SUFFIXES = {'k': 1000, 'm': 1000000}
+
+
+class LatencyProxy:
+    """
+    Local TCP proxy in front of the database that delays every packet by
+    `delay` seconds in each direction, to reproduce a distant server.
+    """
+
+    def __init__(self, dsn, delay):
+        params = conninfo_to_dict(dsn)
+        host = params.get('host') or 'localhost'
+        port = int(params.get('port') or 5432)
+        if host.startswith('/'):
+            self.upstream = (socket.AF_UNIX, f'{host}/.s.PGSQL.{port}')
+        else:
+            self.upstream = (socket.AF_INET, (params.get('hostaddr') or host, port))
+        self.delay = delay
+        self._server = socket.create_server(('127.0.0.1', 0))
+        self.port = self._server.getsockname()[1]
+        overrides = {'host': '127.0.0.1', 'port': self.port}
+        if 'hostaddr' in params:
+            overrides['hostaddr'] = '127.0.0.1'
+        self.dsn = make_conninfo(dsn, **overrides)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            family, address = self.upstream
+            server = socket.socket(family, socket.SOCK_STREAM)
+            server.connect(address)
+            for src, dst in ((client, server), (server, client)):
+                packets = queue.Queue()
+                threading.Thread(target=self._read, args=(src, packets), daemon=True).start()
+                threading.Thread(target=self._write, args=(dst, packets), daemon=True).start()
+
+    def _read(self, src, packets):
+        while True:
+            try:
+                data = src.recv(65536)
+            except OSError:
+                data = b''
+            packets.put((time.monotonic() + self.delay, data))
+            if not data:
+                return
+
+    def _write(self, dst, packets):
+        while True:
+            deadline, data = packets.get()
+            time.sleep(max(0.0, deadline - time.monotonic()))
+            try:
+                if not data:
+                    dst.shutdown(socket.SHUT_WR)
+                    return
+                dst.sendall(data)
+            except OSError:
+                return
+
+    def close(self):
+        self._server.close()
+
+
+def measure(app, url, runs, warmup=1):
+    """
+    Status, response times in ms and statements per request of `runs`
+    requests to `url`, after `warmup` untimed ones.
+    """
+    client = app.test_client()
+    timings = []
+    for run in range(warmup + runs):
+        # The request runs in this app context, so its SQL trace can be read
+        # after it; the connection goes back to the pool at the end, as in a worker
+        with app.app_context():
+            start = time.perf_counter()
+            response = client.get(url)
+            response.get_data()
+            elapsed = (time.perf_counter() - start) * 1000
+            trace = g.get('sql_trace')
+            queries = trace.count if trace else 0
+        if run >= warmup:
+            timings.append(elapsed)
+    return response.status_code, timings, queries
+
+
+def time_routes(app, urls, runs):
+    """Median response time in ms of each URL, after one warm-up request."""
+    results = {}
+    for url in urls:
+        status, timings, _ = measure(app, url, runs)
+        results[url] = (status, statistics.median(timings))
+    return results
+
+
+def parse_size(value):
+    """Parses a count such as 5000, 10k or 1M."""
+    value = value.strip().lower()
+    factor = SIZE_SUFFIXES.get(value[-1:], 1)
+    try:
+        count = int(float(value[:-1] if factor > 1 else value) * factor)
+    except ValueError:
+        raise click.BadParameter(f'{value!r} (ex: 5000, 10k, 1M)')
+    if count < 1:
+        raise click.BadParameter('au moins 1 bâtiment')
+    return count
+
+
+def sample_values(conn):
+    """Ids and bounding boxes of a typical record of each table, for the route URLs."""
+    samples = {}
+    with conn.cursor() as cur:
+        for blueprint, (table, column) in SAMPLE_TABLES.items():
+            cur.execute('SELECT to_regclass(%s) IS NOT NULL', (table,))
+            if not cur.fetchone()[0]:
+                samples[blueprint] = 0
+                continue
+            # Record in the middle of the id range: not the oldest nor the newest
+            cur.execute(f'''
+                SELECT {column} FROM {table}
+                WHERE {column} >= (SELECT (MIN({column}) + MAX({column})) / 2 FROM {table})
+                ORDER BY {column} LIMIT 1
+            ''')
+            row = cur.fetchone()
+            samples[blueprint] = row[0] if row else 0
+        cur.execute('''
+            SELECT b.latitude, b.longitude, b.id_zone, b.id_type, b.id_protection,
+                   (SELECT MIN(i.id_prestataire) FROM INTERVENTION i WHERE i.code_batiment = b.code_batiment)
+            FROM BATIMENT b WHERE b.code_batiment = %s
+        ''', (samples['buildings'],))
+        lat, lng, zone, type_id, protection, prestataire = cur.fetchone() or (None,) * 6
+    lat, lng = float(lat if lat is not None else 34.06), float(lng if lng is not None else -4.97)
+    x, y = min(tiles_at(lng, lat, 13))
+    samples.update(
+        building=samples['buildings'], zone=zone or samples['zones'],
+        type=type_id or samples['types'], protection=protection or samples['protections'],
+        prestataire=prestataire or samples['prestataires'],
+        street_bbox=f'{lng - 0.005:.4f},{lat - 0.003:.4f},{lng + 0.005:.4f},{lat + 0.003:.4f}',
+        country_bbox=f'{lng - 6:.4f},{lat - 4:.4f},{lng + 6:.4f},{lat + 4:.4f}',
+        lat=f'{lat:.5f}', lng=f'{lng:.5f}', tile=(13, x, y),
+    )
+    return samples
+
+
+def route_urls(app, samples, only=None):
+    """
+    (endpoint, URL) of every GET page of the blueprints, with sample ids in
+    the path and the query strings of ROUTE_SCENARIOS.
+    """
+    urls = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        blueprint, _, _ = rule.endpoint.rpartition('.')
+        if not blueprint or 'GET' not in rule.methods:
+            continue
+        if only and not any(pattern in rule.endpoint or pattern in rule.rule for pattern in only):
+            continue
+        values = {}
+        for argument in rule.arguments:
+            if argument in ('z', 'x', 'y'):
+                values[argument] = samples['tile'][('z', 'x', 'y').index(argument)]
+            elif argument == 'building_id':
+                values[argument] = samples['buildings']
+            else:
+                values[argument] = samples[blueprint]
+        with app.test_request_context():
+            path = app.url_for(rule.endpoint, **values)
+        for query in ROUTE_SCENARIOS.get(rule.endpoint, ['']):
+            urls.append((rule.endpoint, path + query.format(**samples)))
+    return urls
+
+
+def statement_key(sql):
+    """Stable name of a statement: digest of its normalized text."""
+    return hashlib.sha1(sql.encode()).hexdigest()[:12]
+
+
+def capture_statements(app, urls):
+    """
+    Runs each (endpoint, URL) once and returns {key: (endpoints, Statement)}
+    for every distinct statement that has a plan, parameters included.
+    """
+    client = app.test_client()
+    statements = {}
+    for endpoint, url in urls:
+        with app.app_context():
+            g.sql_keep_params = True
+            client.get(url).get_data()
+            trace = g.get('sql_trace')
+        for statement in trace.statements if trace else []:
+            if statement.query is not None and statement.sql.upper().startswith(querylog.EXPLAINABLE):
+                endpoints, _ = statements.setdefault(statement_key(statement.sql), ([], statement))
+                if endpoint not in endpoints:
+                    endpoints.append(endpoint)
+    return statements
+
+
+def plan_nodes(node):
+    """Descriptions of the nodes of an EXPLAIN (FORMAT JSON) plan, e.g. 'Index Scan using idx on table'."""
+    description = node['Node Type']
+    if node.get('Index Name'):
+        description += f" using {node['Index Name']}"
+    if node.get('Relation Name'):
+        description += f" on {node['Relation Name']}"
+    yield description
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(conn, statement):
+    """Node descriptions of the statement's plan (without running it)."""
+    query = statement.query.decode() if isinstance(statement.query, bytes) else statement.query
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'EXPLAIN (FORMAT JSON) {query}', statement.params)
+            plan = cur.fetchone()[0]
+    finally:
+        conn.rollback()
+    return list(plan_nodes(plan[0]['Plan']))
+
+
+def _matches(rule, node):
+    # Whole names only: 'Seq Scan on batiment' is not 'Seq Scan on batiment_etat_courant'
+    return re.search(rf'(?<!\w){re.escape(rule)}(?!\w)', node, re.IGNORECASE) is not None
+
+
+def check_plan(nodes, expectation):
+    """Broken rules of an expectation: 'forbid' and 'require' match parts of node descriptions."""
+    problems = []
+    for rule in expectation.get('forbid', []):
+        found = [node for node in nodes if _matches(rule, node)]
+        if found:
+            problems.append(f'interdit: {found[0]}')
+    for rule in expectation.get('require', []):
+        if not any(_matches(rule, node) for node in nodes):
+            problems.append(f'absent: {rule}')
+    return problems
+
+
+def default_expectation(nodes):
+    """Rules recorded for a new statement: the large tables it reads without a Seq Scan stay so."""
+    nodes = [node.lower() for node in nodes]
+    read = {table for table in LARGE_TABLES if any(node.endswith(f' on {table}') for node in nodes)}
+    scanned = {table for table in read if f'seq scan on {table}' in nodes}
+    return {'forbid': [f'Seq Scan on {table}' for table in sorted(read - scanned)], 'require': []}
+
+
+@click.group('bench')
+def bench_cli():
+    """Performance benchmarks against the configured database."""
+
+
+@bench_cli.command('pipeline')
+@click.option('--latency-ms', default=20.0, show_default=True,
+              help='Simulated round-trip time to the database.')
+@click.option('--runs', default=10, show_default=True, help='Requests per page and mode.')
+def pipeline_command(latency_ms, runs):
+    """Page times with and without pipeline mode over a slow network."""
+    app = current_app._get_current_object()
+    config = app.config
+    with psycopg.connect(config['DATABASE_URL']) as conn:
+        row = conn.execute('SELECT MIN(code_batiment) FROM BATIMENT').fetchone()
+    urls = [url.format(code=row[0]) for url in PIPELINE_ROUTES]
+
+    proxy = LatencyProxy(config['DATABASE_URL'], latency_ms / 2000)
+    saved = {key: config[key] for key in ('DATABASE_URL', 'DB_PIPELINE_ENABLED',
+                                          'REFDATA_CACHE_ENABLED', 'PAGE_CACHE_ENABLED',
+                                          'DASHBOARD_STATS_BACKGROUND_REFRESH')}
+    # Every lookup list is read from the database, as on a cold cache
+    config.update(DATABASE_URL=proxy.dsn, REFDATA_CACHE_ENABLED=False, PAGE_CACHE_ENABLED=False,
+                  DASHBOARD_STATS_BACKGROUND_REFRESH=False)
+    results = {}
+    try:
+        for pipeline in (False, True):
+            db.close_pool()
+            config['DB_PIPELINE_ENABLED'] = pipeline
+            results[pipeline] = time_routes(app, urls, runs)
+    finally:
+        db.close_pool()
+        config.update(saved)
+        proxy.close()
+
+    click.echo(f'Round trip {latency_ms:g} ms, median of {runs} requests')
+    click.echo(f'{"page":<28}{"sequential":>12}{"pipeline":>12}{"gain":>8}')
+    for url in urls:
+        status, sequential = results[False][url]
+        _, pipelined = results[True][url]
+        note = '' if status == 200 else f'  (HTTP {status})'
+        click.echo(f'{url:<28}{sequential:>10.1f}ms{pipelined:>10.1f}ms'
+                   f'{(1 - pipelined / sequential) * 100:>7.0f}%{note}')
+
+
+@bench_cli.command('seed')
+@click.option('--buildings', 'size', default='10k', show_default=True,
+              help='Number of buildings (suffixes k and M accepted).')
+@click.option('--seed', default=1, show_default=True, help='Random seed of the dataset.')
+@click.option('--reset', is_flag=True, help='Delete all existing data first.')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation of --reset.')
+def seed_command(size, seed, reset, yes):
+    """Load a deterministic synthetic dataset with COPY."""
+    buildings = parse_size(size)
+    conn = db.get_db()
+    if reset:
+        if not yes:
+            click.confirm('Supprimer toutes les données de la base ?', abort=True)
+        synthetic.reset(conn)
+    start = time.perf_counter()
+
+    def progress(table, count):
+        click.echo(f'{table:<16}{count:>12,} ligne(s)  {time.perf_counter() - start:8.1f}s')
+
+    synthetic.load(conn, buildings, seed, progress)
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regproc('rafraichir_statistiques') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute('SELECT rafraichir_statistiques(true)')
+        conn.commit()
+    # Planner statistics for the new rows (ANALYZE cannot run in a transaction)
+    conn.autocommit = True
+    try:
+        conn.execute('ANALYZE')
+    finally:
+        conn.autocommit = False
+    invalidate(*(table for table, _ in synthetic.TABLES.values()))
+    click.echo(f'Terminé en {time.perf_counter() - start:.1f}s')
+
+
+@bench_cli.command('routes')
+@click.option('--runs', default=30, show_default=True, help='Timed requests per URL.')
+@click.option('--warmup', default=3, show_default=True, help='Untimed requests per URL first.')
+@click.option('--baseline', type=click.Path(dir_okay=False),
+              help='Baseline file (default: <instance folder>/bench-baseline.json).')
+@click.option('--save', is_flag=True, help='Store the results as the new baseline.')
+@click.option('--threshold', default=0.25, show_default=True,
+              help='Tolerated p95 increase over the baseline (fraction).')
+@click.option('--min-delta-ms', default=5.0, show_default=True,
+              help='Smaller p95 increases are never regressions.')
+@click.option('--only', multiple=True, help='Only the endpoints or paths containing this text.')
+@click.pass_context
+def routes_command(ctx, runs, warmup, baseline, save, threshold, min_delta_ms, only):
+    """
+    p50/p95/p99 latency and query count of every page, compared with a
+    baseline. Exits with status 1 on a regression.
+    """
+    app = current_app._get_current_object()
+    baseline = baseline or os.path.join(app.instance_path, 'bench-baseline.json')
+    previous = {}
+    if os.path.exists(baseline) and not save:
+        with open(baseline) as f:
+            previous = json.load(f)
+
+    urls = route_urls(app, sample_values(db.get_db()), only)
+    # Statements are counted by the SQL trace; its per-request log is left out.
+    # Every request renders its page (no 304 or copy of the warm-up's page).
+    app.config.update(SQL_TRACE_ENABLED=True, PAGE_CACHE_ENABLED=False)
+    logging.getLogger(querylog.__name__).setLevel(logging.ERROR)
+    results = {}
+    regressions = 0
+    click.echo(f'{"page":<60}{"p50":>9}{"p95":>9}{"p99":>9}{"req.":>6}')
+    for endpoint, url in urls:
+        status, timings, queries = measure(app, url, runs, warmup)
+        cuts = statistics.quantiles(timings, n=100, method='inclusive')
+        result = {'endpoint': endpoint, 'status': status, 'p50': round(cuts[49], 2),
+                  'p95': round(cuts[94], 2), 'p99': round(cuts[98], 2), 'queries': queries}
+        results[url] = result
+        notes = [] if status == 200 else [f'HTTP {status}']
+        before = previous.get(url)
+        if before:
+            # A page already failing in the baseline is shown, not counted again
+            changes = []
+            if status != before['status']:
+                notes = []
+                changes.append(f"HTTP {before['status']} -> {status}")
+            if (result['p95'] > before['p95'] * (1 + threshold)
+                    and result['p95'] - before['p95'] > min_delta_ms):
+                changes.append(f"p95 {before['p95']:.1f} -> {result['p95']:.1f}ms")
+            if result['queries'] > before['queries']:
+                changes.append(f"requêtes {before['queries']} -> {result['queries']}")
+            if changes:
+                regressions += 1
+            notes += changes
+        click.echo(f"{url[:59]:<60}{result['p50']:>7.1f}ms{result['p95']:>7.1f}ms"
+                   f"{result['p99']:>7.1f}ms{queries:>6}" + (f"  ! {', '.join(notes)}" if notes else ''))
+
+    if save:
+        os.makedirs(os.path.dirname(baseline), exist_ok=True)
+        with open(baseline, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        click.echo(f'Référence enregistrée: {baseline}')
+    elif previous:
+        click.echo(f'{regressions} régression(s) par rapport à {baseline}')
+        if regressions:
+            ctx.exit(1)
+
+
+@bench_cli.command('plans')
+@click.option('--expectations', type=click.Path(dir_okay=False), default=PLAN_EXPECTATIONS,
+              show_default=True, help='Plan expectations file.')
+@click.option('--record', is_flag=True,
+              help='Add the new statements to the file (and drop the ones no page runs any more).')
+@click.option('--min-buildings', default=10000, show_default=True,
+              help='Refuse to run on a smaller dataset (see bench seed).')
+@click.option('--only', multiple=True, help='Only the endpoints or paths containing this text.')
+@click.pass_context
+def plans_command(ctx, expectations, record, min_buildings, only):
+    """
+    Checks the plan of every statement of the pages against its recorded
+    expectations. Exits with status 1 on a broken rule or a statement
+    without expectations.
+    """
+    app = current_app._get_current_object()
+    conn = db.get_db()
+    with conn.cursor() as cur:
+        cur.execute('SELECT COUNT(*) FROM BATIMENT')
+        buildings = cur.fetchone()[0]
+    conn.rollback()
+    if buildings < min_buildings:
+        raise click.ClickException(f'{buildings} bâtiment(s) seulement: les plans ne seraient pas ceux '
+                                   f'de la production (flask bench seed --buildings 100k)')
+    known = {}
+    if os.path.exists(expectations):
+        with open(expectations) as f:
+            known = json.load(f)
+
+    # Every lookup list and page is read (not served from the cache of a previous page)
+    app.config.update(SQL_TRACE_ENABLED=True, REFDATA_CACHE_ENABLED=False, PAGE_CACHE_ENABLED=False)
+    logging.getLogger(querylog.__name__).setLevel(logging.ERROR)
+    statements = capture_statements(app, route_urls(app, sample_values(conn), only))
+
+    failures = new = 0
+    for key, (endpoints, statement) in sorted(statements.items(), key=lambda item: item[1][0]):
+        name = f'{key} ({endpoints[0]})'
+        try:
+            nodes = explain(conn, statement)
+        except psycopg.Error as e:
+            failures += 1
+            click.echo(f'ERREUR  {name}: {str(e).strip().splitlines()[0]}')
+            continue
+        expectation = known.get(key)
+        if expectation is None:
+            new += 1
+            click.echo(f'NOUVEAU {name}: {statement.sql[:100]}')
+            if record:
+                known[key] = {'sql': statement.sql, 'pages': endpoints, **default_expectation(nodes)}
+            continue
+        problems = check_plan(nodes, expectation)
+        if problems:
+            failures += 1
+            click.echo(f'ÉCHEC   {name}: {"; ".join(problems)}')
+            click.echo(f'        {statement.sql[:160]}')
+
+    # With --only, the statements of the other pages were not run
+    unused = [] if only else [key for key in known if key not in statements]
+    for key in unused:
+        click.echo(f'INUTILE {key} (plus exécutée par les pages)')
+    if record:
+        for key in unused:
+            del known[key]
+        with open(expectations, 'w') as f:
+            json.dump(dict(sorted(known.items())), f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        click.echo(f'{new} nouvelle(s) requête(s) enregistrée(s) dans {expectations}')
+        new = 0
+    click.echo(f'{len(statements)} requête(s), {failures} échec(s), {new} sans attente')
+    if failures or new:
+        ctx.exit(1)
+
+
+def init_app(app):
+    """Register the benchmark CLI commands with the Flask app."""
+    app.cli.add_command(bench_cli)
@@ -1,22 +1,269 @@
+import os
+import time
+import logging
+import threading
+
 import psycopg
+from psycopg.pq import PipelineStatus, TransactionStatus
+from psycopg_pool import ConnectionPool, PoolTimeout
 from flask import current_app, g
 
+from . import querylog, slowlog
+
+logger = logging.getLogger(__name__)
+
+# One pool per process. Gunicorn forks its workers from the master, so the
+# pool is created lazily on the first request of each worker (never in the
+# master) and forgotten in any child forked after it was opened.
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# Checkout statistics accumulated by get_db() for this process, updated
+# under their lock (the request threads of a worker check out concurrently)
+_stats_lock = threading.Lock()
+_checkout_stats = {
+    'checkouts': 0,
+    'wait_ms_total': 0.0,
+    'wait_ms_max': 0.0,
+    'slow_checkouts': 0,
+    'timeouts': 0,
+}
+
+
+class TracedCursor(psycopg.Cursor):
+    """Cursor recording its statements in the request's SQL trace (see querylog)."""
+
+    def execute(self, query, params=None, **kwargs):
+        # Not the empty statement of the pool's connection check
+        if query == '':
+            return super().execute(query, params, **kwargs)
+        # In pipeline mode the statement is only queued here: fetch_batch()
+        # records it when the batch returns
+        if self.connection.info.pipeline_status != PipelineStatus.OFF:
+            return super().execute(query, params, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            querylog.record(query, duration, self.rowcount, params)
+            slowlog.check(query, params, duration)
+
+    def executemany(self, query, params_seq, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, params_seq, **kwargs)
+        finally:
+            querylog.record(query, time.perf_counter() - start, self.rowcount)
+
+
+class TracedServerCursor(psycopg.ServerCursor):
+    """Server-side (named) cursor traced like TracedCursor, its fetches included."""
+
+    trace = None
+
+    def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            self.trace = querylog.record(query, time.perf_counter() - start, 0, params)
+
+    def fetchmany(self, size=0):
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._add_fetch(time.perf_counter() - start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._add_fetch(time.perf_counter() - start, len(rows))
+        return rows
+
+    def _add_fetch(self, duration, rows):
+        querylog.add_fetch(self.trace, duration, rows)
+
+
+def _configure_connection(conn):
+    conn.cursor_factory = TracedCursor
+    conn.server_cursor_factory = TracedServerCursor
+
+
+def _forget_pool_after_fork():
+    """Drop the reference to the parent's pool in a forked child."""
+    global _pool, _pool_pid
+    _pool = None
+    _pool_pid = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pool_after_fork)
+
+
+def get_pool():
+    """
+    Returns the connection pool of the current process, creating and
+    pre-warming it on first use.
+    """
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            config = current_app.config
+            pool = ConnectionPool(
+                config['DATABASE_URL'],
+                min_size=config['DB_POOL_MIN_SIZE'],
+                max_size=config['DB_POOL_MAX_SIZE'],
+                timeout=config['DB_POOL_TIMEOUT'],
+                max_lifetime=config['DB_POOL_MAX_LIFETIME'],
+                max_idle=config['DB_POOL_MAX_IDLE'],
+                check=ConnectionPool.check_connection,
+                configure=_configure_connection,
+                name=f'app-{os.getpid()}',
+                open=False,
+            )
+            pool.open(wait=config['DB_POOL_WAIT_ON_OPEN'],
+                      timeout=config['DB_POOL_TIMEOUT'])
+            _pool = pool
+            _pool_pid = os.getpid()
+    return _pool
+
+
 def get_db():
     """
-    Opens a new database connection if there is none yet for the
+    Checks a connection out of the pool if there is none yet for the
     current application context.
     """
     if 'db' not in g:
-        g.db = psycopg.connect(current_app.config['DATABASE_URL'])
+        pool = get_pool()
+        start = time.perf_counter()
+        try:
+            g.db = pool.getconn()
+        except PoolTimeout:
+            with _stats_lock:
+                _checkout_stats['timeouts'] += 1
+            logger.error('Database pool exhausted: no connection within %.1fs '
+                         '(%s)', current_app.config['DB_POOL_TIMEOUT'],
+                         pool.get_stats())
+            raise
+        wait_ms = (time.perf_counter() - start) * 1000
+        g.db_wait_ms = wait_ms
+
+        slow = wait_ms > current_app.config['DB_POOL_SLOW_CHECKOUT_MS']
+        with _stats_lock:
+            _checkout_stats['checkouts'] += 1
+            _checkout_stats['wait_ms_total'] += wait_ms
+            _checkout_stats['wait_ms_max'] = max(_checkout_stats['wait_ms_max'], wait_ms)
+            if slow:
+                _checkout_stats['slow_checkouts'] += 1
+        if slow:
+            logger.warning('Slow database checkout: waited %.1f ms (%s)',
+                           wait_ms, pool.get_stats())
     return g.db
 
+
+def fetch_batch(conn, statements):
+    """
+    Runs independent (query, params) statements and returns the rows of
+    each one, in order. With DB_PIPELINE_ENABLED they are sent together in
+    pipeline mode, so the batch costs one round trip instead of one per
+    statement. A failing statement aborts the rest of the batch.
+    """
+    if len(statements) < 2 or not current_app.config['DB_PIPELINE_ENABLED']:
+        results = []
+        with conn.cursor() as cur:
+            for query, params in statements:
+                cur.execute(query, params)
+                results.append(cur.fetchall())
+        return results
+
+    cursors = []
+    start = time.perf_counter()
+    try:
+        with conn.pipeline():
+            for query, params in statements:
+                cur = conn.cursor()
+                cursors.append(cur)
+                cur.execute(query, params)
+        results = [cur.fetchall() for cur in cursors]
+        # The statements ran together: the batch's time is shared between them
+        share = (time.perf_counter() - start) / len(cursors)
+        for (query, params), cur in zip(statements, cursors):
+            querylog.record(query, share, cur.rowcount, params)
+            slowlog.check(query, params, share)
+        return results
+    finally:
+        for cur in cursors:
+            cur.close()
+
+
 def close_db(e=None):
     """
-    Closes the database connection.
+    Returns the database connection to the pool.
     """
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        if _pool is not None and _pool_pid == os.getpid():
+            # Read-only pages leave their implicit transaction open: end it
+            # here so the pool does not log a warning for every request.
+            if db.info.transaction_status != TransactionStatus.IDLE:
+                try:
+                    db.rollback()
+                except psycopg.Error:
+                    pass
+            _pool.putconn(db)
+        else:
+            db.close()
+
+
+def pool_stats():
+    """
+    Returns the pool statistics of this process: size, idle connections,
+    waiting clients, checkout wait times and saturation.
+    """
+    if _pool is None or _pool_pid != os.getpid():
+        return {'pid': os.getpid(), 'open': False}
+
+    stats = _pool.get_stats()
+    size = stats.get('pool_size', 0)
+    available = stats.get('pool_available', 0)
+    with _stats_lock:
+        checkout_stats = dict(_checkout_stats)
+    checkouts = checkout_stats['checkouts']
+    return {
+        'pid': os.getpid(),
+        'open': True,
+        'min_size': _pool.min_size,
+        'max_size': _pool.max_size,
+        'size': size,
+        'in_use': size - available,
+        'available': available,
+        'waiting': stats.get('requests_waiting', 0),
+        # Share of the maximum size currently checked out
+        'saturation': round((size - available) / _pool.max_size, 3),
+        'checkouts': checkouts,
+        'wait_ms_avg': round(checkout_stats['wait_ms_total'] / checkouts, 3) if checkouts else 0.0,
+        'wait_ms_max': round(checkout_stats['wait_ms_max'], 3),
+        'slow_checkouts': checkout_stats['slow_checkouts'],
+        'timeouts': checkout_stats['timeouts'],
+        'pool': stats,
+    }
+
+
+def close_pool():
+    """
+    Closes the pool of the current process (used on worker shutdown).
+    """
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
+    _pool = None
+    _pool_pid = None
+
 
 def init_app(app):
     """
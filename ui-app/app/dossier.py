@@ -0,0 +1,97 @@
+import datetime
+import json
+
+# A building with its inspections, interventions and documents, built as
+# one JSON document by PostgreSQL so the detail page costs one round trip.
+DOSSIER_QUERY = '''
+    SELECT json_build_object(
+        'batiment', json_build_object(
+            'code_batiment', b.code_batiment,
+            'nom_batiment', b.nom_batiment,
+            'adresse_rue', b.adresse_rue,
+            'latitude', b.latitude,
+            'longitude', b.longitude,
+            'date_construction', b.date_construction,
+            'note_historique', b.note_historique,
+            'id_zone', b.id_zone,
+            'nom_zone', z.nom_zone,
+            'id_type', b.id_type,
+            'libelle_type', t.libelle_type,
+            'id_protection', b.id_protection,
+            'niveau', n.niveau,
+            'id_proprio', b.id_proprio,
+            'proprietaire', p.nom_complet,
+            'type_proprio', p.type_proprio,
+            'etat_courant', ec.etat_constate),
+        'inspections', COALESCE(ins.items, '[]'),
+        'interventions', COALESCE(itv.items, '[]'),
+        'documents', COALESCE(doc.items, '[]')
+    )::text
+    FROM BATIMENT b
+    LEFT JOIN ZONE_URBAINE z ON b.id_zone = z.id_zone
+    LEFT JOIN TYPE_BATIMENT t ON b.id_type = t.id_type
+    LEFT JOIN NIV_PROTECTION n ON b.id_protection = n.id_protection
+    LEFT JOIN PROPRIETAIRE p ON b.id_proprio = p.id_proprio
+    LEFT JOIN BATIMENT_ETAT_COURANT ec ON b.code_batiment = ec.code_batiment
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object(
+                   'id_inspect', i.id_inspect,
+                   'date_visite', i.date_visite,
+                   'etat_constate', i.etat_constate,
+                   'rapport', i.rapport)
+               ORDER BY i.date_visite DESC, i.id_inspect DESC) AS items
+        FROM INSPECTION i
+        WHERE i.code_batiment = b.code_batiment
+    ) ins ON true
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object(
+                   'id_interv', i.id_interv,
+                   'date_debut', i.date_debut,
+                   'date_fin', i.date_fin,
+                   'type_travaux', i.type_travaux,
+                   'cout_estime', i.cout_estime,
+                   'est_validee', i.est_validee,
+                   'statut_travaux', i.statut_travaux,
+                   'nom_entreprise', pr.nom_entreprise,
+                   'role_prest', pr.role_prest)
+               ORDER BY i.date_debut DESC, i.id_interv DESC) AS items
+        FROM INTERVENTION i
+        LEFT JOIN PRESTATAIRE pr ON i.id_prestataire = pr.id_prestataire
+        WHERE i.code_batiment = b.code_batiment
+    ) itv ON true
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object(
+                   'id_doc', d.id_doc,
+                   'titre_doc', d.titre_doc,
+                   'type_doc', d.type_doc,
+                   'url_fichier', d.url_fichier)
+               ORDER BY d.id_doc DESC) AS items
+        FROM DOCUMENT_MEDIA d
+        WHERE d.code_batiment = b.code_batiment
+    ) doc ON true
+    WHERE b.code_batiment = %s
+'''
+
+# Fields converted back from their JSON text to dates for the templates
+DATE_FIELDS = ('date_construction', 'date_visite', 'date_debut', 'date_fin')
+
+
+def fetch_dossier_json(cur, code_batiment):
+    """The building dossier as JSON text, or None if the building does not exist."""
+    cur.execute(DOSSIER_QUERY, (code_batiment,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def load_dossier(cur, code_batiment):
+    """The building dossier as dicts with date values, or None."""
+    text = fetch_dossier_json(cur, code_batiment)
+    if text is None:
+        return None
+    dossier = json.loads(text)
+    for item in [dossier['batiment'], *dossier['inspections'],
+                 *dossier['interventions'], *dossier['documents']]:
+        for field in DATE_FIELDS:
+            if item.get(field):
+                item[field] = datetime.date.fromisoformat(item[field])
+    return dossier
@@ -0,0 +1,83 @@
+import csv
+import datetime
+import io
+import json
+from decimal import Decimal
+
+from flask import Response, current_app, request, stream_with_context, url_for
+
+from .db import get_db
+
+# format -> (mimetype, file extension)
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+# List arguments that only concern the HTML page
+PAGE_ARGS = ('cursor', 'per_page', 'count')
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _csv_chunk(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _ndjson_chunk(names, rows):
+    return ''.join(json.dumps(dict(zip(names, row)), default=_json_value, ensure_ascii=False) + '\n'
+                   for row in rows)
+
+
+def export_response(query, params, file_format, filename, hidden=()):
+    """
+    Streams the rows of `query` as CSV (with a header) or NDJSON. Rows are
+    read from a server-side cursor EXPORT_FETCH_SIZE at a time and sent as
+    they come, so memory stays flat whatever the size of the export.
+    Columns named in `hidden` (sort helpers) are left out.
+    """
+    mimetype, extension = FORMATS[file_format]
+    size = current_app.config['EXPORT_FETCH_SIZE']
+    cur = get_db().cursor(name='export')
+    cur.execute(query, params)
+    names = [column.name for column in cur.description]
+    keep = [i for i, name in enumerate(names) if name not in hidden]
+    names = [names[i] for i in keep]
+
+    def generate():
+        try:
+            if file_format == 'csv':
+                yield _csv_chunk([names])
+            while True:
+                rows = cur.fetchmany(size)
+                if not rows:
+                    break
+                rows = [[row[i] for i in keep] for row in rows]
+                yield _csv_chunk(rows) if file_format == 'csv' else _ndjson_chunk(names, rows)
+        finally:
+            cur.close()
+
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}.{extension}',
+        # Sent as produced, not buffered by a reverse proxy
+        'X-Accel-Buffering': 'no',
+    })
+
+
+def export_url(endpoint, file_format):
+    """URL of the export of the current list, with its filters."""
+    args = {k: v for k, v in request.args.items() if k not in PAGE_ARGS}
+    return url_for(endpoint, format=file_format, **args)
+
+
+def init_app(app):
+    """Make export_url available to the list templates."""
+    app.jinja_env.globals['export_url'] = export_url
@@ -0,0 +1,215 @@
+import csv
+import io
+import json
+import os
+
+import click
+
+from . import db
+from .refdata import invalidate
+
+# Importable kinds: name -> (batch type, staging table, columns, import function, target table)
+# See MPD/update_import.sql for the validation of each kind.
+KINDS = {
+    'buildings': ('batiment', 'IMPORT_BATIMENT',
+                  ['ref_externe', 'nom_batiment', 'adresse_rue', 'latitude', 'longitude',
+                   'date_construction', 'note_historique', 'id_zone', 'id_type',
+                   'id_protection', 'id_proprio'],
+                  'importer_batiments', 'BATIMENT'),
+    'inspections': ('inspection', 'IMPORT_INSPECTION',
+                    ['code_batiment', 'ref_batiment', 'date_visite', 'etat_constate', 'rapport'],
+                    'importer_inspections', 'INSPECTION'),
+    'interventions': ('intervention', 'IMPORT_INTERVENTION',
+                      ['code_batiment', 'ref_batiment', 'date_debut', 'date_fin', 'type_travaux',
+                       'cout_estime', 'est_validee', 'statut_travaux', 'id_prestataire'],
+                      'importer_interventions', 'INTERVENTION'),
+}
+
+FORMATS = ('csv', 'geojson')
+
+# Errors returned with the report (all of them stay in IMPORT_ERREUR)
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFileError(ValueError):
+    """The file itself cannot be read (format, header); nothing was imported."""
+
+
+class ImportReport:
+    """Outcome of one import batch."""
+
+    def __init__(self, lot, rows, imported, rejected, errors):
+        self.lot = lot
+        self.rows = rows
+        self.imported = imported
+        self.rejected = rejected
+        # (line, column, message), line being the line of the CSV file or
+        # the position of the GeoJSON feature
+        self.errors = errors
+
+
+def detect_format(filename):
+    """'geojson' for .geojson/.json files, 'csv' otherwise."""
+    extension = os.path.splitext(filename or '')[1].lower()
+    return 'geojson' if extension in ('.geojson', '.json') else 'csv'
+
+
+def _value(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _check_columns(names, columns):
+    unknown = [name for name in names if name not in columns]
+    if unknown:
+        raise ImportFileError(f"Colonne(s) inconnue(s): {', '.join(unknown)} "
+                              f"(attendues: {', '.join(columns)})")
+
+
+def read_csv(stream, columns):
+    """
+    Yields (line, values) for every record of a CSV text stream with a
+    header row. The delimiter (comma, semicolon or tab) is detected.
+    """
+    sample = stream.read(64 * 1024)
+    stream.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(stream, dialect=dialect)
+    if not reader.fieldnames:
+        raise ImportFileError('Fichier vide')
+    fieldnames = [name.strip() for name in reader.fieldnames]
+    _check_columns(fieldnames, columns)
+    reader.fieldnames = fieldnames
+    try:
+        for record in reader:
+            yield reader.line_num, [_value(record.get(column)) for column in columns]
+    except csv.Error as e:
+        raise ImportFileError(f'CSV invalide ligne {reader.line_num}: {e}')
+
+
+def read_features(stream):
+    """
+    Yields (feature number, properties, geometry) for every feature of a
+    GeoJSON FeatureCollection, checking that each one is an object with
+    object properties and geometry (either may be null: then empty).
+    """
+    try:
+        collection = json.load(stream)
+    except ValueError as e:
+        raise ImportFileError(f'GeoJSON invalide: {e}')
+    if not isinstance(collection, dict) or collection.get('type') != 'FeatureCollection':
+        raise ImportFileError('GeoJSON invalide: FeatureCollection attendue')
+    features = collection.get('features') or []
+    if not isinstance(features, list):
+        raise ImportFileError('GeoJSON invalide: "features" doit être une liste')
+    for number, feature in enumerate(features, start=1):
+        if not isinstance(feature, dict):
+            raise ImportFileError(f'Objet {number}: Feature attendue')
+        properties = feature.get('properties') or {}
+        if not isinstance(properties, dict):
+            raise ImportFileError(f'Objet {number}: "properties" doit être un objet')
+        geometry = feature.get('geometry') or {}
+        if not isinstance(geometry, dict):
+            raise ImportFileError(f'Objet {number}: "geometry" doit être un objet')
+        yield number, properties, geometry
+
+
+def read_geojson(stream, columns):
+    """
+    Yields (feature number, values) for every feature of a GeoJSON
+    FeatureCollection. A Point geometry gives longitude and latitude.
+    Unlike CSV, the whole document is parsed in memory first: uploads are
+    limited to MAX_GEOJSON_UPLOAD_MB for that reason.
+    """
+    for number, properties, geometry in read_features(stream):
+        properties = dict(properties)
+        _check_columns(properties, columns)
+        if geometry.get('type') == 'Point' and 'latitude' in columns:
+            coordinates = geometry.get('coordinates')
+            if isinstance(coordinates, list) and len(coordinates) >= 2:
+                properties['longitude'], properties['latitude'] = coordinates[:2]
+        yield number, [_value(properties.get(column)) for column in columns]
+
+
+def import_file(conn, kind, stream, file_format, filename=None):
+    """
+    Loads a CSV or GeoJSON text stream of `kind` records in one transaction:
+    COPY into the staging table, then set-wise validation and insertion by
+    the database. Invalid lines are reported, not fatal; an unreadable file
+    raises ImportFileError and imports nothing.
+    """
+    type_lot, staging, columns, function, table = KINDS[kind]
+    reader = read_geojson if file_format == 'geojson' else read_csv
+    try:
+        with conn.cursor() as cur:
+            cur.execute('INSERT INTO IMPORT_LOT (type_lot, fichier) VALUES (%s, %s) RETURNING id_lot',
+                        (type_lot, (filename or '')[:255] or None))
+            lot = cur.fetchone()[0]
+
+            with cur.copy(f"COPY {staging} (id_lot, ligne, {', '.join(columns)}) FROM STDIN") as copy:
+                for line, values in reader(stream, columns):
+                    copy.write_row((lot, line, *values))
+
+            cur.execute(f'SELECT {function}(%s)', (lot,))
+            cur.execute('SELECT nb_lignes, nb_importees, nb_rejetees FROM IMPORT_LOT WHERE id_lot = %s',
+                        (lot,))
+            rows, imported, rejected = cur.fetchone()
+            cur.execute('''
+                SELECT ligne, colonne, message FROM IMPORT_ERREUR
+                WHERE id_lot = %s ORDER BY ligne, colonne LIMIT %s
+            ''', (lot, MAX_REPORTED_ERRORS))
+            errors = cur.fetchall()
+        conn.commit()
+    except UnicodeDecodeError:
+        conn.rollback()
+        raise ImportFileError('Encodage invalide: UTF-8 attendu')
+    except BaseException:
+        conn.rollback()
+        raise
+    if imported:
+        invalidate(table)
+    return ImportReport(lot, rows, imported, rejected, errors)
+
+
+@click.command('import')
+@click.argument('kind', type=click.Choice(list(KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(FORMATS),
+              help='Format of the file (default: from its extension).')
+def import_command(kind, path, file_format):
+    """Bulk import of buildings, inspections or interventions from CSV or GeoJSON."""
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        try:
+            report = import_file(db.get_db(), kind, stream,
+                                 file_format or detect_format(path), os.path.basename(path))
+        except ImportFileError as e:
+            raise click.ClickException(str(e))
+    click.echo(f'Lot {report.lot}: {report.rows} ligne(s), {report.imported} importée(s), '
+               f'{report.rejected} rejetée(s)')
+    for line, column, message in report.errors:
+        click.echo(f'  ligne {line}: {column}: {message}')
+    if len(report.errors) == MAX_REPORTED_ERRORS:
+        click.echo(f'  ... (toutes les erreurs: IMPORT_ERREUR, id_lot = {report.lot})')
+
+
+def upload_size(file_storage):
+    """Size in bytes of an uploaded file (spooled by werkzeug, so seekable)."""
+    stream = file_storage.stream
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(0)
+    return size
+
+
+def open_upload(file_storage):
+    """Text stream over an uploaded file (UTF-8, with or without BOM)."""
+    return io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+
+
+def init_app(app):
+    """Register the import CLI command with the Flask app."""
+    app.cli.add_command(import_command)
@@ -0,0 +1,115 @@
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               REGISTRY, generate_latest)
+from prometheus_client import multiprocess
+from psycopg_pool import PoolTimeout
+
+from . import db
+
+# Prometheus metrics. Under gunicorn each worker writes its values to files
+# in PROMETHEUS_MULTIPROC_DIR (set in gunicorn.conf.py before the workers
+# start) and /metrics, served by any worker, adds up those of all of them.
+# Without that variable (flask run) the metrics are the process's own.
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests by route and status.',
+                   ['blueprint', 'endpoint', 'method', 'status'])
+EXCEPTIONS = Counter('http_request_exceptions_total', 'Requests ended by an unhandled exception.',
+                     ['blueprint', 'endpoint', 'exception'])
+LATENCY = Histogram('http_request_duration_seconds', 'Request duration, streamed bodies included.',
+                    ['blueprint', 'endpoint', 'method'])
+DB_TIME = Histogram('http_request_db_seconds', 'Time spent in SQL statements per request.',
+                    ['blueprint', 'endpoint'])
+DB_STATEMENTS = Counter('http_request_db_statements_total', 'SQL statements run by requests.',
+                        ['blueprint', 'endpoint'])
+POOL_WAIT = Histogram('db_pool_checkout_seconds', 'Wait for a pooled connection, per request.',
+                      buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+POOL_TIMEOUTS = Counter('db_pool_timeouts_total', 'Requests that got no pooled connection in time.')
+POOL_CONNECTIONS = Gauge('db_pool_connections', 'Pooled connections of the live workers by state.',
+                         ['state'], multiprocess_mode='livesum')
+POOL_MAX = Gauge('db_pool_max_connections', 'Maximum size of the pools of the live workers.',
+                 multiprocess_mode='livesum')
+POOL_WAITING = Gauge('db_pool_waiting_requests', 'Requests waiting for a pooled connection.',
+                     multiprocess_mode='livesum')
+CACHE = Counter('cache_requests_total', 'Cache lookups by cache and result (hit, miss, ...).',
+                ['cache', 'result'])
+
+
+def count_cache(cache, hits=0, misses=0, **results):
+    """
+    Counts hits and misses of one of the application caches, and other
+    results given by name (count_cache('pages', coalesced=1)).
+    """
+    if hits:
+        CACHE.labels(cache, 'hit').inc(hits)
+    if misses:
+        CACHE.labels(cache, 'miss').inc(misses)
+    for result, count in results.items():
+        if count:
+            CACHE.labels(cache, result).inc(count)
+
+
+def _labels():
+    # The endpoint (not the path) keeps the number of series bounded
+    return request.blueprint or '', request.endpoint or 'unmatched'
+
+
+def _update_pool():
+    stats = db.pool_stats()
+    if stats['open']:
+        POOL_CONNECTIONS.labels('in_use').set(stats['in_use'])
+        POOL_CONNECTIONS.labels('available').set(stats['available'])
+        POOL_MAX.set(stats['max_size'])
+        POOL_WAITING.set(stats['waiting'])
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+
+
+def _save_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _observe_request(e=None):
+    if 'metrics_start' not in g or request.endpoint == 'metrics':
+        return
+    blueprint, endpoint = _labels()
+    status = 500 if e is not None else g.get('metrics_status', 500)
+    REQUESTS.labels(blueprint, endpoint, request.method, status).inc()
+    LATENCY.labels(blueprint, endpoint, request.method).observe(time.perf_counter() - g.metrics_start)
+    if e is not None:
+        EXCEPTIONS.labels(blueprint, endpoint, type(e).__name__).inc()
+        if isinstance(e, PoolTimeout):
+            POOL_TIMEOUTS.inc()
+    trace = g.get('sql_trace')
+    if trace is not None:
+        DB_TIME.labels(blueprint, endpoint).observe(trace.db_ms / 1000)
+        DB_STATEMENTS.labels(blueprint, endpoint).inc(trace.count)
+    if 'db_wait_ms' in g:
+        POOL_WAIT.observe(g.db_wait_ms / 1000)
+    _update_pool()
+
+
+def metrics():
+    """Metrics of all the workers, in the Prometheus text format."""
+    _update_pool()
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """Record the request metrics and serve them at /metrics."""
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.before_request(_start_request)
+    app.after_request(_save_status)
+    app.teardown_request(_observe_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,306 @@
+import functools
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg
+from flask import Response, current_app, g, request, session
+
+from .db import close_db, get_db
+from .metrics import count_cache
+
+logger = logging.getLogger(__name__)
+
+# Tables whose writes bump a counter of VERSION_DONNEES (MPD/update_versions.sql).
+# Derived tables are covered by their source: BATIMENT_ETAT_COURANT by
+# INSPECTION, CARTE_GRAPPE by BATIMENT and INSPECTION.
+VERSIONED_TABLES = (
+    'BATIMENT', 'INSPECTION', 'INTERVENTION', 'DOCUMENT_MEDIA',
+    'ZONE_URBAINE', 'TYPE_BATIMENT', 'NIV_PROTECTION', 'PROPRIETAIRE', 'PRESTATAIRE',
+    'STATISTIQUE_TABLEAU_BORD',
+)
+
+VERSIONS_QUERY = 'SELECT nom_table, version FROM VERSION_DONNEES WHERE nom_table = ANY(%s)'
+
+# Files whose content is part of every ETag, so a deployment changes them all
+RELEASE_SUFFIXES = ('.py', '.html')
+
+# Marks the WSGI environ of a background render (stale-while-revalidate)
+REFRESH_KEY = 'pagecache.refresh'
+
+# Entries of the visitor's WSGI environ left out of a background render (its
+# request object, body, cookies and validators)
+REFRESH_IGNORED = ('werkzeug.request', 'wsgi.input', 'HTTP_COOKIE', 'HTTP_IF_NONE_MATCH')
+
+# Longest wait (seconds) for the render of an identical request; past it
+# the request renders the page itself
+COALESCE_TIMEOUT = 30
+
+
+class Page:
+    """A rendered page and when it was rendered."""
+
+    __slots__ = ('body', 'content_type', 'url', 'rendered_at')
+
+    def __init__(self, body, content_type, url):
+        self.body = body
+        self.content_type = content_type
+        self.url = url
+        self.rendered_at = time.monotonic()
+
+
+class Flight:
+    """A render in progress, awaited by the identical requests arriving meanwhile."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.page = None
+
+
+class PageCache:
+    """
+    Per-process LRU of rendered pages keyed by their ETag, bounded by the
+    total size of the bodies, with the latest page of each URL (served
+    stale by the aggregate pages) and the renders in progress.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._latest = {}
+        self._flights = {}
+        self.size = 0
+
+    def get(self, etag):
+        with self._lock:
+            page = self._entries.get(etag)
+            if page is not None:
+                self._entries.move_to_end(etag)
+            return page
+
+    def latest(self, url, max_age):
+        """(ETag, page) of the latest page of url rendered less than max_age seconds ago."""
+        with self._lock:
+            etag = self._latest.get(url)
+            page = self._entries.get(etag)
+            if page is None or time.monotonic() - page.rendered_at > max_age:
+                return None
+            return etag, page
+
+    def put(self, etag, page, max_bytes):
+        # A single page may not push most of the others out
+        if len(page.body) > max_bytes // 8:
+            return
+        with self._lock:
+            if etag in self._entries:
+                return
+            self._entries[etag] = page
+            self._latest[page.url] = etag
+            self.size += len(page.body)
+            while self.size > max_bytes:
+                old_etag, old = self._entries.popitem(last=False)
+                self.size -= len(old.body)
+                if self._latest.get(old.url) == old_etag:
+                    del self._latest[old.url]
+
+    def join(self, etag):
+        """The render in progress of etag and False, or a new one and True (the caller renders)."""
+        with self._lock:
+            flight = self._flights.get(etag)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[etag] = Flight()
+            return flight, True
+
+    def land(self, etag, flight, page):
+        """Ends a render started by join(), handing its page (or None) to the waiting requests."""
+        flight.page = page
+        with self._lock:
+            self._flights.pop(etag, None)
+        flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._latest.clear()
+            self.size = 0
+
+
+_cache = PageCache()
+
+# Digest of the code, templates and configuration of this process
+_release = None
+
+# Set when VERSION_DONNEES is missing: the pages are then always rendered
+_disabled = False
+
+
+def _release_digest():
+    global _release
+    if _release is None:
+        digest = hashlib.sha1(repr(sorted(current_app.config.items())).encode())
+        package = os.path.dirname(os.path.abspath(__file__))
+        for folder, dirs, files in sorted(os.walk(package)):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(RELEASE_SUFFIXES):
+                    with open(os.path.join(folder, name), 'rb') as f:
+                        digest.update(name.encode())
+                        digest.update(f.read())
+        _release = digest.hexdigest()
+    return _release
+
+
+def page_etag(tables):
+    """
+    Strong ETag of the current page: its URL and the versions of the
+    tables it reads. None when the versions cannot be read.
+    """
+    global _disabled
+    if _disabled:
+        return None
+    conn = get_db()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(VERSIONS_QUERY, (list(tables),))
+            versions = sorted(cur.fetchall())
+    except psycopg.errors.UndefinedTable:
+        conn.rollback()
+        _disabled = True
+        logger.warning('VERSION_DONNEES is missing (MPD/update_versions.sql): page cache disabled')
+        return None
+    # The lookup lists of the page are taken at these versions too (refdata)
+    g.table_versions = dict(versions)
+    digest = hashlib.sha1(_release_digest().encode())
+    digest.update(request.full_path.encode())
+    digest.update(repr(versions).encode())
+    return digest.hexdigest()[:32]
+
+
+def _with_etag(response, etag):
+    response.set_etag(etag)
+    # Stored by the browser, but checked with If-None-Match on every visit
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _send(page, etag):
+    return _with_etag(Response(page.body, content_type=page.content_type), etag)
+
+
+def _not_modified(etag):
+    count_cache('etag', hits=1)
+    return _with_etag(Response(status=304), etag)
+
+
+def _render(view, args, kwargs, etag):
+    """Runs the view; returns its response and its Page (None when not shareable)."""
+    response = current_app.make_response(view(*args, **kwargs))
+    if response.status_code != 200 or response.is_streamed or session.get('_flashes'):
+        return response, None
+    page = Page(response.get_data(), response.content_type, request.full_path)
+    _cache.put(etag, page, int(current_app.config['PAGE_CACHE_MAX_MB'] * 1024 * 1024))
+    return _with_etag(response, etag), page
+
+
+def _refresh_in_background(etag):
+    """
+    Renders the current version of the page in a thread, through the whole
+    request cycle on a copy of this request, unless a render of that
+    version is already running.
+    """
+    flight, leader = _cache.join(etag)
+    if not leader:
+        return
+    count_cache('pages', refresh=1)
+    app = current_app._get_current_object()
+    environ = {key: value for key, value in request.environ.items() if key not in REFRESH_IGNORED}
+    environ.update({'wsgi.input': io.BytesIO(), REFRESH_KEY: True})
+
+    def run():
+        page = None
+        try:
+            with app.request_context(environ):
+                app.full_dispatch_request()
+            # None when the versions moved again during the render
+            page = _cache.get(etag)
+        except Exception:
+            logger.exception('Background render of %s failed', environ.get('PATH_INFO'))
+        finally:
+            _cache.land(etag, flight, page)
+
+    threading.Thread(target=run, name='page-refresh', daemon=True).start()
+
+
+def cached(*tables, stale_while_revalidate=False):
+    """
+    Conditional GET for a page reading `tables`: a strong ETag from their
+    versions, 304 when the browser already has the page, and repeat views
+    served from the page cache. Neither runs the page's queries.
+    Identical requests arriving during a render wait for it and share its
+    page. With `stale_while_revalidate` a page rendered less than
+    PAGE_CACHE_STALE_SECONDS ago is served at once after a change, while
+    one background render brings it up to date.
+    """
+    unknown = set(tables) - set(VERSIONED_TABLES)
+    if unknown:
+        raise ValueError(f'Tables without a version: {", ".join(sorted(unknown))}')
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            config = current_app.config
+            # A page showing flash messages is for this visit only
+            if (not config['PAGE_CACHE_ENABLED'] or request.method not in ('GET', 'HEAD')
+                    or session.get('_flashes')):
+                return view(*args, **kwargs)
+            etag = page_etag(tables)
+            if etag is None:
+                return view(*args, **kwargs)
+            if request.environ.get(REFRESH_KEY):
+                return _render(view, args, kwargs, etag)[0]
+            if request.if_none_match.contains(etag):
+                return _not_modified(etag)
+
+            page = _cache.get(etag)
+            if page is not None:
+                count_cache('etag', misses=1)
+                count_cache('pages', hits=1)
+                return _send(page, etag)
+
+            if stale_while_revalidate:
+                stale = _cache.latest(request.full_path, config['PAGE_CACHE_STALE_SECONDS'])
+                if stale is not None:
+                    _refresh_in_background(etag)
+                    stale_etag, page = stale
+                    if request.if_none_match.contains(stale_etag):
+                        return _not_modified(stale_etag)
+                    count_cache('etag', misses=1)
+                    count_cache('pages', stale=1)
+                    return _send(page, stale_etag)
+
+            count_cache('etag', misses=1)
+            flight, leader = _cache.join(etag)
+            if not leader:
+                # The pooled connection is not needed while waiting
+                close_db()
+                if flight.done.wait(COALESCE_TIMEOUT) and flight.page is not None:
+                    count_cache('pages', coalesced=1)
+                    return _send(flight.page, etag)
+                # The render failed, timed out or cannot be shared
+                count_cache('pages', misses=1)
+                return _render(view, args, kwargs, etag)[0]
+
+            count_cache('pages', misses=1)
+            page = None
+            try:
+                response, page = _render(view, args, kwargs, etag)
+                return response
+            finally:
+                _cache.land(etag, flight, page)
+        return wrapper
+    return decorator
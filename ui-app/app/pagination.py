@@ -0,0 +1,175 @@
+import datetime
+import json
+from decimal import Decimal
+
+from flask import current_app, request, url_for
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from .db import fetch_batch
+
+
+class Keyset:
+    """
+    Sort key of a paginated list. Every expression is sorted DESC, the last
+    one must be unique (usually the primary key) so the order is total.
+    `positions` gives the index of each key value in the selected rows.
+    """
+
+    def __init__(self, expressions, positions):
+        self.expressions = expressions
+        self.positions = positions
+
+    def values(self, row):
+        return [row[i] for i in self.positions]
+
+    def order_by(self, order='DESC'):
+        return ' ORDER BY ' + ', '.join(f'{e} {order}' for e in self.expressions)
+
+
+class Page:
+    """One page of a keyset-paginated list."""
+
+    def __init__(self, rows, page_size, next_token=None, prev_token=None,
+                 estimated_total=None):
+        self.rows = rows
+        self.page_size = page_size
+        self.next_token = next_token
+        self.prev_token = prev_token
+        self.estimated_total = estimated_total
+
+    @property
+    def has_next(self):
+        return self.next_token is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_token is not None
+
+    def url(self, token):
+        """URL of the page `token` points to, keeping the current filters."""
+        args = request.args.to_dict()
+        args['cursor'] = token
+        return url_for(request.endpoint, **request.view_args, **args)
+
+    @property
+    def next_url(self):
+        return self.url(self.next_token) if self.next_token else None
+
+    @property
+    def prev_url(self):
+        return self.url(self.prev_token) if self.prev_token else None
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='keyset-cursor')
+
+
+def _dump_value(value):
+    if isinstance(value, datetime.date):
+        return {'d': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'n': str(value)}
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, dict):
+        if 'd' in value:
+            return datetime.date.fromisoformat(value['d'])
+        if 'n' in value:
+            return Decimal(value['n'])
+    return value
+
+
+def encode_cursor(direction, values):
+    """Signed, URL-safe token for the page after ('next') or before ('prev') `values`."""
+    return _serializer().dumps([direction, [_dump_value(v) for v in values]])
+
+
+def decode_cursor(token):
+    """Returns (direction, values), or None for a missing or tampered token."""
+    if not token:
+        return None
+    try:
+        direction, values = _serializer().loads(token)
+    except (BadSignature, ValueError, TypeError):
+        return None
+    if direction not in ('next', 'prev'):
+        return None
+    return direction, [_load_value(v) for v in values]
+
+
+def get_page_size():
+    """Page size from the `per_page` argument, bounded by the configuration."""
+    default = current_app.config['PAGE_SIZE']
+    try:
+        size = int(request.args.get('per_page', default))
+    except ValueError:
+        size = default
+    return max(1, min(size, current_app.config['MAX_PAGE_SIZE']))
+
+
+def _estimate_query(query):
+    return 'EXPLAIN (FORMAT JSON) ' + query
+
+
+def _plan_rows(plan):
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def paginate(cur, query, params, keyset):
+    """
+    Runs `query` (a SELECT ending with its WHERE clause, without ORDER BY)
+    one page at a time using the cursor in the request arguments.
+    Seeks directly past the cursor values, so a deep page costs the same
+    as the first one.
+    """
+    page_size = get_page_size()
+    params = list(params)
+
+    # The estimate and the page are independent: sent as one batch
+    statements = []
+    if current_app.config['PAGINATION_ESTIMATE_COUNT'] and request.args.get('count', '1') != '0':
+        statements.append((_estimate_query(query), list(params)))
+
+    cursor = decode_cursor(request.args.get('cursor'))
+    if cursor and len(cursor[1]) != len(keyset.expressions):
+        cursor = None
+    direction = cursor[0] if cursor else 'next'
+
+    keys = ', '.join(keyset.expressions)
+    if cursor:
+        placeholders = ', '.join(['%s'] * len(keyset.expressions))
+        operator = '<' if direction == 'next' else '>'
+        query += f' AND ({keys}) {operator} ({placeholders})'
+        params.extend(cursor[1])
+
+    order = 'DESC' if direction == 'next' else 'ASC'
+    query += keyset.order_by(order)
+    query += ' LIMIT %s'
+    params.append(page_size + 1)
+
+    statements.append((query, params))
+    results = fetch_batch(cur.connection, statements)
+    rows = results[-1]
+    estimated_total = _plan_rows(results[0][0][0]) if len(results) > 1 else None
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == 'prev':
+        rows.reverse()
+
+    next_token = prev_token = None
+    if rows:
+        has_next = has_more if direction == 'next' else True
+        has_prev = cursor is not None if direction == 'next' else has_more
+        if has_next:
+            next_token = encode_cursor('next', keyset.values(rows[-1]))
+        if has_prev:
+            prev_token = encode_cursor('prev', keyset.values(rows[0]))
+    elif cursor:
+        # Stepped past the end (e.g. rows deleted meanwhile): offer the way back
+        prev_token = encode_cursor('prev', cursor[1]) if direction == 'next' else None
+
+    return Page(rows, page_size, next_token, prev_token, estimated_total)
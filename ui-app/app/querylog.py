@@ -0,0 +1,205 @@
+import json
+import logging
+import re
+import time
+from collections import defaultdict
+
+from flask import current_app, g, has_request_context, request
+
+logger = logging.getLogger(__name__)
+
+# Statements kept per request for the log line (the counts and times
+# include the others)
+MAX_STATEMENTS = 500
+
+# Statements that have a plan (not EXPLAIN itself, SET, ...)
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_VALUE_LISTS = re.compile(r'\((?:\s*(?:\?|%s|%\(\w+\)s)\s*,)+\s*(?:\?|%s|%\(\w+\)s)\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+def redact(text):
+    """Replaces the string and number literals of SQL text by ?."""
+    return _LITERALS.sub('?', text)
+
+
+def normalize(query):
+    """
+    Statement text without its literal values, so the executions of one
+    statement group together: strings and numbers become ?, lists of
+    values (?, ?, ...) and runs of white space are collapsed.
+    """
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    query = _VALUE_LISTS.sub('(...)', redact(query))
+    return _SPACES.sub(' ', query).strip()
+
+
+class Statement:
+    """
+    One statement run for the request: normalized text, time and rows,
+    and its actual text and parameters when the trace keeps them.
+    """
+
+    __slots__ = ('sql', 'duration_ms', 'rows', 'query', 'params')
+
+    def __init__(self, sql, duration_ms, rows, query=None, params=None):
+        self.sql = sql
+        self.duration_ms = duration_ms
+        self.rows = rows
+        self.query = query
+        self.params = params
+
+
+class RequestTrace:
+    """
+    SQL statements of one request, with their totals. With `keep_params`
+    (set g.sql_keep_params before the request) the statements keep their
+    actual text and parameters, for tools that explain them again.
+    """
+
+    def __init__(self, keep_params=False):
+        self.keep_params = keep_params
+        self.start = time.perf_counter()
+        self.statements = []
+        self.count = 0
+        self.db_ms = 0.0
+        self.rows = 0
+
+    def add(self, query, duration_ms, rows, params=None):
+        self.count += 1
+        self.db_ms += duration_ms
+        # rowcount is -1 when unknown (DDL, server-side cursor before a fetch)
+        rows = max(rows or 0, 0)
+        self.rows += rows
+        if len(self.statements) >= MAX_STATEMENTS:
+            return None
+        statement = Statement(normalize(query), duration_ms, rows)
+        if self.keep_params:
+            statement.query, statement.params = query, params
+        self.statements.append(statement)
+        return statement
+
+    def repeated(self):
+        """(normalized text, executions, total ms) of the statements run more than once."""
+        groups = defaultdict(lambda: [0, 0.0])
+        for statement in self.statements:
+            group = groups[statement.sql]
+            group[0] += 1
+            group[1] += statement.duration_ms
+        return sorted(((sql, n, ms) for sql, (n, ms) in groups.items() if n > 1),
+                      key=lambda item: -item[1])
+
+
+def current_trace():
+    """Trace of the current request, or None outside requests or when disabled."""
+    if not has_request_context() or not current_app.config['SQL_TRACE_ENABLED']:
+        return None
+    if 'sql_trace' not in g:
+        g.sql_trace = RequestTrace(g.get('sql_keep_params', False))
+    return g.sql_trace
+
+
+def record(query, duration, rows, params=None):
+    """
+    Adds a statement to the current request's trace; `duration` in
+    seconds, `rows` as the cursor's rowcount. Returns the Statement
+    (for cursors that complete it later) or None.
+    """
+    trace = current_trace()
+    if trace is None:
+        return None
+    return trace.add(query, duration * 1000, rows, params)
+
+
+def add_fetch(statement, duration, rows):
+    """Adds the time and rows of a server-side cursor fetch to its statement."""
+    trace = current_trace()
+    if trace is None:
+        return
+    trace.db_ms += duration * 1000
+    trace.rows += rows
+    if statement is not None:
+        statement.duration_ms += duration * 1000
+        statement.rows += rows
+
+
+def _start_request():
+    current_trace()
+
+
+def _server_timing(response):
+    trace = g.get('sql_trace')
+    if trace is None:
+        return response
+    g.sql_status = response.status_code
+    if current_app.config['SERVER_TIMING_ENABLED']:
+        total_ms = (time.perf_counter() - trace.start) * 1000
+        timings = [f'db;dur={trace.db_ms:.1f};desc="{trace.count} SQL"']
+        if 'db_wait_ms' in g:
+            timings.append(f'db-wait;dur={g.db_wait_ms:.1f}')
+        timings.append(f'app;dur={total_ms:.1f}')
+        response.headers.add('Server-Timing', ', '.join(timings))
+    return response
+
+
+def _log_request(e=None):
+    """
+    One JSON log line per request (at the end, so streamed responses are
+    counted whole). Requests over SQL_QUERY_BUDGET statements or
+    SQL_TIME_BUDGET_MS of database time, or running one statement
+    SQL_REPEAT_BUDGET times or more (N+1), are logged as warnings with
+    their costliest statements.
+    """
+    trace = g.get('sql_trace')
+    if trace is None:
+        return
+    config = current_app.config
+    repeated = trace.repeated()
+    over = []
+    if trace.count > config['SQL_QUERY_BUDGET']:
+        over.append('queries')
+    if trace.db_ms > config['SQL_TIME_BUDGET_MS']:
+        over.append('db_time')
+    if repeated and repeated[0][1] >= config['SQL_REPEAT_BUDGET']:
+        over.append('repeated')
+
+    entry = {
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': g.get('sql_status', 500),
+        'duration_ms': round((time.perf_counter() - trace.start) * 1000, 1),
+        'db_ms': round(trace.db_ms, 1),
+        'queries': trace.count,
+        'rows': trace.rows,
+    }
+    if over:
+        entry['over_budget'] = over
+        entry['repeated'] = [{'sql': sql, 'count': n, 'ms': round(ms, 1)} for sql, n, ms in repeated[:5]]
+        entry['slowest'] = [{'sql': s.sql, 'ms': round(s.duration_ms, 1), 'rows': s.rows}
+                            for s in sorted(trace.statements, key=lambda s: -s.duration_ms)[:5]]
+        logger.warning('sql %s', json.dumps(entry, ensure_ascii=False))
+    else:
+        logger.info('sql %s', json.dumps(entry, ensure_ascii=False))
+
+
+def _configure_logger(level):
+    # Nothing else configures logging (gunicorn only sets up its own
+    # loggers): without a handler and a level the per-request INFO lines
+    # would be dropped and only the warnings printed.
+    logger.setLevel(level.upper())
+    if not logger.hasHandlers():
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        logger.addHandler(handler)
+
+
+def init_app(app):
+    """Trace the SQL of every request: Server-Timing header and log line."""
+    _configure_logger(app.config['SQL_LOG_LEVEL'])
+    app.before_request(_start_request)
+    app.after_request(_server_timing)
+    app.teardown_request(_log_request)
@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+import time
+
+import psycopg
+from flask import current_app, g
+
+from .db import fetch_batch, get_db
+from .metrics import count_cache
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY channel carrying the names of the tables whose lookups are stale
+CHANNEL = 'refdata'
+
+# Dropdown and filter lists: name -> (query, tables it depends on)
+LOOKUPS = {
+    'zones': ('SELECT id_zone, nom_zone FROM ZONE_URBAINE ORDER BY nom_zone',
+              ('ZONE_URBAINE',)),
+    'types': ('SELECT id_type, libelle_type FROM TYPE_BATIMENT ORDER BY libelle_type',
+              ('TYPE_BATIMENT',)),
+    'protections': ('SELECT id_protection, niveau FROM NIV_PROTECTION ORDER BY niveau',
+                    ('NIV_PROTECTION',)),
+    'proprietaires': ('SELECT id_proprio, nom_complet FROM PROPRIETAIRE ORDER BY nom_complet',
+                      ('PROPRIETAIRE',)),
+    'prestataires': ('SELECT id_prestataire, nom_entreprise, role_prest FROM PRESTATAIRE ORDER BY nom_entreprise',
+                     ('PRESTATAIRE',)),
+    'batiments': ('SELECT code_batiment, nom_batiment FROM BATIMENT ORDER BY nom_batiment',
+                  ('BATIMENT',)),
+    'etats': ('SELECT DISTINCT etat_constate FROM INSPECTION WHERE etat_constate IS NOT NULL ORDER BY etat_constate',
+              ('INSPECTION',)),
+    'statuts_travaux': ('SELECT DISTINCT statut_travaux FROM INTERVENTION WHERE statut_travaux IS NOT NULL ORDER BY statut_travaux',
+                        ('INTERVENTION',)),
+    'types_document': ('SELECT DISTINCT type_doc FROM DOCUMENT_MEDIA WHERE type_doc IS NOT NULL ORDER BY type_doc',
+                       ('DOCUMENT_MEDIA',)),
+    'roles_prestataire': ('SELECT DISTINCT role_prest FROM PRESTATAIRE WHERE role_prest IS NOT NULL ORDER BY role_prest',
+                          ('PRESTATAIRE',)),
+    'types_proprietaire': ('SELECT DISTINCT type_proprio FROM PROPRIETAIRE WHERE type_proprio IS NOT NULL ORDER BY type_proprio',
+                           ('PROPRIETAIRE',)),
+    'types_zone': ('SELECT DISTINCT type_zone FROM ZONE_URBAINE WHERE type_zone IS NOT NULL ORDER BY type_zone',
+                   ('ZONE_URBAINE',)),
+}
+
+
+class LookupCache:
+    """
+    Per-process cache of the lookup lists. Every invalidation bumps the
+    generation of the lists concerned, and a list loaded while its
+    generation moved is not stored (it may predate the change).
+
+    A list loaded for a page of the page cache is stored with the versions
+    of its tables that the page's ETag was built from (VERSION_DONNEES).
+    Such a page only takes a list stored with the same versions, so a write
+    that has not reached this worker through NOTIFY yet (or was never
+    notified: psql, a function run by hand) cannot put a stale list in a
+    page cached under the new ETag.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._generations = {name: 0 for name in LOOKUPS}
+
+    def get(self, name, ttl, versions=None):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and time.monotonic() - entry[0] < ttl and \
+                    (versions is None or entry[2] == versions):
+                return entry[1], None
+            return None, self._generations[name]
+
+    def put(self, name, rows, generation, versions=None):
+        with self._lock:
+            if self._generations[name] == generation:
+                self._entries[name] = (time.monotonic(), rows, versions)
+
+    def invalidate_tables(self, tables):
+        tables = {t.upper() for t in tables}
+        with self._lock:
+            for name, (_, depends_on) in LOOKUPS.items():
+                if tables.intersection(depends_on):
+                    self._entries.pop(name, None)
+                    self._generations[name] += 1
+
+    def clear(self):
+        self.invalidate_tables({t for _, tables in LOOKUPS.values() for t in tables})
+
+
+_cache = LookupCache()
+
+# Listener thread of the current process (restarted in forked workers)
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def lookup(name):
+    """Rows of a lookup list, from the cache when fresh."""
+    return lookups(name)[0]
+
+
+def lookups(*names):
+    """
+    Rows of several lookup lists, in order. The lists missing from the
+    cache are loaded together in one round trip.
+    """
+    config = current_app.config
+    if not config['REFDATA_CACHE_ENABLED']:
+        return _load(names)
+    _ensure_listener()
+    versions = [_versions(name) for name in names]
+    cached = [_cache.get(name, config['REFDATA_CACHE_TTL'], v) for name, v in zip(names, versions)]
+    missing = [i for i, (rows, _) in enumerate(cached) if rows is None]
+    count_cache('refdata', hits=len(names) - len(missing), misses=len(missing))
+    loaded = dict(zip(missing, _load([names[i] for i in missing])))
+    for i, rows in loaded.items():
+        _cache.put(names[i], rows, cached[i][1], versions[i])
+    return [loaded[i] if i in loaded else rows for i, (rows, _) in enumerate(cached)]
+
+
+def _versions(name):
+    """
+    Versions of the tables of a lookup read by the page cache for the
+    current page (see pagecache.page_etag), or None outside such a page.
+    """
+    page_versions = g.get('table_versions')
+    if page_versions is None:
+        return None
+    tables = LOOKUPS[name][1]
+    if not all(table in page_versions for table in tables):
+        return None
+    return tuple(page_versions[table] for table in tables)
+
+
+def _load(names):
+    if not names:
+        return []
+    return fetch_batch(get_db(), [(LOOKUPS[name][0], None) for name in names])
+
+
+def invalidate(*tables):
+    """
+    Drops the lookups depending on the tables, in this worker and (through
+    NOTIFY) in all the others. Call after committing the write.
+    """
+    _cache.invalidate_tables(tables)
+    conn = get_db()
+    try:
+        with conn.cursor() as cur:
+            for table in tables:
+                cur.execute('SELECT pg_notify(%s, %s)', (CHANNEL, table.upper()))
+        conn.commit()
+    except psycopg.Error:
+        # The write itself is committed; the other workers catch up at the TTL
+        conn.rollback()
+        logger.exception('Could not notify the reference data invalidation')
+
+
+def _ensure_listener():
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid != os.getpid():
+            thread = threading.Thread(target=_listen, args=(current_app.config['DATABASE_URL'],),
+                                      name='refdata-listener', daemon=True)
+            thread.start()
+            _listener_pid = os.getpid()
+
+
+def _listen(dsn):
+    """Applies the invalidations of the other workers; reconnects on failure."""
+    while True:
+        try:
+            with psycopg.connect(dsn, autocommit=True) as conn:
+                conn.execute(f'LISTEN {CHANNEL}')
+                # Notifications may have been missed while disconnected
+                _cache.clear()
+                for notify in conn.notifies():
+                    _cache.invalidate_tables([notify.payload])
+        except Exception:
+            logger.exception('Reference data listener disconnected, retrying')
+            _cache.clear()
+            time.sleep(5)
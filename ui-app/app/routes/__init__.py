@@ -8,6 +8,11 @@ from .protections import protections_bp
 from .proprietaires import proprietaires_bp
 from .types import types_bp
 from .documents import documents_bp
+from .search import search_bp
+from .api import api_bp
+from .tiles import tiles_bp
+from .imports import imports_bp
+from .admin import admin_bp
 
 __all__ = [
     'buildings_bp', 
@@ -19,5 +24,10 @@ __all__ = [
     'protections_bp',
     'proprietaires_bp',
     'types_bp',
-    'documents_bp'
+    'documents_bp',
+    'search_bp',
+    'api_bp',
+    'tiles_bp',
+    'imports_bp',
+    'admin_bp'
 ]
\ No newline at end of file
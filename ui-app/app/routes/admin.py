@@ -0,0 +1,66 @@
+import json
+
+from flask import Blueprint, Response, abort, flash, redirect, render_template, url_for
+from app.db import get_db
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+SLOW_QUERY_COLUMNS = 'numero, capturee_le, endpoint, chemin, duree_ms, requete, plan, erreur'
+
+
+@admin_bp.route('/slow-queries')
+def list_slow_queries():
+    """Plans of the slow statements captured by app.slowlog, newest first."""
+    cur = get_db().cursor()
+    cur.execute('''
+        SELECT numero, capturee_le, endpoint, chemin, duree_ms, requete,
+               (plan -> 0 ->> 'Execution Time')::numeric AS duree_plan_ms, erreur IS NOT NULL AS en_erreur
+        FROM REQUETE_LENTE
+        ORDER BY numero DESC
+    ''')
+    captures = cur.fetchall()
+    cur.close()
+    return render_template('admin/slow_queries.html', captures=captures)
+
+
+@admin_bp.route('/slow-queries/<int:numero>')
+def view_slow_query(numero):
+    """One captured statement with its plan."""
+    cur = get_db().cursor()
+    cur.execute(f'SELECT {SLOW_QUERY_COLUMNS} FROM REQUETE_LENTE WHERE numero = %s', (numero,))
+    capture = cur.fetchone()
+    cur.close()
+    if capture is None:
+        abort(404)
+    plan = capture[6][0] if capture[6] else None
+    return render_template('admin/slow_query.html', capture=capture, plan=plan,
+                           plan_json=json.dumps(capture[6], indent=2, ensure_ascii=False))
+
+
+@admin_bp.route('/slow-queries/export')
+def export_slow_queries():
+    """Every capture as a JSON file, plans included."""
+    cur = get_db().cursor()
+    cur.execute(f'SELECT {SLOW_QUERY_COLUMNS} FROM REQUETE_LENTE ORDER BY numero DESC')
+    names = [column.name for column in cur.description]
+    captures = [dict(zip(names, row)) for row in cur.fetchall()]
+    cur.close()
+    return Response(json.dumps(captures, default=str, ensure_ascii=False, indent=2),
+                    mimetype='application/json',
+                    headers={'Content-Disposition': 'attachment; filename=requetes_lentes.json'})
+
+
+@admin_bp.route('/slow-queries/clear', methods=['POST'])
+def clear_slow_queries():
+    """Empties the capture buffer."""
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM REQUETE_LENTE')
+        conn.commit()
+        cur.close()
+        flash('Requêtes lentes effacées.', 'success')
+    except Exception as e:
+        conn.rollback()
+        flash(f'Erreur lors de la suppression: {str(e)}', 'danger')
+    return redirect(url_for('admin.list_slow_queries'))
@@ -0,0 +1,421 @@
+import math
+
+from flask import Blueprint, Response, current_app, jsonify, request
+from app.db import get_db
+from app.dossier import fetch_dossier_json
+from app.tiles import mercator_position
+from app.pagecache import cached
+
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+ETAT_NON_INSPECTE = 'Non inspecté'
+
+# Buildings whose geometry falls in the bounding box, as a GeoJSON
+# FeatureCollection built by PostgreSQL (GiST index on BATIMENT.geom).
+# One row more than the limit is read to tell whether the viewport is over
+# it. If so, one building per cell of a grid (see marker_grid) is kept, the
+# lowest code of each cell, so the markers spread over the whole viewport
+# instead of being its lowest codes.
+MAP_BUILDINGS_QUERY = '''
+    WITH dans AS MATERIALIZED (
+        SELECT b.code_batiment, b.geom
+        FROM BATIMENT b
+        LEFT JOIN BATIMENT_ETAT_COURANT ec ON b.code_batiment = ec.code_batiment
+        WHERE b.geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+        {filters}
+    ),
+    tronque AS (
+        SELECT COUNT(*) > %s AS oui FROM (SELECT 1 FROM dans LIMIT %s) x
+    ),
+    retenus AS (
+        SELECT DISTINCT ON (c.cellule_x, c.cellule_y) d.code_batiment
+        FROM dans d
+        CROSS JOIN tronque t
+        CROSS JOIN LATERAL (SELECT
+            CASE WHEN t.oui THEN floor((ST_X(d.geom) + 180) / 360 * %s)
+                 ELSE d.code_batiment END AS cellule_x,
+            CASE WHEN t.oui THEN floor((1 - asinh(tan(radians(ST_Y(d.geom)))) / pi()) / 2 * %s)
+                 ELSE 0 END AS cellule_y) c
+        ORDER BY c.cellule_x, c.cellule_y, d.code_batiment
+        LIMIT %s
+    )
+    SELECT json_build_object(
+        'type', 'FeatureCollection',
+        'zoom', %s,
+        'features', COALESCE(json_agg(json_build_object(
+            'type', 'Feature',
+            'id', b.code_batiment,
+            'geometry', ST_AsGeoJSON(b.geom, 6)::json,
+            'properties', json_build_object(
+                'code', b.code_batiment,
+                'nom', b.nom_batiment,
+                'adresse', COALESCE(b.adresse_rue, 'N/A'),
+                'zone', COALESCE(z.nom_zone, 'N/A'),
+                'type', COALESCE(t.libelle_type, 'N/A'),
+                'protection', COALESCE(n.niveau, 'N/A'),
+                'etat', COALESCE(ec.etat_constate, %s))
+        ) ORDER BY b.code_batiment), '[]'),
+        'truncated', (SELECT oui FROM tronque)
+    )::text
+    FROM retenus r
+    JOIN BATIMENT b ON b.code_batiment = r.code_batiment
+    LEFT JOIN ZONE_URBAINE z ON b.id_zone = z.id_zone
+    LEFT JOIN TYPE_BATIMENT t ON b.id_type = t.id_type
+    LEFT JOIN NIV_PROTECTION n ON b.id_protection = n.id_protection
+    LEFT JOIN BATIMENT_ETAT_COURANT ec ON b.code_batiment = ec.code_batiment
+'''
+
+# Markers of a viewport over MAP_MAX_FEATURES are thinned to one per square
+# of this many cells per tile side (16 px squares on a 256 px tile)
+MARKER_CELLS_PER_TILE = 16
+
+
+# Buildings nearest to a point, closest first: KNN ordering (<->) on the
+# GiST index of geom::geography (MPD/update_proximite.sql), distances in
+# metres on the spheroid. With a radius, ST_DWithin on the same index.
+NEAR_BUILDINGS_QUERY = '''
+    WITH f AS (
+        SELECT b.code_batiment, b.nom_batiment, b.adresse_rue, b.geom,
+               z.nom_zone, t.libelle_type, n.niveau, ec.etat_constate,
+               ST_Distance(b.geom::geography, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography) AS distance
+        FROM BATIMENT b
+        LEFT JOIN ZONE_URBAINE z ON b.id_zone = z.id_zone
+        LEFT JOIN TYPE_BATIMENT t ON b.id_type = t.id_type
+        LEFT JOIN NIV_PROTECTION n ON b.id_protection = n.id_protection
+        LEFT JOIN BATIMENT_ETAT_COURANT ec ON b.code_batiment = ec.code_batiment
+        WHERE b.geom IS NOT NULL
+        {radius}
+        {filters}
+        ORDER BY b.geom::geography <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography
+        LIMIT %s
+    )
+    SELECT json_build_object(
+        'type', 'FeatureCollection',
+        'features', COALESCE(json_agg(json_build_object(
+            'type', 'Feature',
+            'id', code_batiment,
+            'geometry', ST_AsGeoJSON(geom, 6)::json,
+            'properties', json_build_object(
+                'code', code_batiment,
+                'nom', nom_batiment,
+                'adresse', COALESCE(adresse_rue, 'N/A'),
+                'zone', COALESCE(nom_zone, 'N/A'),
+                'type', COALESCE(libelle_type, 'N/A'),
+                'protection', COALESCE(niveau, 'N/A'),
+                'etat', COALESCE(etat_constate, %s),
+                'distance_m', round(distance::numeric, 1))
+        ) ORDER BY distance, code_batiment), '[]')
+    )::text
+    FROM f
+'''
+
+NEAR_RADIUS_FILTER = \
+    ' AND ST_DWithin(b.geom::geography, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography, %s)'
+
+# Buildings returned by /api/buildings/near without ?limit=
+NEAR_DEFAULT_LIMIT = 20
+
+# Zoom levels precomputed in CARTE_GRAPPE, and its cells per tile side
+# (see MPD/update_grappes.sql)
+CLUSTER_MAX_ZOOM = 16
+CLUSTER_CELLS_PER_TILE = 4
+
+# State columns of CARTE_GRAPPE
+CLUSTER_ETATS = {
+    'Bon': 'nb_bon',
+    'Moyen': 'nb_moyen',
+    'Dégradé': 'nb_degrade',
+    'En ruine': 'nb_ruine',
+    ETAT_NON_INSPECTE: 'nb_non_inspecte',
+}
+
+# Precomputed grid cells of the viewport, one GeoJSON point per cell at
+# the mean position of its buildings
+MAP_CLUSTERS_QUERY = '''
+    SELECT json_build_object(
+        'type', 'FeatureCollection',
+        'zoom', %s,
+        'features', COALESCE(json_agg(json_build_object(
+            'type', 'Feature',
+            'geometry', json_build_object(
+                'type', 'Point',
+                'coordinates', json_build_array(round((g.somme_lng / g.nb)::numeric, 6),
+                                                round((g.somme_lat / g.nb)::numeric, 6))),
+            'properties', json_build_object(
+                'count', {count},
+                'etats', json_build_object({etats}))
+        )), '[]')
+    )::text
+    FROM CARTE_GRAPPE g
+    WHERE g.zoom = %s
+      AND g.cellule_x BETWEEN %s AND %s
+      AND g.cellule_y BETWEEN %s AND %s
+      AND {count} > 0
+'''
+
+
+# Density of the degraded and ruined buildings: the CARTE_GRAPPE cells of
+# the viewport as GeoJSON squares. The grid is precomputed for every zoom,
+# so a whole region costs one index range scan whatever its size.
+HEATMAP_QUERY = '''
+    SELECT json_build_object(
+        'type', 'FeatureCollection',
+        'zoom', %s,
+        'cell_m', %s,
+        'max', COALESCE(MAX(c.count), 0),
+        'features', COALESCE(json_agg(json_build_object(
+            'type', 'Feature',
+            'geometry', json_build_object(
+                'type', 'Polygon',
+                'coordinates', json_build_array(json_build_array(
+                    json_build_array(c.ouest, c.nord), json_build_array(c.est, c.nord),
+                    json_build_array(c.est, c.sud), json_build_array(c.ouest, c.sud),
+                    json_build_array(c.ouest, c.nord)))),
+            'properties', json_build_object(
+                'count', c.count,
+                'etats', json_build_object('Dégradé', c.nb_degrade, 'En ruine', c.nb_ruine),
+                'total', c.nb,
+                'part', round(c.count::numeric / c.nb, 3))
+        )), '[]')
+    )::text
+    FROM (
+        SELECT g.nb_degrade + g.nb_ruine AS count, g.nb_degrade, g.nb_ruine, g.nb,
+               round((g.cellule_x * 360.0 / p.n - 180)::numeric, 6) AS ouest,
+               round(((g.cellule_x + 1) * 360.0 / p.n - 180)::numeric, 6) AS est,
+               round(degrees(atan(sinh(pi() * (1 - 2.0 * g.cellule_y / p.n))))::numeric, 6) AS nord,
+               round(degrees(atan(sinh(pi() * (1 - 2.0 * (g.cellule_y + 1) / p.n))))::numeric, 6) AS sud
+        FROM CARTE_GRAPPE g, (SELECT %s::float8 AS n) p
+        WHERE g.zoom = %s
+          AND g.cellule_x BETWEEN %s AND %s
+          AND g.cellule_y BETWEEN %s AND %s
+          AND g.nb_degrade + g.nb_ruine > 0
+    ) c
+'''
+
+# Equatorial circumference (metres) for the cell size of a grid zoom
+EARTH_CIRCUMFERENCE = 40075016.686
+
+
+def api_error(message, status=400):
+    """JSON error response of the API."""
+    return jsonify(error=message), status
+
+
+def parse_bbox(value):
+    """Parses 'min_lng,min_lat,max_lng,max_lat'; returns None when invalid."""
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(v) for v in value.split(','))
+    except (AttributeError, ValueError):
+        return None
+    if not (-180 <= min_lng <= max_lng <= 180 and -90 <= min_lat <= max_lat <= 90):
+        return None
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def parse_zoom(value):
+    """Parses a web-map zoom level (0-22); returns None when invalid."""
+    try:
+        zoom = int(value)
+    except (TypeError, ValueError):
+        return None
+    return zoom if 0 <= zoom <= 22 else None
+
+
+def parse_float(value, low, high):
+    """Parses a number between low and high; returns None when invalid."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if low <= number <= high else None
+
+
+def grid_cells(bbox, zoom):
+    """First and last CARTE_GRAPPE column and row overlapping the bbox at zoom."""
+    # Rows grow southwards
+    n = CLUSTER_CELLS_PER_TILE * 2 ** zoom
+    min_x, max_y = mercator_position(bbox[0], bbox[1], n)
+    max_x, min_y = mercator_position(bbox[2], bbox[3], n)
+    return [int(min(max(v, 0), n - 1)) for v in (min_x, max_x, min_y, max_y)]
+
+
+def cell_size(zoom, lat):
+    """Side in metres of a CARTE_GRAPPE cell of zoom at latitude lat."""
+    n = CLUSTER_CELLS_PER_TILE * 2 ** zoom
+    return EARTH_CIRCUMFERENCE * math.cos(math.radians(lat)) / n
+
+
+def resolution_zoom(resolution, lat):
+    """Grid zoom whose cells at latitude lat are closest to resolution metres."""
+    zoom = round(math.log2(cell_size(0, lat) / resolution))
+    return min(max(zoom, 0), CLUSTER_MAX_ZOOM)
+
+
+def marker_grid(bbox, zoom, limit):
+    """
+    Cells per side of the world of the grid thinning the markers of a
+    viewport over the limit: MARKER_CELLS_PER_TILE per tile at zoom, halved
+    until the bbox spans at most `limit` cells.
+    """
+    n = MARKER_CELLS_PER_TILE * 2 ** zoom
+    while n > 1:
+        min_x, max_y = mercator_position(bbox[0], bbox[1], n)
+        max_x, min_y = mercator_position(bbox[2], bbox[3], n)
+        if (int(max_x) - int(min_x) + 1) * (int(max_y) - int(min_y) + 1) <= limit:
+            break
+        n //= 2
+    return n
+
+
+def building_filters(args):
+    """SQL conditions and parameters for the zone, type, protection and etat filters."""
+    clauses = []
+    params = []
+    for arg, column in (('zone', 'b.id_zone'), ('type', 'b.id_type'),
+                        ('protection', 'b.id_protection')):
+        value = args.get(arg, '')
+        if value:
+            if not value.isdigit():
+                raise ValueError(arg)
+            clauses.append(f' AND {column} = %s')
+            params.append(int(value))
+    etat = args.get('etat', '')
+    if etat == ETAT_NON_INSPECTE:
+        clauses.append(' AND ec.etat_constate IS NULL')
+    elif etat:
+        clauses.append(' AND ec.etat_constate = %s')
+        params.append(etat)
+    return ''.join(clauses), params
+
+
+@api_bp.route('/map/buildings')
+def map_buildings():
+    """
+    GeoJSON of the buildings inside ?bbox=min_lng,min_lat,max_lng,max_lat;
+    over MAP_MAX_FEATURES, thinned on a grid of ?zoom= (see marker_grid).
+    """
+    bbox = parse_bbox(request.args.get('bbox'))
+    if bbox is None:
+        return api_error('bbox attendu: min_lng,min_lat,max_lng,max_lat (WGS84)')
+    zoom = parse_zoom(request.args.get('zoom'))
+    if zoom is None:
+        return api_error('zoom attendu: entier entre 0 et 22')
+    try:
+        filters, filter_params = building_filters(request.args)
+    except ValueError as e:
+        return api_error(f'filtre {e} invalide')
+
+    limit = current_app.config['MAP_MAX_FEATURES']
+    grid = marker_grid(bbox, zoom, limit)
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(MAP_BUILDINGS_QUERY.format(filters=filters),
+                (*bbox, *filter_params, limit, limit + 1, grid, grid, limit, zoom, ETAT_NON_INSPECTE))
+    geojson = cur.fetchone()[0]
+    cur.close()
+    return Response(geojson, mimetype='application/geo+json')
+
+
+@api_bp.route('/map/clusters')
+def map_clusters():
+    """Building clusters of the viewport with their count and mix of states."""
+    bbox = parse_bbox(request.args.get('bbox'))
+    if bbox is None:
+        return api_error('bbox attendu: min_lng,min_lat,max_lng,max_lat (WGS84)')
+    zoom = parse_zoom(request.args.get('zoom'))
+    if zoom is None or zoom > CLUSTER_MAX_ZOOM:
+        return api_error(f'zoom attendu: entier entre 0 et {CLUSTER_MAX_ZOOM}')
+    etat = request.args.get('etat', '')
+    if etat and etat not in CLUSTER_ETATS:
+        return api_error('filtre etat invalide')
+
+    cells = grid_cells(bbox, zoom)
+    count = f'g.{CLUSTER_ETATS[etat]}' if etat else 'g.nb'
+    etats = ', '.join(f"'{label}', g.{column}" for label, column in CLUSTER_ETATS.items()
+                      if not etat or label == etat)
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(MAP_CLUSTERS_QUERY.format(count=count, etats=etats), (zoom, zoom, *cells))
+    geojson = cur.fetchone()[0]
+    cur.close()
+    return Response(geojson, mimetype='application/geo+json')
+
+
+@api_bp.route('/map/heatmap')
+def map_heatmap():
+    """
+    Density of the degraded and ruined buildings in ?bbox=, on the grid of
+    ?zoom= or the one closest to ?resolution= metres.
+    """
+    bbox = parse_bbox(request.args.get('bbox'))
+    if bbox is None:
+        return api_error('bbox attendu: min_lng,min_lat,max_lng,max_lat (WGS84)')
+    lat = (bbox[1] + bbox[3]) / 2
+    if request.args.get('resolution'):
+        resolution = parse_float(request.args['resolution'], 1, EARTH_CIRCUMFERENCE)
+        if resolution is None:
+            return api_error('resolution attendue: taille de cellule en mètres')
+        zoom = resolution_zoom(resolution, lat)
+    else:
+        zoom = parse_zoom(request.args.get('zoom'))
+        if zoom is None or zoom > CLUSTER_MAX_ZOOM:
+            return api_error(f'zoom attendu: entier entre 0 et {CLUSTER_MAX_ZOOM}')
+
+    cells = grid_cells(bbox, zoom)
+    max_cells = current_app.config['HEATMAP_MAX_CELLS']
+    if (cells[1] - cells[0] + 1) * (cells[3] - cells[2] + 1) > max_cells:
+        return api_error(f'plus de {max_cells} cellules: réduisez la zone ou la résolution')
+
+    n = CLUSTER_CELLS_PER_TILE * 2 ** zoom
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(HEATMAP_QUERY, (zoom, round(cell_size(zoom, lat)), n, zoom, *cells))
+    geojson = cur.fetchone()[0]
+    cur.close()
+    return Response(geojson, mimetype='application/geo+json')
+
+
+@api_bp.route('/buildings/near')
+def buildings_near():
+    """The buildings nearest to ?lat=&lng=, within ?radius= metres if given, closest first."""
+    lat = parse_float(request.args.get('lat'), -90, 90)
+    lng = parse_float(request.args.get('lng'), -180, 180)
+    if lat is None or lng is None:
+        return api_error('lat et lng attendus (WGS84)')
+    radius = None
+    if request.args.get('radius'):
+        radius = parse_float(request.args['radius'], 0, 20000000)
+        if not radius:
+            return api_error('radius attendu: distance en mètres')
+    max_results = current_app.config['NEAR_MAX_RESULTS']
+    limit = request.args.get('limit', str(NEAR_DEFAULT_LIMIT))
+    if not limit.isdigit() or not 1 <= int(limit) <= max_results:
+        return api_error(f'limit attendu: entier entre 1 et {max_results}')
+    limit = int(limit)
+    try:
+        filters, filter_params = building_filters(request.args)
+    except ValueError as e:
+        return api_error(f'filtre {e} invalide')
+
+    radius_params = [lng, lat, radius] if radius else []
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(NEAR_BUILDINGS_QUERY.format(radius=NEAR_RADIUS_FILTER if radius else '', filters=filters),
+                (lng, lat, *radius_params, *filter_params, lng, lat, limit, ETAT_NON_INSPECTE))
+    geojson = cur.fetchone()[0]
+    cur.close()
+    return Response(geojson, mimetype='application/geo+json')
+
+
+@api_bp.route('/buildings/<int:id>')
+@cached('BATIMENT', 'INSPECTION', 'INTERVENTION', 'DOCUMENT_MEDIA', 'ZONE_URBAINE',
+        'TYPE_BATIMENT', 'NIV_PROTECTION', 'PROPRIETAIRE', 'PRESTATAIRE')
+def building_dossier(id):
+    """A building with its inspections, interventions and documents."""
+    conn = get_db()
+    cur = conn.cursor()
+    dossier = fetch_dossier_json(cur, id)
+    cur.close()
+    if dossier is None:
+        return api_error('bâtiment non trouvé', 404)
+    return Response(dossier, mimetype='application/json')
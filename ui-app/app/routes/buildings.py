@@ -1,34 +1,37 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, abort, render_template, request, redirect, url_for, flash
 from app.db import get_db
+from app.export import FORMATS as EXPORT_FORMATS, export_response
+from app.dossier import load_dossier
+from app.refdata import invalidate, lookups
+from app.pagination import Keyset, paginate
+from app.search import search_condition
+from app.pagecache import cached
 
 buildings_bp = Blueprint('buildings', __name__, url_prefix='/buildings')
 
-@buildings_bp.route('/')
-def list_buildings():
-    """List all buildings with search and filtering."""
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # Get filter parameters from URL
-    search = request.args.get('search', '').strip()
-    zone_filter = request.args.get('zone', '')
-    type_filter = request.args.get('type', '')
-    protection_filter = request.args.get('protection', '')
-    etat_filter = request.args.get('etat', '')
+# Newest buildings first, as before pagination
+BUILDINGS_KEYSET = Keyset(['b.code_batiment'], positions=[0])
+
+def buildings_query(args):
+    """The building list query (without ORDER BY) and its parameters for the filters in `args`."""
+    search = args.get('search', '').strip()
+    zone_filter = args.get('zone', '')
+    type_filter = args.get('type', '')
+    protection_filter = args.get('protection', '')
+    etat_filter = args.get('etat', '')
     
     # Base query
     query = '''
-        SELECT DISTINCT b.code_batiment, b.nom_batiment, b.adresse_rue, 
+        SELECT b.code_batiment, b.nom_batiment, b.adresse_rue, 
                z.nom_zone, t.libelle_type, n.niveau, p.nom_complet,
                b.latitude, b.longitude,
-               (SELECT i.etat_constate FROM INSPECTION i 
-                WHERE i.code_batiment = b.code_batiment 
-                ORDER BY i.date_visite DESC LIMIT 1) as dernier_etat
+               ec.etat_constate as dernier_etat
         FROM BATIMENT b
         LEFT JOIN ZONE_URBAINE z ON b.id_zone = z.id_zone
         LEFT JOIN TYPE_BATIMENT t ON b.id_type = t.id_type
         LEFT JOIN NIV_PROTECTION n ON b.id_protection = n.id_protection
         LEFT JOIN PROPRIETAIRE p ON b.id_proprio = p.id_proprio
+        LEFT JOIN BATIMENT_ETAT_COURANT ec ON b.code_batiment = ec.code_batiment
         WHERE 1=1
     '''
     
@@ -36,14 +39,13 @@ def list_buildings():
     
     # Add search condition
     if search:
-        query += ''' AND (
-            LOWER(b.nom_batiment) LIKE LOWER(%s) OR 
-            LOWER(b.adresse_rue) LIKE LOWER(%s) OR
-            LOWER(z.nom_zone) LIKE LOWER(%s) OR
-            CAST(b.code_batiment AS TEXT) LIKE %s
-        )'''
-        search_param = f'%{search}%'
-        params.extend([search_param, search_param, search_param, search_param])
+        clause, search_params = search_condition(
+            search,
+            columns=['b.nom_batiment', 'b.adresse_rue'],
+            id_columns=['b.code_batiment'],
+            related=[('b.id_zone', 'ZONE_URBAINE', 'id_zone', ['nom_zone'])])
+        query += clause
+        params.extend(search_params)
     
     # Add zone filter
     if zone_filter:
@@ -62,41 +64,37 @@ def list_buildings():
     
     # Add etat filter (based on latest inspection)
     if etat_filter:
-        query += '''
-            AND b.code_batiment IN (
-                SELECT i.code_batiment FROM INSPECTION i
-                WHERE i.etat_constate = %s
-                AND i.date_visite = (
-                    SELECT MAX(i2.date_visite) FROM INSPECTION i2 
-                    WHERE i2.code_batiment = i.code_batiment
-                )
-            )
-        '''
+        query += ' AND ec.etat_constate = %s'
         params.append(etat_filter)
     
-    query += ' ORDER BY b.code_batiment DESC'
-    
-    cur.execute(query, params)
-    buildings = cur.fetchall()
+    return query, params
+
+@buildings_bp.route('/')
+@cached('BATIMENT', 'INSPECTION', 'ZONE_URBAINE', 'TYPE_BATIMENT', 'NIV_PROTECTION', 'PROPRIETAIRE')
+def list_buildings():
+    """List all buildings with search and filtering."""
+    conn = get_db()
+    cur = conn.cursor()
     
-    # Get dropdown data for filters
-    cur.execute('SELECT id_zone, nom_zone FROM ZONE_URBAINE ORDER BY nom_zone')
-    zones = cur.fetchall()
+    # Get filter parameters from URL
+    search = request.args.get('search', '').strip()
+    zone_filter = request.args.get('zone', '')
+    type_filter = request.args.get('type', '')
+    protection_filter = request.args.get('protection', '')
+    etat_filter = request.args.get('etat', '')
     
-    cur.execute('SELECT id_type, libelle_type FROM TYPE_BATIMENT ORDER BY libelle_type')
-    types = cur.fetchall()
+    query, params = buildings_query(request.args)
     
-    cur.execute('SELECT id_protection, niveau FROM NIV_PROTECTION ORDER BY niveau')
-    protections = cur.fetchall()
+    page = paginate(cur, query, params, BUILDINGS_KEYSET)
     
-    # Get distinct etats from inspections
-    cur.execute('SELECT DISTINCT etat_constate FROM INSPECTION WHERE etat_constate IS NOT NULL ORDER BY etat_constate')
-    etats = cur.fetchall()
+    # Get dropdown data for filters (distinct etats from inspections)
+    zones, types, protections, etats = lookups('zones', 'types', 'protections', 'etats')
     
     cur.close()
     
     return render_template('buildings/list.html', 
-                          buildings=buildings,
+                          buildings=page.rows,
+                          page=page,
                           zones=zones,
                           types=types,
                           protections=protections,
@@ -108,6 +106,15 @@ def list_buildings():
                           current_protection=protection_filter,
                           current_etat=etat_filter)
 
+@buildings_bp.route('/export')
+def export_buildings():
+    """Export the filtered building list as CSV or NDJSON (?format=)."""
+    file_format = request.args.get('format', 'csv')
+    if file_format not in EXPORT_FORMATS:
+        abort(400)
+    query, params = buildings_query(request.args)
+    return export_response(query + BUILDINGS_KEYSET.order_by(), params, file_format, 'batiments')
+
 @buildings_bp.route('/add', methods=['GET', 'POST'])
 def add_building():
     """Add a new building."""
@@ -135,16 +142,11 @@ def add_building():
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             ''', (nom, adresse, latitude, longitude, date_construction, note,
                   id_zone, id_type, id_protection, id_proprio))
-            
-            # Update geometry if coordinates provided
-            if latitude and longitude:
-                cur.execute('''
-                    UPDATE BATIMENT 
-                    SET geom = ST_SetSRID(ST_MakePoint(%s, %s), 4326)
-                    WHERE code_batiment = (SELECT MAX(code_batiment) FROM BATIMENT)
-                ''', (longitude, latitude))
+
+            # geom is set from latitude/longitude by the batiment_geom trigger
             
             conn.commit()
+            invalidate('BATIMENT')
             flash('Bâtiment ajouté avec succès!', 'success')
             return redirect(url_for('buildings.list_buildings'))
         except Exception as e:
@@ -154,79 +156,32 @@ def add_building():
             cur.close()
     
     # GET: Load dropdown data
-    cur.execute('SELECT id_zone, nom_zone FROM ZONE_URBAINE ORDER BY nom_zone')
-    zones = cur.fetchall()
-    cur.execute('SELECT id_type, libelle_type FROM TYPE_BATIMENT ORDER BY libelle_type')
-    types = cur.fetchall()
-    cur.execute('SELECT id_protection, niveau FROM NIV_PROTECTION ORDER BY niveau')
-    protections = cur.fetchall()
-    cur.execute('SELECT id_proprio, nom_complet FROM PROPRIETAIRE ORDER BY nom_complet')
-    proprietaires = cur.fetchall()
+    zones, types, protections, proprietaires = lookups(
+        'zones', 'types', 'protections', 'proprietaires')
     cur.close()
     
     return render_template('buildings/add.html', zones=zones, types=types, 
                           protections=protections, proprietaires=proprietaires)
 
 @buildings_bp.route('/view/<int:id>')
+@cached('BATIMENT', 'INSPECTION', 'INTERVENTION', 'DOCUMENT_MEDIA', 'ZONE_URBAINE',
+        'TYPE_BATIMENT', 'NIV_PROTECTION', 'PROPRIETAIRE', 'PRESTATAIRE')
 def view_building(id):
     """View a single building with all details."""
     conn = get_db()
     cur = conn.cursor()
+    dossier = load_dossier(cur, id)
+    cur.close()
     
-    # Get building details
-    cur.execute('''
-        SELECT b.code_batiment, b.nom_batiment, b.adresse_rue, 
-               b.latitude, b.longitude, b.date_construction, b.note_historique,
-               z.nom_zone, t.libelle_type, n.niveau, p.nom_complet, p.type_proprio
-        FROM BATIMENT b
-        LEFT JOIN ZONE_URBAINE z ON b.id_zone = z.id_zone
-        LEFT JOIN TYPE_BATIMENT t ON b.id_type = t.id_type
-        LEFT JOIN NIV_PROTECTION n ON b.id_protection = n.id_protection
-        LEFT JOIN PROPRIETAIRE p ON b.id_proprio = p.id_proprio
-        WHERE b.code_batiment = %s
-    ''', (id,))
-    building = cur.fetchone()
-    
-    if not building:
+    if not dossier:
         flash('Bâtiment non trouvé!', 'warning')
         return redirect(url_for('buildings.list_buildings'))
     
-    # Get inspections for this building
-    cur.execute('''
-        SELECT id_inspect, date_visite, etat_constate, rapport
-        FROM INSPECTION 
-        WHERE code_batiment = %s 
-        ORDER BY date_visite DESC
-    ''', (id,))
-    inspections = cur.fetchall()
-    
-    # Get interventions for this building
-    cur.execute('''
-        SELECT i.id_interv, i.date_debut, i.date_fin, i.type_travaux, 
-               i.cout_estime, i.est_validee, i.statut_travaux,
-               p.nom_entreprise, p.role_prest
-        FROM INTERVENTION i
-        LEFT JOIN PRESTATAIRE p ON i.id_prestataire = p.id_prestataire
-        WHERE i.code_batiment = %s 
-        ORDER BY i.date_debut DESC
-    ''', (id,))
-    interventions = cur.fetchall()
-    
-    # Get documents/media for this building
-    cur.execute('''
-        SELECT id_doc, titre_doc, type_doc, url_fichier
-        FROM DOCUMENT_MEDIA
-        WHERE code_batiment = %s
-        ORDER BY id_doc DESC
-    ''', (id,))
-    documents = cur.fetchall()
-    
-    cur.close()
     return render_template('buildings/view.html', 
-                          building=building, 
-                          inspections=inspections, 
-                          interventions=interventions,
-                          documents=documents)
+                          building=dossier['batiment'], 
+                          inspections=dossier['inspections'], 
+                          interventions=dossier['interventions'],
+                          documents=dossier['documents'])
 
 @buildings_bp.route('/edit/<int:id>', methods=['GET', 'POST'])
 def edit_building(id):
@@ -255,16 +210,11 @@ def edit_building(id):
                 WHERE code_batiment = %s
             ''', (nom, adresse, latitude, longitude, date_construction, note,
                   id_zone, id_type, id_protection, id_proprio, id))
-            
-            # Update geometry if coordinates changed
-            if latitude and longitude:
-                cur.execute('''
-                    UPDATE BATIMENT 
-                    SET geom = ST_SetSRID(ST_MakePoint(%s, %s), 4326)
-                    WHERE code_batiment = %s
-                ''', (longitude, latitude, id))
+
+            # geom is set from latitude/longitude by the batiment_geom trigger
             
             conn.commit()
+            invalidate('BATIMENT')
             flash('Bâtiment modifié avec succès!', 'success')
             return redirect(url_for('buildings.view_building', id=id))
         except Exception as e:
@@ -275,7 +225,10 @@ def edit_building(id):
     
     # GET: Load building data and dropdown options
     cur.execute('''
-        SELECT b.*, z.id_zone, t.id_type, n.id_protection, p.id_proprio
+        SELECT b.code_batiment, b.nom_batiment, b.adresse_rue,
+               b.latitude, b.longitude, b.date_construction, b.note_historique,
+               b.id_zone, b.id_type, b.id_protection, b.id_proprio,
+               z.id_zone, t.id_type, n.id_protection, p.id_proprio
         FROM BATIMENT b
         LEFT JOIN ZONE_URBAINE z ON b.id_zone = z.id_zone
         LEFT JOIN TYPE_BATIMENT t ON b.id_type = t.id_type
@@ -289,14 +242,8 @@ def edit_building(id):
         flash('Bâtiment non trouvé!', 'warning')
         return redirect(url_for('buildings.list_buildings'))
     
-    cur.execute('SELECT id_zone, nom_zone FROM ZONE_URBAINE ORDER BY nom_zone')
-    zones = cur.fetchall()
-    cur.execute('SELECT id_type, libelle_type FROM TYPE_BATIMENT ORDER BY libelle_type')
-    types = cur.fetchall()
-    cur.execute('SELECT id_protection, niveau FROM NIV_PROTECTION ORDER BY niveau')
-    protections = cur.fetchall()
-    cur.execute('SELECT id_proprio, nom_complet FROM PROPRIETAIRE ORDER BY nom_complet')
-    proprietaires = cur.fetchall()
+    zones, types, protections, proprietaires = lookups(
+        'zones', 'types', 'protections', 'proprietaires')
     cur.close()
     
     return render_template('buildings/edit.html', 
@@ -319,6 +266,7 @@ def delete_building(id):
         cur.execute('DELETE FROM INSPECTION WHERE code_batiment = %s', (id,))
         cur.execute('DELETE FROM BATIMENT WHERE code_batiment = %s', (id,))
         conn.commit()
+        invalidate('BATIMENT', 'INSPECTION', 'INTERVENTION', 'DOCUMENT_MEDIA')
         flash('Bâtiment supprimé avec succès!', 'success')
     except Exception as e:
         conn.rollback()
@@ -1,18 +1,21 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, abort, render_template, request, redirect, url_for, flash
 from app.db import get_db
+from app.export import FORMATS as EXPORT_FORMATS, export_response
+from app.refdata import invalidate, lookup
+from app.pagination import Keyset, paginate
+from app.search import search_condition
+from app.pagecache import cached
 
 documents_bp = Blueprint('documents', __name__, url_prefix='/documents')
 
-@documents_bp.route('/')
-def list_all_documents():
-    """List all documents with search and filtering."""
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # Get filter parameters
-    search = request.args.get('search', '').strip()
-    type_filter = request.args.get('type_doc', '')
-    building_filter = request.args.get('building', '')
+# Most recently added documents first
+DOCUMENTS_KEYSET = Keyset(['d.id_doc'], positions=[0])
+
+def documents_query(args):
+    """The document list query (without ORDER BY) and its parameters for the filters in `args`."""
+    search = args.get('search', '').strip()
+    type_filter = args.get('type_doc', '')
+    building_filter = args.get('building', '')
     
     # Base query
     query = '''
@@ -25,8 +28,12 @@ def list_all_documents():
     params = []
     
     if search:
-        query += ' AND (LOWER(d.titre_doc) LIKE LOWER(%s) OR LOWER(b.nom_batiment) LIKE LOWER(%s))'
-        params.extend([f'%{search}%', f'%{search}%'])
+        clause, search_params = search_condition(
+            search,
+            columns=['d.titre_doc'],
+            related=[('d.code_batiment', 'BATIMENT', 'code_batiment', ['nom_batiment'])])
+        query += clause
+        params.extend(search_params)
     
     if type_filter:
         query += ' AND d.type_doc = %s'
@@ -36,29 +43,51 @@ def list_all_documents():
         query += ' AND d.code_batiment = %s'
         params.append(building_filter)
     
-    query += ' ORDER BY d.id_doc DESC'
+    return query, params
+
+@documents_bp.route('/')
+@cached('DOCUMENT_MEDIA', 'BATIMENT')
+def list_all_documents():
+    """List all documents with search and filtering."""
+    conn = get_db()
+    cur = conn.cursor()
     
-    cur.execute(query, params)
-    documents = cur.fetchall()
+    # Get filter parameters
+    search = request.args.get('search', '').strip()
+    type_filter = request.args.get('type_doc', '')
+    building_filter = request.args.get('building', '')
+    
+    query, params = documents_query(request.args)
+    
+    page = paginate(cur, query, params, DOCUMENTS_KEYSET)
     
     # Get filter dropdown data
-    cur.execute('SELECT DISTINCT type_doc FROM DOCUMENT_MEDIA WHERE type_doc IS NOT NULL ORDER BY type_doc')
-    types = cur.fetchall()
+    types = lookup('types_document')
     
-    cur.execute('SELECT code_batiment, nom_batiment FROM BATIMENT ORDER BY nom_batiment')
-    buildings = cur.fetchall()
+    buildings = lookup('batiments')
     
     cur.close()
     
     return render_template('documents/list_all.html',
-                          documents=documents,
+                          documents=page.rows,
+                          page=page,
                           types=types,
                           buildings=buildings,
                           current_search=search,
                           current_type=type_filter,
                           current_building=building_filter)
 
+@documents_bp.route('/export')
+def export_documents():
+    """Export the filtered document list as CSV or NDJSON (?format=)."""
+    file_format = request.args.get('format', 'csv')
+    if file_format not in EXPORT_FORMATS:
+        abort(400)
+    query, params = documents_query(request.args)
+    return export_response(query + DOCUMENTS_KEYSET.order_by(), params, file_format, 'documents')
+
 @documents_bp.route('/building/<int:building_id>')
+@cached('DOCUMENT_MEDIA', 'BATIMENT')
 def list_documents(building_id):
     """List documents for a building."""
     conn = get_db()
@@ -107,6 +136,7 @@ def add_document(building_id):
                 VALUES (%s, %s, %s, %s)
             ''', (titre, type_doc, url_fichier, building_id))
             conn.commit()
+            invalidate('DOCUMENT_MEDIA')
             cur.close()
             flash('Document ajouté!', 'success')
             return redirect(url_for('buildings.view_building', id=building_id))
@@ -122,6 +152,7 @@ def add_document(building_id):
                           types=types)
 
 @documents_bp.route('/view/<int:id>')
+@cached('DOCUMENT_MEDIA', 'BATIMENT')
 def view_document(id):
     """View a document."""
     conn = get_db()
@@ -163,6 +194,7 @@ def edit_document(id):
                 WHERE id_doc = %s
             ''', (titre, type_doc, url_fichier, id))
             conn.commit()
+            invalidate('DOCUMENT_MEDIA')
             cur.close()
             flash('Document modifié!', 'success')
             return redirect(url_for('documents.view_document', id=id))
@@ -203,6 +235,7 @@ def delete_document(id):
     try:
         cur.execute('DELETE FROM DOCUMENT_MEDIA WHERE id_doc = %s', (id,))
         conn.commit()
+        invalidate('DOCUMENT_MEDIA')
         flash('Document supprimé!', 'success')
     except Exception as e:
         conn.rollback()
@@ -233,6 +266,7 @@ def add_document_global():
         ''', (titre, type_doc, url_fichier, building_id))
         new_id = cur.fetchone()[0]
         conn.commit()
+        invalidate('DOCUMENT_MEDIA')
         flash(f'Document "{titre}" ajouté avec succès! (ID: {new_id})', 'success')
     except Exception as e:
         conn.rollback()
@@ -0,0 +1,47 @@
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash
+from werkzeug.exceptions import RequestEntityTooLarge
+from app.db import get_db
+from app.importer import (FORMATS, KINDS, ImportFileError, detect_format, import_file,
+                          open_upload, upload_size)
+
+imports_bp = Blueprint('imports', __name__, url_prefix='/imports')
+
+@imports_bp.route('/', methods=['GET', 'POST'])
+def import_data():
+    """Bulk import of buildings, inspections or interventions from a CSV or GeoJSON file."""
+    report = None
+    kind = request.form.get('kind', 'buildings')
+    
+    if request.method == 'POST':
+        upload = request.files.get('fichier')
+        file_format = request.form.get('format') or detect_format(upload.filename if upload else '')
+        if kind not in KINDS or file_format not in FORMATS:
+            flash('Type de données ou format invalide!', 'danger')
+        elif not upload or not upload.filename:
+            flash('Veuillez choisir un fichier!', 'warning')
+        elif (file_format == 'geojson'
+              and upload_size(upload) > current_app.config['MAX_GEOJSON_UPLOAD_LENGTH']):
+            flash(f"Fichier refusé: GeoJSON de plus de "
+                  f"{current_app.config['MAX_GEOJSON_UPLOAD_LENGTH'] // (1024 * 1024)} Mo "
+                  f"(le découper ou le convertir en CSV)", 'danger')
+        else:
+            try:
+                report = import_file(get_db(), kind, open_upload(upload), file_format,
+                                     upload.filename)
+                flash(f'{report.imported} ligne(s) importée(s), {report.rejected} rejetée(s).',
+                      'success' if not report.rejected else 'warning')
+            except ImportFileError as e:
+                flash(f'Fichier refusé: {e}', 'danger')
+            except Exception as e:
+                flash(f'Erreur lors de l\'import: {str(e)}', 'danger')
+    
+    return render_template('imports/index.html', report=report, kind=kind,
+                          kinds=KINDS, formats=FORMATS)
+
+
+@imports_bp.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """Uploads over MAX_CONTENT_LENGTH are refused before being read."""
+    flash(f"Fichier refusé: plus de "
+          f"{current_app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} Mo", 'danger')
+    return redirect(url_for('imports.import_data'))
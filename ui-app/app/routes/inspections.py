@@ -1,20 +1,24 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, abort, render_template, request, redirect, url_for, flash
 from app.db import get_db
+from app.export import FORMATS as EXPORT_FORMATS, export_response
+from app.refdata import invalidate, lookup
+from app.pagination import Keyset, paginate
+from app.search import search_condition, fulltext_condition
+from app.pagecache import cached
 
 inspections_bp = Blueprint('inspections', __name__, url_prefix='/inspections')
 
-@inspections_bp.route('/')
-def list_inspections():
-    """List all inspections with search and filtering."""
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # Get filter parameters
-    search = request.args.get('search', '').strip()
-    etat_filter = request.args.get('etat', '')
-    building_filter = request.args.get('building', '')
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
+# Latest visits first; id_inspect breaks ties between visits of the same day
+INSPECTIONS_KEYSET = Keyset(['i.date_visite', 'i.id_inspect'], positions=[1, 0])
+
+def inspections_query(args):
+    """The inspection list query (without ORDER BY) and its parameters for the filters in `args`."""
+    search = args.get('search', '').strip()
+    search_mode = args.get('mode', '')
+    etat_filter = args.get('etat', '')
+    building_filter = args.get('building', '')
+    date_from = args.get('date_from', '')
+    date_to = args.get('date_to', '')
     
     # Base query
     query = '''
@@ -28,14 +32,19 @@ def list_inspections():
     params = []
     
     # Search
-    if search:
-        query += ''' AND (
-            LOWER(b.nom_batiment) LIKE LOWER(%s) OR 
-            LOWER(i.rapport) LIKE LOWER(%s) OR
-            CAST(i.id_inspect AS TEXT) LIKE %s
-        )'''
-        search_param = f'%{search}%'
-        params.extend([search_param, search_param, search_param])
+    if search and search_mode == 'texte':
+        # French full-text search in the reports (stemmed, accent-insensitive)
+        clause, search_params = fulltext_condition(search, 'i.rapport_tsv')
+        query += clause
+        params.extend(search_params)
+    elif search:
+        clause, search_params = search_condition(
+            search,
+            columns=['i.rapport'],
+            id_columns=['i.id_inspect'],
+            related=[('i.code_batiment', 'BATIMENT', 'code_batiment', ['nom_batiment'])])
+        query += clause
+        params.extend(search_params)
     
     # État filter
     if etat_filter:
@@ -56,30 +65,55 @@ def list_inspections():
         query += ' AND i.date_visite <= %s'
         params.append(date_to)
     
-    query += ' ORDER BY i.date_visite DESC'
+    return query, params
+
+@inspections_bp.route('/')
+@cached('INSPECTION', 'BATIMENT')
+def list_inspections():
+    """List all inspections with search and filtering."""
+    conn = get_db()
+    cur = conn.cursor()
+    
+    # Get filter parameters
+    search = request.args.get('search', '').strip()
+    search_mode = request.args.get('mode', '')
+    etat_filter = request.args.get('etat', '')
+    building_filter = request.args.get('building', '')
+    date_from = request.args.get('date_from', '')
+    date_to = request.args.get('date_to', '')
     
-    cur.execute(query, params)
-    inspections = cur.fetchall()
+    query, params = inspections_query(request.args)
+    
+    page = paginate(cur, query, params, INSPECTIONS_KEYSET)
     
     # Get filter dropdown data
-    cur.execute('SELECT DISTINCT etat_constate FROM INSPECTION WHERE etat_constate IS NOT NULL ORDER BY etat_constate')
-    etats = cur.fetchall()
+    etats = lookup('etats')
     
-    cur.execute('SELECT code_batiment, nom_batiment FROM BATIMENT ORDER BY nom_batiment')
-    buildings = cur.fetchall()
+    buildings = lookup('batiments')
     
     cur.close()
     
     return render_template('inspections/list.html',
-                          inspections=inspections,
+                          inspections=page.rows,
+                          page=page,
                           etats=etats,
                           buildings=buildings,
                           current_search=search,
+                          current_mode=search_mode,
                           current_etat=etat_filter,
                           current_building=building_filter,
                           current_date_from=date_from,
                           current_date_to=date_to)
 
+@inspections_bp.route('/export')
+def export_inspections():
+    """Export the filtered inspection list as CSV or NDJSON (?format=)."""
+    file_format = request.args.get('format', 'csv')
+    if file_format not in EXPORT_FORMATS:
+        abort(400)
+    query, params = inspections_query(request.args)
+    return export_response(query + INSPECTIONS_KEYSET.order_by(), params, file_format, 'inspections')
+
 @inspections_bp.route('/add', methods=['GET', 'POST'])
 def add_inspection():
     """Add a new inspection."""
@@ -98,6 +132,7 @@ def add_inspection():
                 VALUES (%s, %s, %s, %s)
             ''', (date_visite, rapport, etat_constate, code_batiment))
             conn.commit()
+            invalidate('INSPECTION')
             flash('Inspection ajoutée avec succès!', 'success')
             return redirect(url_for('inspections.list_inspections'))
         except Exception as e:
@@ -107,21 +142,22 @@ def add_inspection():
             cur.close()
     
     # GET: Load buildings for dropdown
-    cur.execute('SELECT code_batiment, nom_batiment FROM BATIMENT ORDER BY nom_batiment')
-    buildings = cur.fetchall()
+    buildings = lookup('batiments')
     cur.close()
     
     etats = ['Bon', 'Moyen', 'Dégradé', 'En ruine']
     return render_template('inspections/add.html', buildings=buildings, etats=etats)
 
 @inspections_bp.route('/view/<int:id>')
+@cached('INSPECTION', 'BATIMENT')
 def view_inspection(id):
     """View inspection details."""
     conn = get_db()
     cur = conn.cursor()
     
     cur.execute('''
-        SELECT i.*, b.nom_batiment, b.adresse_rue
+        SELECT i.id_inspect, i.date_visite, i.etat_constate, i.rapport,
+               i.code_batiment, b.nom_batiment, b.adresse_rue
         FROM INSPECTION i
         JOIN BATIMENT b ON i.code_batiment = b.code_batiment
         WHERE i.id_inspect = %s
@@ -144,6 +180,7 @@ def delete_inspection(id):
     try:
         cur.execute('DELETE FROM INSPECTION WHERE id_inspect = %s', (id,))
         conn.commit()
+        invalidate('INSPECTION')
         flash('Inspection supprimée avec succès!', 'success')
     except Exception as e:
         conn.rollback()
@@ -171,6 +208,7 @@ def edit_inspection(id):
                 WHERE id_inspect = %s
             ''', (date_visite, rapport, etat_constate, id))
             conn.commit()
+            invalidate('INSPECTION')
             cur.close()
             flash('Inspection modifiée avec succès!', 'success')
             return redirect(url_for('inspections.view_inspection', id=id))
@@ -1,27 +1,33 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, abort, render_template, request, redirect, url_for, flash
 from app.db import get_db
+from app.export import FORMATS as EXPORT_FORMATS, export_response
+from app.refdata import invalidate, lookup, lookups
+from app.pagination import Keyset, paginate
+from app.search import search_condition
+from app.pagecache import cached
 
 interventions_bp = Blueprint('interventions', __name__, url_prefix='/interventions')
 
-@interventions_bp.route('/')
-def list_interventions():
-    """List all interventions with search and filtering."""
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # Get filter parameters
-    search = request.args.get('search', '').strip()
-    statut_filter = request.args.get('statut', '')
-    building_filter = request.args.get('building', '')
-    prestataire_filter = request.args.get('prestataire', '')
-    validated_filter = request.args.get('validated', '')
+# Latest start dates first. Undated interventions came first with the former
+# ORDER BY date_debut DESC (NULLS FIRST), so they sort as the greatest date.
+INTERVENTIONS_KEYSET = Keyset(["COALESCE(i.date_debut, DATE '9999-12-31')", 'i.id_interv'],
+                              positions=[11, 0])
+
+def interventions_query(args):
+    """The intervention list query (without ORDER BY) and its parameters for the filters in `args`."""
+    search = args.get('search', '').strip()
+    statut_filter = args.get('statut', '')
+    building_filter = args.get('building', '')
+    prestataire_filter = args.get('prestataire', '')
+    validated_filter = args.get('validated', '')
     
     # Base query
     query = '''
         SELECT i.id_interv, i.date_debut, i.date_fin, i.type_travaux,
                i.cout_estime, i.est_validee, i.statut_travaux,
                b.code_batiment, b.nom_batiment,
-               p.id_prestataire, p.nom_entreprise
+               p.id_prestataire, p.nom_entreprise,
+               COALESCE(i.date_debut, DATE '9999-12-31') as cle_tri
         FROM INTERVENTION i
         JOIN BATIMENT b ON i.code_batiment = b.code_batiment
         LEFT JOIN PRESTATAIRE p ON i.id_prestataire = p.id_prestataire
@@ -32,13 +38,13 @@ def list_interventions():
     
     # Search
     if search:
-        query += ''' AND (
-            LOWER(b.nom_batiment) LIKE LOWER(%s) OR 
-            LOWER(i.type_travaux) LIKE LOWER(%s) OR
-            LOWER(p.nom_entreprise) LIKE LOWER(%s)
-        )'''
-        search_param = f'%{search}%'
-        params.extend([search_param, search_param, search_param])
+        clause, search_params = search_condition(
+            search,
+            columns=['i.type_travaux'],
+            related=[('i.code_batiment', 'BATIMENT', 'code_batiment', ['nom_batiment']),
+                     ('i.id_prestataire', 'PRESTATAIRE', 'id_prestataire', ['nom_entreprise'])])
+        query += clause
+        params.extend(search_params)
     
     # Statut filter
     if statut_filter:
@@ -61,25 +67,34 @@ def list_interventions():
     elif validated_filter == 'no':
         query += ' AND (i.est_validee = FALSE OR i.est_validee IS NULL)'
     
-    query += ' ORDER BY i.date_debut DESC'
+    return query, params
+
+@interventions_bp.route('/')
+@cached('INTERVENTION', 'BATIMENT', 'PRESTATAIRE')
+def list_interventions():
+    """List all interventions with search and filtering."""
+    conn = get_db()
+    cur = conn.cursor()
     
-    cur.execute(query, params)
-    interventions = cur.fetchall()
+    # Get filter parameters
+    search = request.args.get('search', '').strip()
+    statut_filter = request.args.get('statut', '')
+    building_filter = request.args.get('building', '')
+    prestataire_filter = request.args.get('prestataire', '')
+    validated_filter = request.args.get('validated', '')
     
-    # Get filter dropdown data
-    cur.execute('SELECT DISTINCT statut_travaux FROM INTERVENTION WHERE statut_travaux IS NOT NULL ORDER BY statut_travaux')
-    statuts = cur.fetchall()
+    query, params = interventions_query(request.args)
     
-    cur.execute('SELECT code_batiment, nom_batiment FROM BATIMENT ORDER BY nom_batiment')
-    buildings = cur.fetchall()
+    page = paginate(cur, query, params, INTERVENTIONS_KEYSET)
     
-    cur.execute('SELECT id_prestataire, nom_entreprise FROM PRESTATAIRE ORDER BY nom_entreprise')
-    prestataires = cur.fetchall()
+    # Get filter dropdown data
+    statuts, buildings, prestataires = lookups('statuts_travaux', 'batiments', 'prestataires')
     
     cur.close()
     
     return render_template('interventions/list.html',
-                          interventions=interventions,
+                          interventions=page.rows,
+                          page=page,
                           statuts=statuts,
                           buildings=buildings,
                           prestataires=prestataires,
@@ -89,6 +104,16 @@ def list_interventions():
                           current_prestataire=prestataire_filter,
                           current_validated=validated_filter)
 
+@interventions_bp.route('/export')
+def export_interventions():
+    """Export the filtered intervention list as CSV or NDJSON (?format=)."""
+    file_format = request.args.get('format', 'csv')
+    if file_format not in EXPORT_FORMATS:
+        abort(400)
+    query, params = interventions_query(request.args)
+    return export_response(query + INTERVENTIONS_KEYSET.order_by(), params, file_format, 'interventions',
+                           hidden=('cle_tri',))
+
 @interventions_bp.route('/add', methods=['GET', 'POST'])
 def add_intervention():
     """Add a new intervention."""
@@ -112,6 +137,7 @@ def add_intervention():
             ''', (date_debut, date_fin, type_travaux, cout_estime, 
                   code_batiment, id_prestataire, statut_travaux))
             conn.commit()
+            invalidate('INTERVENTION')
             flash('Intervention ajoutée avec succès!', 'success')
             return redirect(url_for('interventions.list_interventions'))
         except Exception as e:
@@ -121,10 +147,7 @@ def add_intervention():
             cur.close()
     
     # GET: Load dropdowns
-    cur.execute('SELECT code_batiment, nom_batiment FROM BATIMENT ORDER BY nom_batiment')
-    buildings = cur.fetchall()
-    cur.execute('SELECT id_prestataire, nom_entreprise, role_prest FROM PRESTATAIRE ORDER BY nom_entreprise')
-    prestataires = cur.fetchall()
+    buildings, prestataires = lookups('batiments', 'prestataires')
     cur.close()
     
     statuts = ['Planifié', 'En cours', 'Terminé', 'Annulé']
@@ -134,6 +157,7 @@ def add_intervention():
                           statuts=statuts)
 
 @interventions_bp.route('/view/<int:id>')
+@cached('INTERVENTION', 'BATIMENT', 'PRESTATAIRE')
 def view_intervention(id):
     """View intervention details."""
     conn = get_db()
@@ -177,6 +201,7 @@ def validate_intervention(id):
             WHERE id_interv = %s
         ''', (commentaire, id))
         conn.commit()
+        invalidate('INTERVENTION')
         flash('Intervention validée avec succès!', 'success')
     except Exception as e:
         conn.rollback()
@@ -195,6 +220,7 @@ def delete_intervention(id):
     try:
         cur.execute('DELETE FROM INTERVENTION WHERE id_interv = %s', (id,))
         conn.commit()
+        invalidate('INTERVENTION')
         flash('Intervention supprimée!', 'success')
     except Exception as e:
         conn.rollback()
@@ -227,6 +253,7 @@ def edit_intervention(id):
             ''', (date_debut, date_fin, type_travaux, cout_estime, 
                   id_prestataire, statut_travaux, id))
             conn.commit()
+            invalidate('INTERVENTION')
             cur.close()
             flash('Intervention modifiée avec succès!', 'success')
             return redirect(url_for('interventions.view_intervention', id=id))
@@ -250,8 +277,7 @@ def edit_intervention(id):
         flash('Intervention non trouvée!', 'warning')
         return redirect(url_for('interventions.list_interventions'))
     
-    cur.execute('SELECT id_prestataire, nom_entreprise, role_prest FROM PRESTATAIRE ORDER BY nom_entreprise')
-    prestataires = cur.fetchall()
+    prestataires = lookup('prestataires')
     cur.close()
     
     statuts = ['Planifié', 'En cours', 'Terminé', 'Annulé']
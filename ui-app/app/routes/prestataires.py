@@ -1,9 +1,13 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from app.db import get_db
+from app.refdata import invalidate, lookup
+from app.search import search_condition
+from app.pagecache import cached
 
 prestataires_bp = Blueprint('prestataires', __name__, url_prefix='/prestataires')
 
 @prestataires_bp.route('/')
+@cached('PRESTATAIRE', 'INTERVENTION', stale_while_revalidate=True)
 def list_prestataires():
     """List all prestataires with search and filtering."""
     conn = get_db()
@@ -27,12 +31,9 @@ def list_prestataires():
     
     # Search
     if search:
-        query += ''' AND (
-            LOWER(p.nom_entreprise) LIKE LOWER(%s) OR 
-            LOWER(p.role_prest) LIKE LOWER(%s)
-        )'''
-        search_param = f'%{search}%'
-        params.extend([search_param, search_param])
+        clause, search_params = search_condition(search, columns=['p.nom_entreprise', 'p.role_prest'])
+        query += clause
+        params.extend(search_params)
     
     # Role filter
     if role_filter:
@@ -46,8 +47,7 @@ def list_prestataires():
     prestataires = cur.fetchall()
     
     # Get distinct roles for filter dropdown
-    cur.execute('SELECT DISTINCT role_prest FROM PRESTATAIRE WHERE role_prest IS NOT NULL ORDER BY role_prest')
-    roles = cur.fetchall()
+    roles = lookup('roles_prestataire')
     
     cur.close()
     
@@ -76,6 +76,7 @@ def add_prestataire():
             ''', (nom_entreprise, role_prest))
             new_id = cur.fetchone()[0]
             conn.commit()
+            invalidate('PRESTATAIRE')
             flash(f'Prestataire ajouté avec succès! (ID: {new_id})', 'success')
             return redirect(url_for('prestataires.list_prestataires'))
         except Exception as e:
@@ -85,13 +86,13 @@ def add_prestataire():
             cur.close()
     
     # GET: Load existing roles from database for suggestions
-    cur.execute('SELECT DISTINCT role_prest FROM PRESTATAIRE WHERE role_prest IS NOT NULL ORDER BY role_prest')
-    existing_roles = [r[0] for r in cur.fetchall()]
+    existing_roles = [r[0] for r in lookup('roles_prestataire')]
     cur.close()
     
     return render_template('prestataires/add.html', existing_roles=existing_roles)
 
 @prestataires_bp.route('/view/<int:id>')
+@cached('PRESTATAIRE', 'INTERVENTION', 'BATIMENT')
 def view_prestataire(id):
     """View prestataire details with their interventions."""
     conn = get_db()
@@ -158,6 +159,7 @@ def edit_prestataire(id):
                 WHERE id_prestataire = %s
             ''', (nom_entreprise, role_prest, id))
             conn.commit()
+            invalidate('PRESTATAIRE')
             flash('Prestataire modifié avec succès!', 'success')
             return redirect(url_for('prestataires.view_prestataire', id=id))
         except Exception as e:
@@ -179,8 +181,7 @@ def edit_prestataire(id):
         return redirect(url_for('prestataires.list_prestataires'))
     
     # Load existing roles for suggestions
-    cur.execute('SELECT DISTINCT role_prest FROM PRESTATAIRE WHERE role_prest IS NOT NULL ORDER BY role_prest')
-    existing_roles = [r[0] for r in cur.fetchall()]
+    existing_roles = [r[0] for r in lookup('roles_prestataire')]
     cur.close()
     
     return render_template('prestataires/edit.html', prestataire=prestataire, existing_roles=existing_roles)
@@ -202,6 +203,7 @@ def delete_prestataire(id):
         
         cur.execute('DELETE FROM PRESTATAIRE WHERE id_prestataire = %s', (id,))
         conn.commit()
+        invalidate('PRESTATAIRE')
         flash('Prestataire supprimé avec succès!', 'success')
     except Exception as e:
         conn.rollback()
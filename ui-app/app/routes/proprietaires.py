@@ -1,9 +1,13 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from app.db import get_db
+from app.refdata import invalidate, lookup
+from app.search import search_condition
+from app.pagecache import cached
 
 proprietaires_bp = Blueprint('proprietaires', __name__, url_prefix='/proprietaires')
 
 @proprietaires_bp.route('/')
+@cached('PROPRIETAIRE', 'BATIMENT')
 def list_proprietaires():
     """List all proprietaires with search and filtering."""
     conn = get_db()
@@ -26,12 +30,9 @@ def list_proprietaires():
     
     # Search
     if search:
-        query += ''' AND (
-            LOWER(p.nom_complet) LIKE LOWER(%s) OR 
-            LOWER(p.contact) LIKE LOWER(%s)
-        )'''
-        search_param = f'%{search}%'
-        params.extend([search_param, search_param])
+        clause, search_params = search_condition(search, columns=['p.nom_complet', 'p.contact'])
+        query += clause
+        params.extend(search_params)
     
     # Type filter
     if type_filter:
@@ -45,8 +46,7 @@ def list_proprietaires():
     proprietaires = cur.fetchall()
     
     # Get distinct types for filter dropdown
-    cur.execute('SELECT DISTINCT type_proprio FROM PROPRIETAIRE WHERE type_proprio IS NOT NULL ORDER BY type_proprio')
-    types = cur.fetchall()
+    types = lookup('types_proprietaire')
     
     cur.close()
     
@@ -75,6 +75,7 @@ def add_proprietaire():
             ''', (nom_complet, type_proprio, contact))
             new_id = cur.fetchone()[0]
             conn.commit()
+            invalidate('PROPRIETAIRE')
             flash(f'Propriétaire "{nom_complet}" ajouté avec succès! (ID: {new_id})', 'success')
             return redirect(url_for('proprietaires.list_proprietaires'))
         except Exception as e:
@@ -83,13 +84,13 @@ def add_proprietaire():
         # Don't close cursor here - we need it for GET request fallback
     
     # GET: Load existing types for suggestions
-    cur.execute('SELECT DISTINCT type_proprio FROM PROPRIETAIRE WHERE type_proprio IS NOT NULL ORDER BY type_proprio')
-    existing_types = [t[0] for t in cur.fetchall()]
+    existing_types = [t[0] for t in lookup('types_proprietaire')]
     cur.close()
     
     return render_template('proprietaires/add.html', existing_types=existing_types)
 
 @proprietaires_bp.route('/view/<int:id>')
+@cached('PROPRIETAIRE', 'BATIMENT', 'ZONE_URBAINE', 'TYPE_BATIMENT')
 def view_proprietaire(id):
     """View proprietaire details with their buildings."""
     conn = get_db()
@@ -143,6 +144,7 @@ def edit_proprietaire(id):
                 WHERE id_proprio = %s
             ''', (nom_complet, type_proprio, contact, id))
             conn.commit()
+            invalidate('PROPRIETAIRE')
             flash('Propriétaire modifié avec succès!', 'success')
             return redirect(url_for('proprietaires.view_proprietaire', id=id))
         except Exception as e:
@@ -164,8 +166,7 @@ def edit_proprietaire(id):
         return redirect(url_for('proprietaires.list_proprietaires'))
     
     # Load existing types for suggestions
-    cur.execute('SELECT DISTINCT type_proprio FROM PROPRIETAIRE WHERE type_proprio IS NOT NULL ORDER BY type_proprio')
-    existing_types = [t[0] for t in cur.fetchall()]
+    existing_types = [t[0] for t in lookup('types_proprietaire')]
     cur.close()
     
     return render_template('proprietaires/edit.html', proprietaire=proprietaire, existing_types=existing_types)
@@ -187,6 +188,7 @@ def delete_proprietaire(id):
         
         cur.execute('DELETE FROM PROPRIETAIRE WHERE id_proprio = %s', (id,))
         conn.commit()
+        invalidate('PROPRIETAIRE')
         flash('Propriétaire supprimé avec succès!', 'success')
     except Exception as e:
         conn.rollback()
@@ -1,9 +1,13 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from app.db import get_db
+from app.refdata import invalidate
+from app.search import search_condition
+from app.pagecache import cached
 
 protections_bp = Blueprint('protections', __name__, url_prefix='/protections')
 
 @protections_bp.route('/')
+@cached('NIV_PROTECTION', 'BATIMENT')
 def list_protections():
     """List all protection levels with building count."""
     conn = get_db()
@@ -24,8 +28,9 @@ def list_protections():
     params = []
     
     if search:
-        query += ' AND LOWER(n.niveau) LIKE LOWER(%s)'
-        params.append(f'%{search}%')
+        clause, search_params = search_condition(search, columns=['n.niveau'])
+        query += clause
+        params.extend(search_params)
     
     query += ' GROUP BY n.id_protection, n.niveau'
     query += ' ORDER BY n.niveau'
@@ -55,6 +60,7 @@ def add_protection():
             ''', (niveau,))
             new_id = cur.fetchone()[0]
             conn.commit()
+            invalidate('NIV_PROTECTION')
             flash(f'Niveau de protection "{niveau}" ajouté avec succès! (ID: {new_id})', 'success')
             return redirect(url_for('protections.list_protections'))
         except Exception as e:
@@ -66,6 +72,7 @@ def add_protection():
     return render_template('protections/add.html')
 
 @protections_bp.route('/view/<int:id>')
+@cached('NIV_PROTECTION', 'BATIMENT', 'INSPECTION', 'ZONE_URBAINE', 'TYPE_BATIMENT')
 def view_protection(id):
     """View protection level details with its buildings."""
     conn = get_db()
@@ -87,12 +94,11 @@ def view_protection(id):
     cur.execute('''
         SELECT b.code_batiment, b.nom_batiment, b.adresse_rue,
                z.nom_zone, t.libelle_type,
-               (SELECT i.etat_constate FROM INSPECTION i 
-                WHERE i.code_batiment = b.code_batiment 
-                ORDER BY i.date_visite DESC LIMIT 1) as dernier_etat
+               ec.etat_constate as dernier_etat
         FROM BATIMENT b
         LEFT JOIN ZONE_URBAINE z ON b.id_zone = z.id_zone
         LEFT JOIN TYPE_BATIMENT t ON b.id_type = t.id_type
+        LEFT JOIN BATIMENT_ETAT_COURANT ec ON b.code_batiment = ec.code_batiment
         WHERE b.id_protection = %s
         ORDER BY b.nom_batiment
     ''', (id,))
@@ -120,6 +126,7 @@ def edit_protection(id):
                 WHERE id_protection = %s
             ''', (niveau, id))
             conn.commit()
+            invalidate('NIV_PROTECTION')
             flash('Niveau de protection modifié avec succès!', 'success')
             return redirect(url_for('protections.view_protection', id=id))
         except Exception as e:
@@ -161,6 +168,7 @@ def delete_protection(id):
         
         cur.execute('DELETE FROM NIV_PROTECTION WHERE id_protection = %s', (id,))
         conn.commit()
+        invalidate('NIV_PROTECTION')
         flash('Niveau de protection supprimé avec succès!', 'success')
     except Exception as e:
         conn.rollback()
@@ -0,0 +1,90 @@
+from flask import Blueprint, render_template, request, jsonify
+from app.db import get_db
+from app.search import FULLTEXT_CONFIG, HEADLINE_OPTIONS, fulltext_query, highlight
+from app.pagecache import cached
+
+search_bp = Blueprint('search', __name__, url_prefix='/search')
+
+SCOPES = {
+    '': ('inspection', 'batiment'),
+    'inspections': ('inspection',),
+    'batiments': ('batiment',),
+}
+
+# Inspection reports and building notes ranked together in one statement.
+# Snippets (ts_headline, the costly part) are only built for the top rows.
+FULLTEXT_SEARCH_QUERY = f'''
+    WITH q AS (
+        SELECT {fulltext_query()} AS query
+    ),
+    hits AS (
+        SELECT 'inspection' AS source, i.id_inspect AS id,
+               ts_rank_cd(i.rapport_tsv, q.query, 32) AS rank
+        FROM INSPECTION i, q
+        WHERE 'inspection' = ANY(%s) AND i.rapport_tsv @@ q.query
+        UNION ALL
+        SELECT 'batiment' AS source, b.code_batiment AS id,
+               ts_rank_cd(b.note_historique_tsv, q.query, 32) AS rank
+        FROM BATIMENT b, q
+        WHERE 'batiment' = ANY(%s) AND b.note_historique_tsv @@ q.query
+    ),
+    top AS (
+        SELECT source, id, rank FROM hits
+        ORDER BY rank DESC, id DESC
+        LIMIT %s
+    )
+    SELECT t.source, t.id, t.rank,
+           b.code_batiment, b.nom_batiment, i.date_visite, i.etat_constate,
+           ts_headline('{FULLTEXT_CONFIG}',
+                       CASE WHEN t.source = 'inspection' THEN i.rapport
+                            ELSE b.note_historique END,
+                       q.query, %s) AS extrait
+    FROM top t
+    CROSS JOIN q
+    LEFT JOIN INSPECTION i ON t.source = 'inspection' AND i.id_inspect = t.id
+    JOIN BATIMENT b ON b.code_batiment = CASE WHEN t.source = 'inspection'
+                                              THEN i.code_batiment ELSE t.id END
+    ORDER BY t.rank DESC, t.id DESC
+'''
+
+
+@search_bp.route('/')
+@cached('INSPECTION', 'BATIMENT')
+def fulltext_search():
+    """Full-text search over inspection reports and historical notes."""
+    term = request.args.get('q', '').strip()
+    scope = request.args.get('scope', '')
+    if scope not in SCOPES:
+        scope = ''
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 200))
+    except ValueError:
+        limit = 50
+
+    results = []
+    if term:
+        conn = get_db()
+        cur = conn.cursor()
+        sources = list(SCOPES[scope])
+        cur.execute(FULLTEXT_SEARCH_QUERY, (term, sources, sources, limit, HEADLINE_OPTIONS))
+        for r in cur.fetchall():
+            results.append({
+                'source': r[0],
+                'id': r[1],
+                'rank': round(float(r[2]), 4),
+                'code_batiment': r[3],
+                'nom_batiment': r[4],
+                'date_visite': r[5].isoformat() if r[5] else None,
+                'etat': r[6],
+                'extrait': highlight(r[7]),
+            })
+        cur.close()
+
+    if request.args.get('format') == 'json':
+        return jsonify(query=term, scope=scope or 'tout',
+                       results=[dict(r, extrait=str(r['extrait'])) for r in results])
+
+    return render_template('search/results.html',
+                          results=results,
+                          current_q=term,
+                          current_scope=scope)
@@ -0,0 +1,70 @@
+from flask import Blueprint, Response, abort, current_app
+from app.db import get_db
+from app.metrics import count_cache
+from app.tiles import get_tile_cache, sync_invalidations, tile_in_range
+
+tiles_bp = Blueprint('tiles', __name__, url_prefix='/tiles')
+
+MVT_MIMETYPE = 'application/vnd.mapbox-vector-tile'
+
+# One "buildings" layer per tile with the attributes of the map popup,
+# plus the ids the client filters on. The GiST index on BATIMENT.geom
+# (EPSG:4326) is used through the tile envelope transformed back to it.
+BUILDINGS_TILE_QUERY = '''
+    WITH bounds AS (
+        SELECT ST_TileEnvelope(%s, %s, %s) AS env
+    ),
+    features AS (
+        SELECT ST_AsMVTGeom(ST_Transform(b.geom, 3857), bounds.env, 4096, 64, true) AS geom,
+               b.code_batiment AS code,
+               b.nom_batiment AS nom,
+               COALESCE(b.adresse_rue, 'N/A') AS adresse,
+               COALESCE(z.nom_zone, 'N/A') AS zone,
+               COALESCE(t.libelle_type, 'N/A') AS type,
+               COALESCE(n.niveau, 'N/A') AS protection,
+               COALESCE(ec.etat_constate, 'Non inspecté') AS etat,
+               b.id_zone, b.id_type, b.id_protection
+        FROM BATIMENT b
+        CROSS JOIN bounds
+        LEFT JOIN ZONE_URBAINE z ON b.id_zone = z.id_zone
+        LEFT JOIN TYPE_BATIMENT t ON b.id_type = t.id_type
+        LEFT JOIN NIV_PROTECTION n ON b.id_protection = n.id_protection
+        LEFT JOIN BATIMENT_ETAT_COURANT ec ON b.code_batiment = ec.code_batiment
+        WHERE b.geom && ST_Transform(bounds.env, 4326)
+    )
+    SELECT ST_AsMVT(features.*, 'buildings', 4096, 'geom', 'code')
+    FROM features
+'''
+
+
+def tile_response(data):
+    response = Response(data, mimetype=MVT_MIMETYPE)
+    response.headers['Cache-Control'] = f"public, max-age={current_app.config['TILE_BROWSER_MAX_AGE']}"
+    return response
+
+
+@tiles_bp.route('/buildings/<int:z>/<int:x>/<int:y>.pbf')
+def building_tile(z, x, y):
+    """Mapbox Vector Tile of the buildings, cached on disk."""
+    if not tile_in_range(z, x, y):
+        abort(404)
+
+    conn = get_db()
+    cache = get_tile_cache('buildings')
+    sync_invalidations(conn, cache)
+
+    data = cache.get(z, x, y)
+    if data is not None:
+        count_cache('tiles', hits=1)
+        return tile_response(data)
+    count_cache('tiles', misses=1)
+
+    # Read before rendering: a change invalidated while the tile renders
+    # bumps the generation and keeps the (possibly stale) tile out of the cache.
+    generation = cache.generation()
+    cur = conn.cursor()
+    cur.execute(BUILDINGS_TILE_QUERY, (z, x, y))
+    data = bytes(cur.fetchone()[0] or b'')
+    cur.close()
+    cache.put(z, x, y, data, generation)
+    return tile_response(data)
@@ -1,9 +1,13 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from app.db import get_db
+from app.refdata import invalidate
+from app.search import search_condition
+from app.pagecache import cached
 
 types_bp = Blueprint('types', __name__, url_prefix='/types')
 
 @types_bp.route('/')
+@cached('TYPE_BATIMENT', 'BATIMENT')
 def list_types():
     """List all building types."""
     conn = get_db()
@@ -21,8 +25,9 @@ def list_types():
     params = []
     
     if search:
-        query += ' AND LOWER(t.libelle_type) LIKE LOWER(%s)'
-        params.append(f'%{search}%')
+        clause, search_params = search_condition(search, columns=['t.libelle_type'])
+        query += clause
+        params.extend(search_params)
     
     query += ' GROUP BY t.id_type, t.libelle_type ORDER BY t.libelle_type'
     
@@ -49,6 +54,7 @@ def add_type():
             ''', (libelle_type,))
             new_id = cur.fetchone()[0]
             conn.commit()
+            invalidate('TYPE_BATIMENT')
             cur.close()
             flash(f'Type "{libelle_type}" ajouté avec succès! (ID: {new_id})', 'success')
             return redirect(url_for('types.list_types'))
@@ -60,6 +66,7 @@ def add_type():
     return render_template('types/add.html')
 
 @types_bp.route('/view/<int:id>')
+@cached('TYPE_BATIMENT', 'BATIMENT', 'INSPECTION', 'ZONE_URBAINE', 'NIV_PROTECTION')
 def view_type(id):
     """View building type details with its buildings."""
     conn = get_db()
@@ -81,12 +88,11 @@ def view_type(id):
     cur.execute('''
         SELECT b.code_batiment, b.nom_batiment, b.adresse_rue,
                z.nom_zone, n.niveau,
-               (SELECT i.etat_constate FROM INSPECTION i 
-                WHERE i.code_batiment = b.code_batiment 
-                ORDER BY i.date_visite DESC LIMIT 1) as dernier_etat
+               ec.etat_constate as dernier_etat
         FROM BATIMENT b
         LEFT JOIN ZONE_URBAINE z ON b.id_zone = z.id_zone
         LEFT JOIN NIV_PROTECTION n ON b.id_protection = n.id_protection
+        LEFT JOIN BATIMENT_ETAT_COURANT ec ON b.code_batiment = ec.code_batiment
         WHERE b.id_type = %s
         ORDER BY b.nom_batiment
     ''', (id,))
@@ -96,16 +102,11 @@ def view_type(id):
     cur.execute('''
         SELECT 
             COUNT(*) as total,
-            COUNT(CASE WHEN (SELECT i.etat_constate FROM INSPECTION i 
-                            WHERE i.code_batiment = b.code_batiment 
-                            ORDER BY i.date_visite DESC LIMIT 1) = 'Bon' THEN 1 END) as bon,
-            COUNT(CASE WHEN (SELECT i.etat_constate FROM INSPECTION i 
-                            WHERE i.code_batiment = b.code_batiment 
-                            ORDER BY i.date_visite DESC LIMIT 1) = 'Moyen' THEN 1 END) as moyen,
-            COUNT(CASE WHEN (SELECT i.etat_constate FROM INSPECTION i 
-                            WHERE i.code_batiment = b.code_batiment 
-                            ORDER BY i.date_visite DESC LIMIT 1) IN ('Dégradé', 'En ruine') THEN 1 END) as urgent
+            COUNT(CASE WHEN ec.etat_constate = 'Bon' THEN 1 END) as bon,
+            COUNT(CASE WHEN ec.etat_constate = 'Moyen' THEN 1 END) as moyen,
+            COUNT(CASE WHEN ec.etat_constate IN ('Dégradé', 'En ruine') THEN 1 END) as urgent
         FROM BATIMENT b
+        LEFT JOIN BATIMENT_ETAT_COURANT ec ON b.code_batiment = ec.code_batiment
         WHERE b.id_type = %s
     ''', (id,))
     stats = cur.fetchone()
@@ -130,6 +131,7 @@ def edit_type(id):
             cur.execute('UPDATE TYPE_BATIMENT SET libelle_type = %s WHERE id_type = %s', 
                        (libelle_type, id))
             conn.commit()
+            invalidate('TYPE_BATIMENT')
             cur.close()
             flash('Type modifié avec succès!', 'success')
             return redirect(url_for('types.view_type', id=id))
@@ -163,6 +165,7 @@ def delete_type(id):
         
         cur.execute('DELETE FROM TYPE_BATIMENT WHERE id_type = %s', (id,))
         conn.commit()
+        invalidate('TYPE_BATIMENT')
         flash('Type supprimé!', 'success')
     except Exception as e:
         conn.rollback()
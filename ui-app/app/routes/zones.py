@@ -1,9 +1,22 @@
+import logging
+
+import psycopg
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from app.db import get_db
+from app.refdata import invalidate, lookup
+from app.search import search_condition
+from app.pagecache import cached
+
+logger = logging.getLogger(__name__)
 
 zones_bp = Blueprint('zones', __name__, url_prefix='/zones')
 
+# Set when statistiques_zones_spatiales is missing (MPD/update_zones_contour.sql
+# not applied): the zone page then shows no contour figures
+_no_contour_stats = False
+
 @zones_bp.route('/')
+@cached('ZONE_URBAINE', 'BATIMENT', stale_while_revalidate=True)
 def list_zones():
     """List all zones with search and filtering."""
     conn = get_db()
@@ -26,12 +39,9 @@ def list_zones():
     
     # Search
     if search:
-        query += ''' AND (
-            LOWER(z.nom_zone) LIKE LOWER(%s) OR 
-            LOWER(z.type_zone) LIKE LOWER(%s)
-        )'''
-        search_param = f'%{search}%'
-        params.extend([search_param, search_param])
+        clause, search_params = search_condition(search, columns=['z.nom_zone', 'z.type_zone'])
+        query += clause
+        params.extend(search_params)
     
     # Type filter
     if type_filter:
@@ -45,8 +55,7 @@ def list_zones():
     zones = cur.fetchall()
     
     # Get distinct types for filter dropdown
-    cur.execute('SELECT DISTINCT type_zone FROM ZONE_URBAINE WHERE type_zone IS NOT NULL ORDER BY type_zone')
-    types = cur.fetchall()
+    types = lookup('types_zone')
     
     cur.close()
     
@@ -74,6 +83,7 @@ def add_zone():
             ''', (nom_zone, type_zone))
             new_id = cur.fetchone()[0]
             conn.commit()
+            invalidate('ZONE_URBAINE')
             cur.close()
             flash(f'Zone "{nom_zone}" ajoutée avec succès! (ID: {new_id})', 'success')
             return redirect(url_for('zones.list_zones'))
@@ -83,15 +93,16 @@ def add_zone():
             # Don't close cursor here - we need it for the form below
     
     # GET or POST with error: Load existing types for suggestions
-    cur.execute('SELECT DISTINCT type_zone FROM ZONE_URBAINE WHERE type_zone IS NOT NULL ORDER BY type_zone')
-    existing_types = [t[0] for t in cur.fetchall()]
+    existing_types = [t[0] for t in lookup('types_zone')]
     cur.close()
     
     return render_template('zones/add.html', existing_types=existing_types)
 
 @zones_bp.route('/view/<int:id>')
+@cached('ZONE_URBAINE', 'BATIMENT', 'INSPECTION', 'TYPE_BATIMENT', 'NIV_PROTECTION')
 def view_zone(id):
     """View zone details with its buildings."""
+    global _no_contour_stats
     conn = get_db()
     cur = conn.cursor()
     
@@ -111,12 +122,11 @@ def view_zone(id):
     cur.execute('''
         SELECT b.code_batiment, b.nom_batiment, b.adresse_rue,
                t.libelle_type, n.niveau,
-               (SELECT i.etat_constate FROM INSPECTION i 
-                WHERE i.code_batiment = b.code_batiment 
-                ORDER BY i.date_visite DESC LIMIT 1) as dernier_etat
+               ec.etat_constate as dernier_etat
         FROM BATIMENT b
         LEFT JOIN TYPE_BATIMENT t ON b.id_type = t.id_type
         LEFT JOIN NIV_PROTECTION n ON b.id_protection = n.id_protection
+        LEFT JOIN BATIMENT_ETAT_COURANT ec ON b.code_batiment = ec.code_batiment
         WHERE b.id_zone = %s
         ORDER BY b.nom_batiment
     ''', (id,))
@@ -126,26 +136,35 @@ def view_zone(id):
     cur.execute('''
         SELECT 
             COUNT(*) as total,
-            COUNT(CASE WHEN (SELECT i.etat_constate FROM INSPECTION i 
-                            WHERE i.code_batiment = b.code_batiment 
-                            ORDER BY i.date_visite DESC LIMIT 1) = 'Bon' THEN 1 END) as bon,
-            COUNT(CASE WHEN (SELECT i.etat_constate FROM INSPECTION i 
-                            WHERE i.code_batiment = b.code_batiment 
-                            ORDER BY i.date_visite DESC LIMIT 1) = 'Moyen' THEN 1 END) as moyen,
-            COUNT(CASE WHEN (SELECT i.etat_constate FROM INSPECTION i 
-                            WHERE i.code_batiment = b.code_batiment 
-                            ORDER BY i.date_visite DESC LIMIT 1) IN ('Dégradé', 'En ruine') THEN 1 END) as urgent
+            COUNT(CASE WHEN ec.etat_constate = 'Bon' THEN 1 END) as bon,
+            COUNT(CASE WHEN ec.etat_constate = 'Moyen' THEN 1 END) as moyen,
+            COUNT(CASE WHEN ec.etat_constate IN ('Dégradé', 'En ruine') THEN 1 END) as urgent
         FROM BATIMENT b
+        LEFT JOIN BATIMENT_ETAT_COURANT ec ON b.code_batiment = ec.code_batiment
         WHERE b.id_zone = %s
     ''', (id,))
     stats = cur.fetchone()
     
+    # Same figures from the zone's contour, if it has one (and
+    # MPD/update_zones_contour.sql has been applied)
+    contour_stats = None
+    if not _no_contour_stats:
+        try:
+            cur.execute('SELECT * FROM statistiques_zones_spatiales(%s::int[])', ([id],))
+            contour_stats = cur.fetchone()
+        except psycopg.errors.UndefinedFunction:
+            conn.rollback()
+            _no_contour_stats = True
+            logger.warning('statistiques_zones_spatiales is missing '
+                           '(MPD/update_zones_contour.sql): no contour figures')
+    
     cur.close()
     
     return render_template('zones/view.html', 
                           zone=zone, 
                           buildings=buildings,
-                          stats=stats)
+                          stats=stats,
+                          contour_stats=contour_stats)
 
 @zones_bp.route('/edit/<int:id>', methods=['GET', 'POST'])
 def edit_zone(id):
@@ -164,6 +183,7 @@ def edit_zone(id):
                 WHERE id_zone = %s
             ''', (nom_zone, type_zone, id))
             conn.commit()
+            invalidate('ZONE_URBAINE')
             cur.close()
             flash('Zone modifiée avec succès!', 'success')
             return redirect(url_for('zones.view_zone', id=id))
@@ -186,8 +206,7 @@ def edit_zone(id):
         return redirect(url_for('zones.list_zones'))
     
     # Load existing types for suggestions
-    cur.execute('SELECT DISTINCT type_zone FROM ZONE_URBAINE WHERE type_zone IS NOT NULL ORDER BY type_zone')
-    existing_types = [t[0] for t in cur.fetchall()]
+    existing_types = [t[0] for t in lookup('types_zone')]
     cur.close()
     
     return render_template('zones/edit.html', zone=zone, existing_types=existing_types)
@@ -209,6 +228,7 @@ def delete_zone(id):
         
         cur.execute('DELETE FROM ZONE_URBAINE WHERE id_zone = %s', (id,))
         conn.commit()
+        invalidate('ZONE_URBAINE')
         flash('Zone supprimée avec succès!', 'success')
     except Exception as e:
         conn.rollback()
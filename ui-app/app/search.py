@@ -0,0 +1,86 @@
+"""
+Search conditions shared by the list pages.
+
+Text is matched as a substring, ignoring case and accents ("fes" finds
+"Fès"), through the expression lower(f_unaccent(column)) which carries a
+trigram index (see MPD/update_recherche.sql). Related tables are searched
+through an IN (subquery) on the foreign key instead of an OR across the
+join, so every branch of the condition can use an index of its own table.
+
+Long texts (inspection reports, historical notes) also have a French
+full-text mode over stored tsvector columns (see
+MPD/update_recherche_texte.sql).
+"""
+from markupsafe import Markup, escape
+
+# Text search configuration: French stemming on unaccented words
+FULLTEXT_CONFIG = 'fr_unaccent'
+
+# ts_headline wraps matches in these markers; highlight() escapes the rest
+# of the text and turns them into <mark> tags.
+HIGHLIGHT_START = '\u27e6'
+HIGHLIGHT_STOP = '\u27e7'
+HEADLINE_OPTIONS = (f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, '
+                    'MaxFragments=2, MaxWords=25, MinWords=8, FragmentDelimiter=" … "')
+
+
+def like_pattern(term):
+    """LIKE pattern matching `term` anywhere, with its wildcards escaped."""
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def text_match(expression):
+    """Indexed, accent-insensitive substring match of `expression` (one parameter)."""
+    return f'lower(f_unaccent({expression})) LIKE lower(f_unaccent(%s))'
+
+
+def search_condition(term, columns=(), id_columns=(), related=()):
+    """
+    Returns (sql, params) for ' AND (...)' matching `term` in any of:
+
+    - columns: text columns of the main table, e.g. 'b.nom_batiment'
+    - id_columns: integer identifiers searched as text, e.g. 'b.code_batiment'
+    - related: (foreign_key, table, key, [columns]) tuples searching the
+      text columns of a referenced table, e.g.
+      ('b.id_zone', 'ZONE_URBAINE', 'id_zone', ['nom_zone'])
+    """
+    pattern = like_pattern(term)
+    branches = []
+    params = []
+
+    for column in columns:
+        branches.append(text_match(column))
+        params.append(pattern)
+
+    for column in id_columns:
+        branches.append(f'({column})::text LIKE %s')
+        params.append(pattern)
+
+    for foreign_key, table, key, related_columns in related:
+        matches = ' OR '.join(text_match(c) for c in related_columns)
+        branches.append(f'{foreign_key} IN (SELECT {key} FROM {table} WHERE {matches})')
+        params.extend([pattern] * len(related_columns))
+
+    if not branches:
+        return '', []
+    return ' AND (' + ' OR '.join(branches) + ')', params
+
+
+def fulltext_query():
+    """SQL for the tsquery of a search typed by a user (one parameter)."""
+    return f"websearch_to_tsquery('{FULLTEXT_CONFIG}', %s)"
+
+
+def fulltext_condition(term, tsvector_column):
+    """Returns (sql, params) for ' AND ...' matching `term` against a tsvector column."""
+    return f' AND {tsvector_column} @@ {fulltext_query()}', [term]
+
+
+def highlight(snippet):
+    """HTML of a ts_headline() snippet: text escaped, matches in <mark>."""
+    if not snippet:
+        return Markup('')
+    html = str(escape(snippet))
+    html = html.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
+    return Markup(html)
@@ -0,0 +1,139 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+import psycopg
+from psycopg.types.json import Jsonb
+from flask import current_app, has_request_context, request
+
+from .querylog import EXPLAINABLE, normalize, redact
+
+logger = logging.getLogger(__name__)
+
+# Statements waiting for their plan; captures beyond this are dropped
+# rather than slowing the requests down
+_jobs = queue.Queue(maxsize=20)
+
+# Last capture time of each normalized statement in this process
+_last_capture = {}
+_lock = threading.Lock()
+
+# Capture thread of the current process (restarted in forked workers)
+_worker_pid = None
+
+# Plan fields holding expressions, and so the statement's values
+_VALUE_FIELDS = ('Cond', 'Filter', 'Key', 'Output', 'Order By')
+
+STORE_QUERY = '''
+    INSERT INTO REQUETE_LENTE (emplacement, numero, endpoint, chemin, duree_ms, requete, plan, erreur)
+    SELECT s.n %% %(capacity)s, s.n, %(endpoint)s, %(path)s, %(duration_ms)s, %(sql)s, %(plan)s, %(error)s
+    FROM (SELECT nextval('requete_lente_numero_seq') AS n) s
+    ON CONFLICT (emplacement) DO UPDATE
+    SET numero = EXCLUDED.numero, capturee_le = now(), endpoint = EXCLUDED.endpoint,
+        chemin = EXCLUDED.chemin, duree_ms = EXCLUDED.duree_ms, requete = EXCLUDED.requete,
+        plan = EXCLUDED.plan, erreur = EXCLUDED.erreur
+'''
+
+
+def check(query, params, duration):
+    """
+    Queues the capture of the plan of a request's statement that ran
+    longer than SLOW_QUERY_MS (`duration` in seconds). A statement is
+    captured at most once every SLOW_QUERY_INTERVAL seconds per worker.
+    """
+    # The admin pages reading the captures are left out
+    if not has_request_context() or request.blueprint == 'admin':
+        return
+    config = current_app.config
+    threshold = config['SLOW_QUERY_MS']
+    if not threshold or duration * 1000 < threshold or not isinstance(query, (str, bytes)):
+        return
+    if isinstance(query, bytes):
+        query = query.decode('utf-8')
+    sql = normalize(query)
+    if not sql.upper().startswith(EXPLAINABLE):
+        return
+    now = time.monotonic()
+    with _lock:
+        last = _last_capture.get(sql)
+        if last is not None and now - last < config['SLOW_QUERY_INTERVAL']:
+            return
+        _last_capture[sql] = now
+    _ensure_worker()
+    try:
+        _jobs.put_nowait({
+            'query': query, 'params': params, 'sql': sql,
+            'endpoint': request.endpoint, 'path': request.path[:255],
+            'duration_ms': round(duration * 1000, 1),
+            'capacity': config['SLOW_QUERY_CAPACITY'],
+            'timeout_ms': config['SLOW_QUERY_EXPLAIN_TIMEOUT_MS'],
+        })
+    except queue.Full:
+        pass
+
+
+def _ensure_worker():
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    with _lock:
+        if _worker_pid != os.getpid():
+            thread = threading.Thread(target=_capture_loop, args=(current_app.config['DATABASE_URL'],),
+                                      name='slowlog-capture', daemon=True)
+            thread.start()
+            _worker_pid = os.getpid()
+
+
+def _capture_loop(dsn):
+    """Explains the queued statements on a connection of its own."""
+    conn = None
+    while True:
+        job = _jobs.get()
+        try:
+            if conn is None or conn.closed:
+                conn = psycopg.connect(dsn, autocommit=True)
+            _capture(conn, job)
+        except Exception:
+            logger.exception('Could not capture the plan of a slow statement')
+            if conn is not None:
+                conn.close()
+            conn = None
+
+
+def redact_plan(node):
+    """The plan with the literal values of its expressions replaced by ?."""
+    if isinstance(node, list):
+        return [redact_plan(item) for item in node]
+    if not isinstance(node, dict):
+        return node
+    redacted = {}
+    for key, value in node.items():
+        if key.endswith(_VALUE_FIELDS):
+            if isinstance(value, str):
+                value = redact(value)
+            elif isinstance(value, list):
+                value = [redact(v) if isinstance(v, str) else v for v in value]
+        redacted[key] = redact_plan(value)
+    return redacted
+
+
+def _capture(conn, job):
+    # ANALYZE runs the statement: only for reads, in a read-only transaction
+    analyze = job['sql'].upper().startswith(('SELECT', 'WITH'))
+    options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+    plan = error = None
+    try:
+        with conn.transaction():
+            conn.execute('SET TRANSACTION READ ONLY')
+            conn.execute("SELECT set_config('statement_timeout', %s, true)", (str(job['timeout_ms']),))
+            row = conn.execute(f'EXPLAIN ({options}) {job["query"]}', job['params']).fetchone()
+            plan = redact_plan(row[0])
+    except psycopg.Error as e:
+        error = redact(str(e).strip())
+    conn.execute(STORE_QUERY, {
+        'capacity': job['capacity'], 'endpoint': job['endpoint'], 'path': job['path'],
+        'duration_ms': job['duration_ms'], 'sql': job['sql'],
+        'plan': Jsonb(plan) if plan is not None else None, 'error': error,
+    })
@@ -0,0 +1,95 @@
+import datetime
+import logging
+import threading
+
+import click
+from flask import current_app
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+# At most one background refresh per worker at a time; the database function
+# additionally lets only one refresh run across all workers.
+_refresh_lock = threading.Lock()
+
+
+class Statistic:
+    """One figure of the dashboard rollup and how fresh it is."""
+
+    def __init__(self, value, computed_at, stale_since):
+        self.value = value
+        self.computed_at = computed_at
+        self.stale_since = stale_since
+
+    @property
+    def is_stale(self):
+        return self.stale_since is not None
+
+
+def parse_statistics(rows):
+    """Maps the rollup rows {cle, valeur, calcule_le, perime_depuis} to Statistic objects."""
+    stats = {}
+    for row in rows or []:
+        stats[row['cle']] = Statistic(
+            row['valeur'],
+            _parse_timestamp(row['calcule_le']),
+            _parse_timestamp(row['perime_depuis']),
+        )
+    return stats
+
+
+def _parse_timestamp(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def refresh_statistics(conn, force=False):
+    """Recomputes the stale figures (all of them with force). Returns how many."""
+    with conn.cursor() as cur:
+        cur.execute('SELECT rafraichir_statistiques(%s)', (force,))
+        refreshed = cur.fetchone()[0]
+    conn.commit()
+    return refreshed
+
+
+def refresh_in_background():
+    """
+    Starts a refresh of the stale figures in a background thread, unless one
+    is already running in this worker. The page that noticed the stale figures
+    is served immediately with the previous values.
+    """
+    if not _refresh_lock.acquire(blocking=False):
+        return False
+    app = current_app._get_current_object()
+
+    def run():
+        try:
+            with app.app_context():
+                with db.get_pool().connection() as conn:
+                    refresh_statistics(conn)
+        except Exception:
+            logger.exception('Dashboard statistics refresh failed')
+        finally:
+            _refresh_lock.release()
+
+    threading.Thread(target=run, name='stats-refresh', daemon=True).start()
+    return True
+
+
+@click.group('stats')
+def stats_cli():
+    """Dashboard statistics rollup."""
+
+
+@stats_cli.command('refresh')
+@click.option('--force', is_flag=True, help='Recompute every figure, not only the stale ones.')
+def refresh_command(force):
+    """Recompute the stale dashboard figures (for cron)."""
+    with db.get_pool().connection() as conn:
+        refreshed = refresh_statistics(conn, force=force)
+    click.echo(f'{refreshed} statistique(s) recalculée(s)')
+
+
+def init_app(app):
+    """Register the statistics CLI commands with the Flask app."""
+    app.cli.add_command(stats_cli)
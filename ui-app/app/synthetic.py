@@ -0,0 +1,269 @@
+import datetime
+import math
+import random
+
+# Deterministic synthetic dataset for benchmarks: the same seed and size
+# always produce the same rows. Ids are assigned here (after the highest
+# existing one) so the histories can reference their buildings, and every
+# table is loaded with COPY.
+
+# Historic cities: name, latitude, longitude, spread of the buildings (degrees)
+CITIES = [
+    ('Fès', 34.0645, -4.9736, 0.03), ('Marrakech', 31.6295, -7.9811, 0.04),
+    ('Rabat', 34.0209, -6.8416, 0.03), ('Casablanca', 33.5731, -7.5898, 0.06),
+    ('Meknès', 33.8935, -5.5473, 0.03), ('Tétouan', 35.5785, -5.3684, 0.02),
+    ('Tanger', 35.7595, -5.8340, 0.03), ('Essaouira', 31.5085, -9.7595, 0.015),
+    ('Chefchaouen', 35.1688, -5.2636, 0.01), ('Ouarzazate', 30.9335, -6.9370, 0.03),
+    ('Taroudant', 30.4703, -8.8770, 0.015), ('Safi', 32.2994, -9.2372, 0.02),
+    ('El Jadida', 33.2316, -8.5007, 0.02), ('Skoura', 31.0600, -6.5600, 0.03),
+    ('Salé', 34.0531, -6.7985, 0.02), ('Azemmour', 33.2876, -8.3420, 0.01),
+]
+QUARTERS = ['Médina', 'Mellah', 'Kasbah', 'Ville Nouvelle', 'Habous', 'Quartier Andalou',
+            'Derb Sultan', 'Gueliz', 'Bab Doukkala', 'Palmeraie', 'Quartier des Tanneurs',
+            'Hay Mohammadi', 'Quartier Administratif', 'Oasis']
+ZONE_TYPES = ['Secteur Sauvegardé', 'Quartier Historique', 'Architecture XXème', 'Zone Oasienne']
+BUILDING_TYPES = [
+    ('Medersa (École Coranique)', 'Medersa'), ('Riad / Dar', 'Riad'),
+    ('Immeuble Art Déco', 'Immeuble'), ('Kasbah (Architecture de terre)', 'Kasbah'),
+    ('Mosquée', 'Mosquée'), ('Fondouk', 'Fondouk'), ('Hammam', 'Hammam'),
+    ('Palais', 'Palais'), ('Borj / Fortification', 'Borj'), ('Ksar', 'Ksar'),
+    ('Zaouïa', 'Zaouïa'), ('Villa coloniale', 'Villa'),
+]
+# Niveau, weight
+PROTECTIONS = [('Patrimoine Mondial UNESCO', 1), ('Classé Monument National (Dahir)', 3),
+               ('Inventaire Régional', 8), ('En cours de classement', 4), ('Non protégé', 12)]
+FAMILIES = ['Bennani', 'El Fassi', 'Tazi', 'Berrada', 'Alaoui', 'Idrissi', 'Kettani', 'Sqalli',
+            'Lahlou', 'Benjelloun', 'Chraibi', 'El Glaoui', 'Guessous', 'Sefrioui', 'Bennis',
+            'Lamrani', 'Ouazzani', 'Skalli', 'Benkirane', 'Mernissi', 'Filali', 'Zniber']
+PUBLIC_OWNERS = ['Ministère des Habous et Affaires Islamiques', 'Ministère de la Culture',
+                 'Fondation Nationale des Musées', 'Commune', 'Wilaya', 'Agence de Développement']
+CONTRACTOR_ROLES = ["Artisanat d'Art", 'Spécialiste Pisé/Terre', "Bureau d'Études", 'Gros Oeuvre',
+                    'Architecte', 'Menuiserie traditionnelle']
+STATES = ['Bon', 'Moyen', 'Dégradé', 'En ruine']
+# Next state of a building between two inspections: stable, worse or better
+STATE_CHANGE = {'Bon': (0.80, 0.18, 0.02), 'Moyen': (0.70, 0.20, 0.10),
+                'Dégradé': (0.65, 0.15, 0.20), 'En ruine': (0.85, 0.0, 0.15)}
+OBSERVATIONS = {
+    'Bon': ["Structure saine, enduits en bon état.", "Zelliges et plâtres sculptés bien conservés.",
+            "Toiture étanche, aucune infiltration constatée."],
+    'Moyen': ["Fissures superficielles sur les façades.", "Infiltrations ponctuelles en terrasse.",
+              "Boiseries de cèdre à traiter contre les insectes."],
+    'Dégradé': ["Fissures structurelles sur les murs porteurs.", "Effondrement partiel des enduits.",
+                "Remontées capillaires importantes, pisé fragilisé."],
+    'En ruine': ["Effondrement de la toiture et des planchers.", "Murs en pisé éventrés, risque majeur.",
+                 "Bâtiment inaccessible, étaiement d'urgence nécessaire."],
+}
+WORKS = [('Restauration zelliges', 40000), ('Réfection toiture', 120000), ('Consolidation pisé', 250000),
+         ('Traitement humidité', 60000), ('Reprise en sous-œuvre', 400000), ('Restauration boiseries', 80000),
+         ('Mise en sécurité', 30000), ('Ravalement façade', 90000)]
+DOCUMENT_TYPES = ['Photo', 'Plan', 'Rapport PDF', 'Relevé']
+
+# Inspections and interventions are dated up to this day (fixed, for determinism)
+LAST_DAY = datetime.date(2025, 12, 31)
+
+
+class Dataset:
+    """Sizes and first ids of a synthetic dataset of `buildings` buildings."""
+
+    def __init__(self, buildings, seed, first_ids):
+        self.buildings = buildings
+        self.seed = seed
+        self.zones = max(8, buildings // 400)
+        self.owners = max(20, buildings // 200)
+        self.contractors = max(10, buildings // 1000)
+        self.first = first_ids
+
+    def rng(self, *key):
+        return random.Random(f'{self.seed}:' + ':'.join(map(str, key)))
+
+    def ids(self, table, count):
+        return range(self.first[table], self.first[table] + count)
+
+    def zone_rows(self):
+        rng = self.rng('zones')
+        for n, id_zone in enumerate(self.ids('zone', self.zones)):
+            city = CITIES[n % len(CITIES)][0]
+            quarter = QUARTERS[(n // len(CITIES)) % len(QUARTERS)]
+            number = n // (len(CITIES) * len(QUARTERS))
+            name = f'{quarter} de {city}' + (f' {number + 1}' if number else '')
+            yield id_zone, name, rng.choice(ZONE_TYPES)
+
+    def type_rows(self):
+        for id_type, (label, _) in zip(self.ids('type', len(BUILDING_TYPES)), BUILDING_TYPES):
+            yield id_type, label
+
+    def protection_rows(self):
+        for id_protection, (level, _) in zip(self.ids('protection', len(PROTECTIONS)), PROTECTIONS):
+            yield id_protection, level
+
+    def owner_rows(self):
+        rng = self.rng('owners')
+        for n, id_proprio in enumerate(self.ids('proprio', self.owners)):
+            if n % 5 == 0:
+                owner = PUBLIC_OWNERS[(n // 5) % len(PUBLIC_OWNERS)]
+                city = CITIES[(n // 5) % len(CITIES)][0]
+                yield id_proprio, f'{owner} ({city})', 'Public', f'patrimoine{n}@gov.ma'
+            else:
+                family = rng.choice(FAMILIES)
+                kind = rng.choice(['Héritiers Famille', 'Famille', 'Société Immobilière'])
+                yield id_proprio, f'{kind} {family} {n}', 'Privé', f'+212 6 {rng.randrange(10**8):08d}'
+
+    def contractor_rows(self):
+        rng = self.rng('contractors')
+        for n, id_prestataire in enumerate(self.ids('prestataire', self.contractors)):
+            role = CONTRACTOR_ROLES[n % len(CONTRACTOR_ROLES)]
+            yield id_prestataire, f'Ent. {rng.choice(FAMILIES)} {role} {n}', role
+
+    def building(self, code):
+        """Row of building `code`."""
+        rng = self.rng('b', code)
+        n = code - self.first['batiment']
+        # Zones get uneven sizes, as real quarters do
+        zone = int(self.zones * rng.random() ** 1.5)
+        city, lat, lng, spread = CITIES[zone % len(CITIES)]
+        type_index = rng.randrange(len(BUILDING_TYPES))
+        label, prefix = BUILDING_TYPES[type_index]
+        year = int(1950 - 700 * rng.random() ** 2)
+        protection = rng.choices(range(len(PROTECTIONS)), [w for _, w in PROTECTIONS])[0]
+        family = rng.choice(FAMILIES)
+        quarter = QUARTERS[(zone // len(CITIES)) % len(QUARTERS)]
+        note = (f"{prefix} construit vers {year}, {quarter} de {city}. "
+                f"{rng.choice(['Décor de zelliges', 'Plafonds en cèdre sculpté', 'Façade en pisé', 'Patio à arcades'])} "
+                f"{rng.choice(['remarquable', 'typique de son époque', 'partiellement remanié'])}.")
+        return (code, f'{prefix} {family} {n}', f'{rng.randrange(1, 200)} Derb {family}, {city}',
+               round(lat + rng.gauss(0, spread), 6), round(lng + rng.gauss(0, spread), 6),
+               datetime.date(year, rng.randrange(1, 13), 1), note,
+               self.first['zone'] + zone, self.first['type'] + type_index,
+               self.first['protection'] + protection, self.first['proprio'] + rng.randrange(self.owners))
+
+    def history(self, code):
+        """Inspections, interventions and documents of building `code`, without ids."""
+        rng = self.rng('h', code)
+        inspections, interventions, documents = [], [], []
+        count = min(int(rng.expovariate(1 / 3)), 12)
+        day = LAST_DAY - datetime.timedelta(days=rng.randrange(365 * 20))
+        state = rng.choices(STATES, (5, 4, 2, 1))[0]
+        for _ in range(count):
+            stable, worse, better = STATE_CHANGE[state]
+            change = rng.choices((0, 1, -1), (stable, worse, better))[0]
+            state = STATES[min(max(STATES.index(state) + change, 0), len(STATES) - 1)]
+            inspections.append((day, ' '.join(rng.sample(OBSERVATIONS[state], 2)), state, code))
+            # Degraded buildings get works after the visit
+            if state in ('Dégradé', 'En ruine') or rng.random() < 0.1:
+                work, cost = rng.choice(WORKS)
+                start = day + datetime.timedelta(days=rng.randrange(30, 240))
+                if start <= LAST_DAY:
+                    duration = datetime.timedelta(days=rng.randrange(30, 500))
+                    if start + duration <= LAST_DAY:
+                        status, end = 'Terminé', start + duration
+                    else:
+                        status, end = 'En cours', None
+                    if rng.random() < 0.05:
+                        status, end = 'Annulé', None
+                    interventions.append((start, end, work,
+                                          round(cost * math.exp(rng.gauss(0, 0.5)), 2),
+                                          status == 'Terminé' and rng.random() < 0.8, status, code,
+                                          self.first['prestataire'] + rng.randrange(self.contractors)))
+            day += datetime.timedelta(days=rng.randrange(90, 1500))
+            if day > LAST_DAY:
+                break
+        if rng.random() < 0.15:
+            interventions.append((None, None, rng.choice(WORKS)[0], None, False, 'Planifié', code,
+                                  self.first['prestataire'] + rng.randrange(self.contractors)))
+        for n in range(min(int(rng.expovariate(1 / 1.2)), 6)):
+            kind = rng.choice(DOCUMENT_TYPES)
+            documents.append((f'{kind} {n + 1}', kind, f'/docs/{code}/{kind.lower().replace(" ", "_")}_{n + 1}', code))
+        return inspections, interventions, documents
+
+    def building_codes(self):
+        return self.ids('batiment', self.buildings)
+
+
+# key -> (table, primary key); reference tables and buildings get explicit ids
+TABLES = {
+    'zone': ('ZONE_URBAINE', 'id_zone'),
+    'type': ('TYPE_BATIMENT', 'id_type'),
+    'protection': ('NIV_PROTECTION', 'id_protection'),
+    'proprio': ('PROPRIETAIRE', 'id_proprio'),
+    'prestataire': ('PRESTATAIRE', 'id_prestataire'),
+    'batiment': ('BATIMENT', 'code_batiment'),
+}
+
+# Tables derived from the data by the MPD/update_*.sql triggers, emptied with it.
+# Emptying CARTE_TUILE_LECTEUR makes every tile cache clear itself.
+DERIVED_TABLES = ['BATIMENT_ETAT_COURANT', 'CARTE_GRAPPE', 'CARTE_GRAPPE_MEMBRE', 'CARTE_TUILE_PERIMEE',
+                  'CARTE_TUILE_LECTEUR']
+
+
+def _copy(cur, target, rows):
+    count = 0
+    with cur.copy(f'COPY {target} FROM STDIN') as copy:
+        for row in rows:
+            copy.write_row(row)
+            count += 1
+    return count
+
+
+def _exists(cur, name):
+    cur.execute('SELECT to_regclass(%s) IS NOT NULL', (name,))
+    return cur.fetchone()[0]
+
+
+def reset(conn):
+    """Deletes every building, history and reference row (and their derived tables)."""
+    with conn.cursor() as cur:
+        tables = ['DOCUMENT_MEDIA', 'INTERVENTION', 'INSPECTION', 'BATIMENT'] + \
+                 [table for table, _ in TABLES.values() if table != 'BATIMENT'] + \
+                 [table for table in DERIVED_TABLES if _exists(cur, table)]
+        cur.execute(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY CASCADE")
+    conn.commit()
+
+
+def load(conn, buildings, seed, progress=lambda table, count: None):
+    """
+    Adds a synthetic dataset of `buildings` buildings with their reference
+    data, inspections, interventions and documents. On an empty database
+    the same seed always gives the same rows.
+    """
+    with conn.cursor() as cur:
+        first = {}
+        for key, (table, column) in TABLES.items():
+            cur.execute(f'SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}')
+            first[key] = cur.fetchone()[0]
+        data = Dataset(buildings, seed, first)
+
+        progress('ZONE_URBAINE', _copy(cur, 'ZONE_URBAINE (id_zone, nom_zone, type_zone)', data.zone_rows()))
+        progress('TYPE_BATIMENT', _copy(cur, 'TYPE_BATIMENT (id_type, libelle_type)', data.type_rows()))
+        progress('NIV_PROTECTION', _copy(cur, 'NIV_PROTECTION (id_protection, niveau)', data.protection_rows()))
+        progress('PROPRIETAIRE', _copy(cur, 'PROPRIETAIRE (id_proprio, nom_complet, type_proprio, contact)',
+                                       data.owner_rows()))
+        progress('PRESTATAIRE', _copy(cur, 'PRESTATAIRE (id_prestataire, nom_entreprise, role_prest)',
+                                      data.contractor_rows()))
+
+        columns = ('code_batiment, nom_batiment, adresse_rue, latitude, longitude, date_construction, '
+                   'note_historique, id_zone, id_type, id_protection, id_proprio')
+        cur.execute("""SELECT EXISTS (SELECT 1 FROM information_schema.columns
+                                      WHERE table_name = 'batiment' AND column_name = 'geom')""")
+        if cur.fetchone()[0]:
+            # Extended WKT, so the geometry is set by COPY itself
+            rows = (row + (f'SRID=4326;POINT({row[4]} {row[3]})',)
+                    for row in map(data.building, data.building_codes()))
+            columns += ', geom'
+        else:
+            rows = map(data.building, data.building_codes())
+        progress('BATIMENT', _copy(cur, f'BATIMENT ({columns})', rows))
+
+        # The histories are generated again for each table, rather than kept in memory
+        codes = data.building_codes
+        progress('INSPECTION', _copy(cur, 'INSPECTION (date_visite, rapport, etat_constate, code_batiment)',
+                                     (row for code in codes() for row in data.history(code)[0])))
+        progress('INTERVENTION', _copy(cur, 'INTERVENTION (date_debut, date_fin, type_travaux, cout_estime, '
+                                            'est_validee, statut_travaux, code_batiment, id_prestataire)',
+                                       (row for code in codes() for row in data.history(code)[1])))
+        progress('DOCUMENT_MEDIA', _copy(cur, 'DOCUMENT_MEDIA (titre_doc, type_doc, url_fichier, code_batiment)',
+                                         (row for code in codes() for row in data.history(code)[2])))
+
+        for table, column in TABLES.values():
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), MAX({column})) "
+                        f"FROM {table}")
+    conn.commit()
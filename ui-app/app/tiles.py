@@ -0,0 +1,244 @@
+import fcntl
+import logging
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+MAX_ZOOM = 22
+
+# Last time this worker consumed the invalidation log
+_last_sync = 0.0
+_sync_lock = threading.Lock()
+
+# Position of a tile cache in the log: the transactions below its horizon
+# have been read. Locked for the read, so the workers of a host take turns.
+READER_QUERY = 'SELECT horizon FROM CARTE_TUILE_LECTEUR WHERE id_lecteur = %s FOR UPDATE'
+
+# Every transaction below it has ended: its log entries are all visible
+HORIZON_QUERY = 'SELECT pg_snapshot_xmin(pg_current_snapshot())'
+
+INVALIDATIONS_QUERY = '''
+    SELECT ST_X(geom), ST_Y(geom)
+    FROM CARTE_TUILE_PERIMEE
+    WHERE id_transaction >= %s AND id_transaction < %s
+'''
+
+# Drops the readers gone for TILE_INVALIDATION_READER_TTL seconds (their
+# cache is cleared if they come back), then the entries every reader has read
+PURGE_QUERY = '''
+    WITH partis AS (
+        DELETE FROM CARTE_TUILE_LECTEUR
+        WHERE vu_le < now() - make_interval(secs => %s)
+        RETURNING id_lecteur
+    )
+    DELETE FROM CARTE_TUILE_PERIMEE
+    WHERE id_transaction < COALESCE(
+        (SELECT min(horizon) FROM CARTE_TUILE_LECTEUR
+         WHERE id_lecteur NOT IN (SELECT id_lecteur FROM partis)),
+        pg_snapshot_xmin(pg_current_snapshot()))
+'''
+
+
+def tile_in_range(z, x, y):
+    """Whether z/x/y is a valid tile of the web-mercator pyramid."""
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def mercator_position(lng, lat, n):
+    """Fractional column and row of a point on a web-mercator grid of n x n cells."""
+    lat = max(min(lat, 85.0511), -85.0511)
+    fx = (lng + 180.0) / 360.0 * n
+    fy = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return fx, fy
+
+
+def tiles_at(lng, lat, z):
+    """
+    The tiles of zoom z containing the point. A point lying on a tile
+    border belongs to all the tiles it touches.
+    """
+    n = 2 ** z
+    fx, fy = mercator_position(lng, lat, n)
+    xs = {min(max(int(fx), 0), n - 1)}
+    ys = {min(max(int(fy), 0), n - 1)}
+    if fx == int(fx) and int(fx) > 0:
+        xs.add(int(fx) - 1)
+    if fy == int(fy) and int(fy) > 0:
+        ys.add(int(fy) - 1)
+    return {(x, y) for x in xs for y in ys}
+
+
+class TileCache:
+    """
+    Rendered tiles stored as <directory>/<layer>/<z>/<x>/<y>.pbf, shared by
+    all the workers of the host.
+
+    Writers and invalidations are serialized by a file lock, and every
+    invalidation bumps a generation counter. A tile rendered before an
+    invalidation (whose database snapshot may predate the change) is only
+    stored if the generation did not move meanwhile.
+    """
+
+    def __init__(self, directory, layer):
+        self.root = os.path.join(directory, layer)
+        os.makedirs(self.root, exist_ok=True)
+        self._lock_path = os.path.join(directory, f'.{layer}.lock')
+        self._generation_path = os.path.join(directory, f'.{layer}.generation')
+        self._reader_path = os.path.join(directory, f'.{layer}.reader')
+
+    def path(self, z, x, y):
+        return os.path.join(self.root, str(z), str(x), f'{y}.pbf')
+
+    def get(self, z, x, y):
+        try:
+            with open(self.path(z, x, y), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def generation(self):
+        try:
+            with open(self._generation_path) as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _bump_generation(self):
+        self._write_atomic(self._generation_path, str(self.generation() + 1).encode())
+
+    def _write_atomic(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def reader(self):
+        """Id of this cache in CARTE_TUILE_LECTEUR, created with the cache directory."""
+        try:
+            with open(self._reader_path) as f:
+                reader = f.read().strip()
+            if reader:
+                return reader
+        except FileNotFoundError:
+            pass
+        with self._locked():
+            if not os.path.exists(self._reader_path):
+                self._write_atomic(self._reader_path, uuid.uuid4().hex.encode())
+            with open(self._reader_path) as f:
+                return f.read().strip()
+
+    def put(self, z, x, y, data, generation):
+        """Stores a tile rendered at the given generation. Returns False if it is already stale."""
+        with self._locked():
+            if self.generation() != generation:
+                return False
+            self._write_atomic(self.path(z, x, y), data)
+            return True
+
+    def invalidate(self, points):
+        """Deletes the cached tiles containing any of the (lng, lat) points, at every zoom."""
+        with self._locked():
+            removed = 0
+            for lng, lat in points:
+                for z in range(MAX_ZOOM + 1):
+                    for x, y in tiles_at(lng, lat, z):
+                        try:
+                            os.unlink(self.path(z, x, y))
+                            removed += 1
+                        except FileNotFoundError:
+                            pass
+            self._bump_generation()
+        return removed
+
+    def clear(self):
+        """Deletes every cached tile of the layer."""
+        with self._locked():
+            for entry in os.listdir(self.root):
+                shutil.rmtree(os.path.join(self.root, entry), ignore_errors=True)
+            self._bump_generation()
+
+
+def get_tile_cache(layer):
+    """The tile cache of a layer, under TILE_CACHE_DIR (default: the instance folder)."""
+    directory = current_app.config['TILE_CACHE_DIR'] or os.path.join(current_app.instance_path, 'tiles')
+    return TileCache(directory, layer)
+
+
+def sync_invalidations(conn, cache):
+    """
+    Reads the CARTE_TUILE_PERIMEE entries this cache has not read yet and
+    deletes the tiles they name, at most once every
+    TILE_INVALIDATION_INTERVAL seconds per worker.
+
+    The cache lives on the disk of its host, so each cache directory reads
+    the log from its own position (CARTE_TUILE_LECTEUR), and entries are
+    only purged once every cache has read them. Positions are transaction
+    ids rather than row ids: the entries of a transaction are read once no
+    older transaction is still running, so none is skipped because it
+    committed after a newer one. A cache without a position (new, or gone
+    longer than TILE_INVALIDATION_READER_TTL) is cleared.
+    Files are deleted before the new position is committed, so a crash in
+    between only costs a few extra renders.
+    """
+    global _last_sync
+    config = current_app.config
+    if time.monotonic() - _last_sync < config['TILE_INVALIDATION_INTERVAL'] or \
+            not _sync_lock.acquire(blocking=False):
+        return
+    try:
+        reader = cache.reader()
+        with conn.cursor() as cur:
+            cur.execute(READER_QUERY, (reader,))
+            row = cur.fetchone()
+            cur.execute(HORIZON_QUERY)
+            horizon = cur.fetchone()[0]
+            if row is None:
+                cache.clear()
+                logger.info('Tile cache cleared: no position in the invalidation log')
+                cur.execute('INSERT INTO CARTE_TUILE_LECTEUR (id_lecteur, horizon) VALUES (%s, %s) '
+                            'ON CONFLICT (id_lecteur) DO NOTHING', (reader, horizon))
+            else:
+                cur.execute(INVALIDATIONS_QUERY, (row[0], horizon))
+                rows = cur.fetchall()
+                if rows:
+                    if len(rows) > config['TILE_INVALIDATION_MAX_POINTS'] or \
+                            any(lng is None for lng, lat in rows):
+                        cache.clear()
+                        logger.info('Tile cache cleared')
+                    else:
+                        removed = cache.invalidate(set(rows))
+                        logger.info('%d cached tile(s) invalidated for %d position(s)', removed, len(rows))
+                cur.execute('UPDATE CARTE_TUILE_LECTEUR SET horizon = %s, vu_le = now() '
+                            'WHERE id_lecteur = %s', (horizon, reader))
+            cur.execute(PURGE_QUERY, (config['TILE_INVALIDATION_READER_TTL'],))
+        conn.commit()
+        _last_sync = time.monotonic()
+    finally:
+        _sync_lock.release()
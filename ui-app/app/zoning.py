@@ -0,0 +1,149 @@
+import json
+import time
+
+import click
+
+from . import db
+from .importer import ImportFileError, read_features
+from .refdata import invalidate
+
+# GeoJSON geometries accepted as zone contours
+CONTOUR_TYPES = ('Polygon', 'MultiPolygon')
+
+# GeoJSON geometry -> MULTIPOLYGON 4326, repaired if self-intersecting
+CONTOUR_SQL = 'ST_Multi(ST_CollectionExtract(ST_MakeValid(ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326)), 3))'
+
+
+class ContourReport:
+    """Outcome of a contour import."""
+
+    def __init__(self, updated, created, moved):
+        self.updated = updated
+        self.created = created
+        # Buildings re-assigned to another zone (None: not re-assigned)
+        self.moved = moved
+
+
+def read_contours(stream, name_property='nom_zone', type_property='type_zone'):
+    """
+    (name, zone type, GeoJSON geometry text) of every feature of a
+    FeatureCollection in WGS84. Features without a name or a polygon
+    raise ImportFileError: nothing is imported from such a file.
+    """
+    contours = []
+    for number, properties, geometry in read_features(stream):
+        name = str(properties.get(name_property) or '').strip()
+        if not name:
+            raise ImportFileError(f'Objet {number}: propriété "{name_property}" manquante')
+        if geometry.get('type') not in CONTOUR_TYPES:
+            raise ImportFileError(f'Objet {number} ({name}): Polygon ou MultiPolygon attendu')
+        zone_type = str(properties.get(type_property) or '').strip() or None
+        contours.append((name[:100], zone_type, json.dumps(geometry)))
+    return contours
+
+
+def assign_buildings(conn, zones=None):
+    """
+    Re-assigns to their zone the buildings inside the contours (of `zones`
+    only, if given) in one set-based UPDATE. Returns how many moved.
+    The caller commits.
+    """
+    with conn.cursor() as cur:
+        cur.execute('SELECT affecter_zones(%s::int[])', (list(zones) if zones else None,))
+        return cur.fetchone()[0]
+
+
+def import_contours(conn, contours, assign=True):
+    """
+    Sets the contour of the zones named in `contours`, creating the missing
+    ones, then re-assigns the buildings inside them, in one transaction.
+    A zone is matched on its exact name.
+    """
+    updated = created = 0
+    zones = []
+    try:
+        with conn.cursor() as cur:
+            for name, zone_type, geometry in contours:
+                cur.execute(f'''
+                    UPDATE ZONE_URBAINE SET contour = {CONTOUR_SQL}, type_zone = COALESCE(%s, type_zone)
+                    WHERE nom_zone = %s
+                    RETURNING id_zone
+                ''', (geometry, zone_type, name))
+                ids = [row[0] for row in cur.fetchall()]
+                if ids:
+                    updated += len(ids)
+                else:
+                    cur.execute(f'''
+                        INSERT INTO ZONE_URBAINE (nom_zone, type_zone, contour)
+                        VALUES (%s, %s, {CONTOUR_SQL})
+                        RETURNING id_zone
+                    ''', (name, zone_type, geometry))
+                    ids = [cur.fetchone()[0]]
+                    created += 1
+                zones.extend(ids)
+        moved = assign_buildings(conn, zones) if assign and zones else None
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    invalidate('ZONE_URBAINE')
+    if moved:
+        invalidate('BATIMENT')
+    return ContourReport(updated, created, moved)
+
+
+@click.group('zones')
+def zones_cli():
+    """Zone contours and spatial assignment of the buildings."""
+
+
+@zones_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--name-property', default='nom_zone', show_default=True,
+              help='Feature property holding the zone name.')
+@click.option('--type-property', default='type_zone', show_default=True,
+              help='Feature property holding the zone type.')
+@click.option('--assign/--no-assign', default=True,
+              help='Re-assign the buildings inside the imported contours.')
+def import_command(path, name_property, type_property, assign):
+    """Load zone contours from a GeoJSON FeatureCollection (WGS84)."""
+    with open(path, encoding='utf-8-sig') as stream:
+        try:
+            contours = read_contours(stream, name_property, type_property)
+        except ImportFileError as e:
+            raise click.ClickException(str(e))
+    report = import_contours(db.get_db(), contours, assign=assign)
+    click.echo(f'{report.updated} zone(s) mise(s) à jour, {report.created} créée(s)')
+    if report.moved is not None:
+        click.echo(f'{report.moved} bâtiment(s) rattaché(s) à une autre zone')
+
+
+@zones_cli.command('assign')
+@click.option('--zone', 'zones', type=int, multiple=True,
+              help='Only the buildings inside this zone (repeatable).')
+@click.option('--dry-run', is_flag=True, help='Count the buildings that would move, change nothing.')
+def assign_command(zones, dry_run):
+    """Re-assign the buildings to the zone whose contour contains them."""
+    conn = db.get_db()
+    start = time.perf_counter()
+    try:
+        moved = assign_buildings(conn, zones)
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    elapsed = time.perf_counter() - start
+    if dry_run:
+        click.echo(f'{moved} bâtiment(s) changeraient de zone ({elapsed:.1f} s)')
+    else:
+        if moved:
+            invalidate('BATIMENT')
+        click.echo(f'{moved} bâtiment(s) rattaché(s) à une autre zone ({elapsed:.1f} s)')
+
+
+def init_app(app):
+    """Register the zone CLI commands with the Flask app."""
+    app.cli.add_command(zones_cli)
@@ -0,0 +1,34 @@
+# Gunicorn settings picked up automatically by `gunicorn run:app` (see Procfile).
+# The database pool is opened lazily in each worker, after the fork.
+import os
+import shutil
+import tempfile
+
+# Prometheus metrics of the workers are kept in files under this directory
+# and added up by /metrics. Set before the app (and prometheus_client) is
+# imported in the workers.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(
+    tempfile.gettempdir(), f"heritage-metrics-{os.environ.get('PORT', 5000)}"))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+
+def worker_exit(server, worker):
+    """Close the worker's database pool so connections are released cleanly."""
+    from app import db
+    db.close_pool()
+
+
+def on_starting(server):
+    """Start the metrics from zero: remove the files of a previous run."""
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Drop the live gauges (pool sizes) of a worker that exited."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)